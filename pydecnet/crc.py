@@ -33,7 +33,11 @@ THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
 OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 This defines a general mechanism to compute CRCs for any polynomial, using
-the well known 256 entry lookup table technique.
+the well known 256 entry lookup table technique.  For CRCs between 9
+and 64 bits wide, the data is processed a word at a time ("slicing by
+N") using a set of tables, one per byte of the word.  CRCs that the
+Python standard library implements (CRC32 and the CCITT CRC-16) are
+handed off to the library instead.
 
 Credit for some of the details goes to Ross Williams; refer to his
 document "A Painless Guide to CRC Error Detection Algorithms" at
@@ -41,7 +45,20 @@ https://web.archive.org/web/20190620155540/http://www.ross.net/crc/download/crc_
 for more details.
 """
 
+import array
+import binascii
 import collections.abc
+import sys
+import zlib
+
+# Data types that the word-at-a-time and library code paths handle.
+# Anything else (for example a list of byte values) goes through the
+# basic byte at a time loop.
+_buffers = (bytes, bytearray, memoryview)
+
+# Buffers shorter than this are done a byte at a time; for those the
+# setup cost of the sliced method is more than what it saves.
+SLICEMIN = 16
 
 def _reverse (value, width):
     ret = 0
@@ -70,6 +87,49 @@ def _maketable (poly, width, reflect):
         ret.append (i)
     return ret
 
+def _slicetables (table, width, reflect, n):
+    """Return the tables used to process n bytes at a time.  These are
+    in the order of the byte position in the data word, starting with
+    the least significant byte.  The table for a byte is the CRC
+    register resulting from that byte followed by as many zero bytes
+    as the word has after it, starting from a zero register.
+    """
+    mask = (1 << width) - 1
+    sh = width - 8
+    ret = [ table ]
+    for k in range (1, n):
+        # Advance each entry of the previous table by one zero byte.
+        prev = ret[-1]
+        if reflect:
+            ret.append ([ table[v & 0xff] ^ (v >> 8) for v in prev ])
+        else:
+            ret.append ([ table[v >> sh] ^ ((v << 8) & mask) for v in prev ])
+    if reflect:
+        # The first byte of the data is the least significant byte
+        # of a little endian word, and it is followed by n - 1 bytes.
+        ret.reverse ()
+    if n == 2:
+        # For two byte words, merge the two tables into a single one
+        # indexed by the whole word.
+        lo, hi = ret
+        return [ [ h ^ l for h in hi for l in lo ] ]
+    return ret
+
+def _gf2_times (mat, vec):
+    # Multiply a GF(2) matrix, given as a list of its columns, by a
+    # vector.
+    ret = 0
+    i = 0
+    while vec:
+        if vec & 1:
+            ret ^= mat[i]
+        vec >>= 1
+        i += 1
+    return ret
+
+def _gf2_square (mat):
+    return [ _gf2_times (mat, c) for c in mat ]
+
 class _CRCMeta (type):
     """Metaclass for CRC.  
     """
@@ -115,14 +175,44 @@ class _CRCMeta (type):
         doc = nc.update.__doc__
         if reversed:
             if width <= 8:
-                nc.update = nc._update_short_reversed
+                nc._update_bytes = nc._update_short_reversed
             else:
-                nc.update = nc._update_reversed
+                nc._update_bytes = nc._update_reversed
         else:
             if width <= 8:
-                nc.update = nc._update_short_forward
+                nc._update_bytes = nc._update_short_forward
+            else:
+                nc._update_bytes = nc._update_forward
+        if width == 32 and poly == 0x04c11db7 and reversed:
+            # This is the Ethernet CRC, which zlib does for us.  Note
+            # that the initial and final values don't matter, since
+            # the library routine works on the register value.
+            nc.update = nc._update_crc32
+        elif width == 16 and poly == 0x1021 and not reversed:
+            # CCITT CRC-16 as done in binascii
+            nc.update = nc._update_hqx
+        elif 8 < width <= 64:
+            # Slice by the smallest word size that holds the CRC
+            for n in 2, 4, 8:
+                if width <= n * 8:
+                    break
+            for code in array.typecodes:
+                if code.isupper () and array.array (code).itemsize == n:
+                    break
+            nc.slicecode = code
+            # Reversed CRCs take the data as little endian words,
+            # forward ones as big endian words.
+            nc.sliceswap = (sys.byteorder == "little") != reversed
+            # In forward mode the CRC register lines up with the top
+            # of the data word.
+            if reversed:
+                nc.sliceshift = 0
             else:
-                nc.update = nc._update_forward
+                nc.sliceshift = n * 8 - width
+            nc.slicetables = _slicetables (nc.crctable, width, reversed, n)
+            nc.update = getattr (nc, "_update_slice{}".format (n))
+        else:
+            nc.update = nc._update_bytes
         nc.update.__doc__ = doc
         # Make an instance of that so we can find the "good CRC" check
         # value.
@@ -135,6 +225,16 @@ class _CRCMeta (type):
         if check != c2.value:
             raise RuntimeError ("Unable to find good CRC check value")
         nc.goodvalue = check
+        # Find the operator that advances the CRC register across a
+        # zero byte.  This is a linear function, so it is given by the
+        # values for each of the bits in the register.  "combine"
+        # uses it.
+        zero = list ()
+        for i in range (width):
+            c1._value = 1 << i
+            c1._update_bytes (b"\x00")
+            zero.append (c1._value)
+        nc.zerobyte = zero
         return nc
 
     def __init__ (cls, *args, **kwds):
@@ -206,6 +306,30 @@ class CRC (metaclass = _CRCMeta):
         """
         return self.value == self.goodvalue
 
+    @classmethod
+    def combine (cls, crc1, crc2, len2):
+        """Return the CRC of the concatenation of two buffers, given
+        the CRC values (as in "value") of the first and second buffer
+        and the length in bytes of the second.  This is useful to find
+        the CRC of data that was processed in pieces, possibly in
+        parallel, without going over it again.
+        """
+        # The register after the concatenation is the register after
+        # the second buffer, adjusted for the difference between the
+        # register at the end of the first buffer and the initial
+        # value, carried across len2 zero bytes.  That last step is
+        # done by repeated squaring of the zero byte operator, as in
+        # zlib's crc32_combine.
+        v = crc1 ^ cls.final ^ cls.initial
+        op = cls.zerobyte
+        while v and len2:
+            if len2 & 1:
+                v = _gf2_times (op, v)
+            len2 >>= 1
+            if len2:
+                op = _gf2_square (op)
+        return crc2 ^ v
+
     def update_bits (self, data, bits):
         """Update the CRC state using the first "bits" bits in the
         supplied data.  This is like "update" if "bits" is a multiple
@@ -260,7 +384,89 @@ class CRC (metaclass = _CRCMeta):
         This will adjust "value" and "good" to reflect the new data.
         """
         # Will be replaced at subclass definition time by one of the
-        # four following methods.
+        # following methods.
+
+    # Update the CRC register using the standard library, for CRC32
+    # and CCITT CRC-16 respectively.
+    def _update_crc32 (self, data):
+        if isinstance (data, _buffers):
+            self._value = zlib.crc32 (data, self._value ^ 0xffffffff) \
+                          ^ 0xffffffff
+        else:
+            self._update_reversed (data)
+
+    def _update_hqx (self, data):
+        if isinstance (data, _buffers):
+            self._value = binascii.crc_hqx (data, self._value)
+        else:
+            self._update_forward (data)
+
+    # Update the CRC register from a sequence of 2, 4, or 8 byte
+    # words, followed by any leftover bytes.  The words are XORed
+    # with the CRC register, then each byte of the result picks out
+    # the CRC register contribution for that byte position from its
+    # table.
+    def _words (self, data, n):
+        ret = array.array (self.slicecode)
+        ret.frombytes (data[:n])
+        if self.sliceswap:
+            ret.byteswap ()
+        return ret
+
+    def _update_slice2 (self, data):
+        l = len (data)
+        if l < SLICEMIN or not isinstance (data, _buffers):
+            self._update_bytes (data)
+            return
+        n = l & ~1
+        c = self._value
+        sh = self.sliceshift
+        t0, = self.slicetables
+        if sh:
+            for x in self._words (data, n):
+                c = t0[x ^ (c << sh)]
+        else:
+            for x in self._words (data, n):
+                c = t0[x ^ c]
+        self._value = c
+        if n < l:
+            self._update_bytes (data[n:])
+
+    def _update_slice4 (self, data):
+        l = len (data)
+        if l < SLICEMIN or not isinstance (data, _buffers):
+            self._update_bytes (data)
+            return
+        n = l & ~3
+        c = self._value
+        sh = self.sliceshift
+        t0, t1, t2, t3 = self.slicetables
+        for x in self._words (data, n):
+            x ^= c << sh
+            c = t0[x & 0xff] ^ t1[(x >> 8) & 0xff] ^ \
+                t2[(x >> 16) & 0xff] ^ t3[x >> 24]
+        self._value = c
+        if n < l:
+            self._update_bytes (data[n:])
+
+    def _update_slice8 (self, data):
+        l = len (data)
+        if l < SLICEMIN or not isinstance (data, _buffers):
+            self._update_bytes (data)
+            return
+        n = l & ~7
+        c = self._value
+        sh = self.sliceshift
+        t0, t1, t2, t3, t4, t5, t6, t7 = self.slicetables
+        for x in self._words (data, n):
+            x ^= c << sh
+            c = t0[x & 0xff] ^ t1[(x >> 8) & 0xff] ^ \
+                t2[(x >> 16) & 0xff] ^ t3[(x >> 24) & 0xff] ^ \
+                t4[(x >> 32) & 0xff] ^ t5[(x >> 40) & 0xff] ^ \
+                t6[(x >> 48) & 0xff] ^ t7[x >> 56]
+        self._value = c
+        if n < l:
+            self._update_bytes (data[n:])
 
     # Update the CRC register from a sequence of bytes, for regular
     # and reversed bit order respectively.
@@ -40,6 +40,10 @@ class Adjacency (Element, timers.Timer):
         self.tiver = info.tiver
         self.macid = Macaddr (self.nodeid)
         self.priority = info.prio
+        # For LAN router adjacencies: the E-list last received from
+        # this neighbor, and whether we were listed in it.
+        self.elist = None
+        self.listed = False
 
     def __str__ (self):
         return "{0.nodeid}".format (self)
@@ -0,0 +1,114 @@
+#!
+
+"""Classic BPF (Berkeley Packet Filter) support for LAN datalinks.
+
+This compiles the receive filter of a broadcast datalink -- the same
+information that BcDatalink.filter encodes as a PCAP filter string --
+directly into a classic BPF program.  That program can then be
+attached to a Linux packet socket (SO_ATTACH_FILTER) or a TAP device
+(TUNATTACHFILTER) so that frames nobody asked for are discarded in
+the kernel rather than being passed to Python.
+"""
+
+import ctypes
+import struct
+
+from .common import *
+
+# Instruction classes and modes, from linux/filter.h
+BPF_LD = 0x00
+BPF_JMP = 0x05
+BPF_RET = 0x06
+BPF_W = 0x00
+BPF_H = 0x08
+BPF_B = 0x10
+BPF_ABS = 0x20
+BPF_JA = 0x00
+BPF_JEQ = 0x10
+BPF_K = 0x00
+
+LDW = BPF_LD | BPF_W | BPF_ABS
+LDH = BPF_LD | BPF_H | BPF_ABS
+LDB = BPF_LD | BPF_B | BPF_ABS
+JEQ = BPF_JMP | BPF_JEQ | BPF_K
+JA = BPF_JMP | BPF_JA
+RET = BPF_RET | BPF_K
+
+# Return value for an accepted frame: the number of bytes to keep,
+# i.e., all of it.
+ACCEPT = 0xffff
+
+# struct sock_filter
+sock_filter = struct.Struct ("=HBBI")
+
+# Socket option to attach a filter
+SO_ATTACH_FILTER = 26
+
+def clause (addr, protos):
+    """Return the instructions that accept a frame sent to "addr" with
+    one of the protocol types or SAPs in "protos".  If addr is None,
+    the destination address is not checked.  If the frame does not
+    match, control continues at the instruction after the clause.
+    """
+    types = sorted (int.from_bytes (p, "big") for p in protos
+                    if not isinstance (p, DLSAP))
+    saps = sorted (int (p) for p in protos if isinstance (p, DLSAP))
+    # Build the protocol part first.  Each match jumps forward to the
+    # accept instruction at the end, which is preceded by a jump over
+    # it for the no match case.
+    checks = list ()
+    for field, vals in ((LDH, 12), types), ((LDB, 14), saps):
+        if vals:
+            checks.append (field)
+            checks.extend ((JEQ, v) for v in vals)
+    ret = list ()
+    n = len (checks)
+    for i, (op, k) in enumerate (checks):
+        if op == JEQ:
+            # Distance to the accept instruction: past the remaining
+            # checks and the jump.
+            ret.append ((op, n - i, 0, k))
+        else:
+            ret.append ((op, 0, 0, k))
+    ret.append ((JA, 0, 0, 1))
+    ret.append ((RET, 0, 0, ACCEPT))
+    if addr is not None:
+        addr = bytes (addr)
+        skip = len (ret)
+        ret = [ (LDW, 0, 0, 0),
+                (JEQ, 0, skip + 2, int.from_bytes (addr[:4], "big")),
+                (LDH, 0, 0, 4),
+                (JEQ, 0, skip, int.from_bytes (addr[4:], "big")) ] + ret
+    return ret
+
+def compile (datalink):
+    """Return the BPF program, as a list of (code, jt, jf, k) tuples,
+    that implements the receive filter of the supplied BcDatalink.
+    """
+    protomap = datalink.filtermap ()
+    if protomap is None:
+        # Promiscuous, so only the protocol type matters
+        prog = clause (None, datalink.ports.keys ())
+    else:
+        prog = list ()
+        for a, ps in protomap.items ():
+            prog.extend (clause (a, ps))
+        if not prog:
+            # Nothing enabled yet.  Match what an empty PCAP filter
+            # string does, which is to accept everything.
+            return [ (RET, 0, 0, ACCEPT) ]
+    prog.append ((RET, 0, 0, 0))
+    return prog
+
+class Program:
+    """A BPF program in the form the kernel wants, a struct sock_fprog.
+    The "fprog" attribute is that struct as bytes, suitable as the
+    argument of setsockopt or ioctl.  Note that it points to memory
+    owned by this object, so the object must be kept until the call
+    that passes it to the kernel is done.
+    """
+    def __init__ (self, prog):
+        self.buf = ctypes.create_string_buffer (b"".join (sock_filter.pack (*i)
+                                                          for i in prog))
+        self.fprog = struct.pack ("HP", len (prog),
+                                  ctypes.addressof (self.buf))
@@ -254,9 +254,40 @@ agroup.add_argument ("--random-address", action = "store_true", default = False,
                      help = "Generate random \"hardware address\" (Ethernet only)")
 agroup.add_argument ("--hwaddr", type = Macaddr, default = NULLID, metavar = "H",
                      help = "Specify hardware address (Ethernet only)")
+cp.add_argument ("--buffer-size", type = int, metavar = "K", default = 0,
+                 help = """Kernel capture buffer size in kilobytes
+                 (Ethernet pcap mode only, default: libpcap default)""")
+cp.add_argument ("--queues", type = int, metavar = "N", default = 1,
+                 choices = range (1, 257),
+                 help = """Number of TAP queues, each with its own receive
+                 thread (Ethernet tap mode on Linux only, default 1)""")
+cp.add_argument ("--immediate", action = "store_true", default = False,
+                 help = """Deliver received frames without waiting for
+                 the capture buffer to fill (Ethernet pcap mode only)""")
+cp.add_argument ("--nodelay", action = "store_true", default = False,
+                 help = """Set TCP_NODELAY on the connection (Multinet
+                 TCP modes only)""")
 cp.add_argument ("--qmax", type = int, metavar = "Q",
                  default = 7, choices = range (1, 256),
                  help = "DDCMP max pending frame count (1..255, default 7)")
+cp.add_argument ("--delay", type = float, metavar = "D", default = 0,
+                 help = """Transmit delay in ms (Memory circuits only,
+                 default 0)""")
+cp.add_argument ("--rate", type = int, metavar = "R", default = 0,
+                 help = """Transmit rate in bits per second (Memory
+                 circuits only, default: 0, meaning unlimited)""")
+cp.add_argument ("--loss", type = float, metavar = "P", default = 0,
+                 help = """Percentage of transmitted frames to discard
+                 (Memory circuits only, default 0)""")
+cp.add_argument ("--seed", metavar = "S", default = "",
+                 help = """Seed for the loss random number generator;
+                 it makes the sequence of loss decisions repeatable,
+                 not the timing (Memory circuits only)""")
+cp.add_argument ("--routing-bandwidth", type = int, metavar = "B",
+                 default = 0,
+                 help = """Bandwidth budget for routing messages on this
+                 circuit, in bits per second (default: 0, meaning no
+                 pacing)""")
 
 # The spec says the valid range is 0..255 but that is wrong, because the list
 # of routers has to fit in a field of the router hello message that can at
@@ -345,8 +376,18 @@ cp.add_argument ("--maxarea", metavar = "NA", type = int, default = 63,
                  help = "Max area number (range 1..63)")
 cp.add_argument ("--t1", type = int, default = 600,
                  help = "Non-LAN background routing message interval")
+cp.add_argument ("--path-splits", type = int, default = 1, metavar = "N",
+                 choices = range (1, 9),
+                 help = """Maximum number of equal cost paths to spread
+                 traffic over (range 1..8, default 1)""")
 cp.add_argument ("--bct1", type = int, default = 10,
                  help = "LAN background routing message interval")
+cp.add_argument ("--checkpoint", metavar = "F",
+                 help = """File name for routing state checkpoint, used
+                 for warm restart (default: none)""")
+cp.add_argument ("--checkpoint-interval", type = int, default = 60,
+                 metavar = "S",
+                 help = "Interval between routing checkpoints (default 60)")
 igroup = cp.add_mutually_exclusive_group ()
 igroup.add_argument ("--no-intercept", action = "store_const",
                      dest = "intercept", const = 0,
@@ -385,6 +426,24 @@ cp.add_argument ("--qmax", default = 20, metavar = "Q",
 cp.add_argument ("--retransmits", type = int, default = 5, metavar = "R",
                  choices = range (2, 16),
                  help = "NSP maximum retransmits (range 2..15)")
+cp.add_argument ("--rtt-estimator", default = "nsp",
+                 choices = ("nsp", "srtt"),
+                 help = "NSP round trip estimator (nsp or srtt)")
+cp.add_argument ("--no-congestion-control", action = "store_false",
+                 dest = "congestion_control", default = True,
+                 help = "Disable NSP data congestion control")
+cp.add_argument ("--ack-after", type = int, default = 0, metavar = "N",
+                 choices = range (0, 256),
+                 help = """Ack after at most N received segments
+                        (range 0..255, 0 for no limit)""")
+cp.add_argument ("--ack-delay", type = float, default = 0.1, metavar = "D",
+                 help = "Maximum ack holdoff time in seconds (default 0.1)")
+cp.add_argument ("--adaptive-ack-delay", action = "store_true",
+                 default = False,
+                 help = "Derive ack holdoff from round trip delay")
+cp.add_argument ("--ack-piggyback", action = "store_true", default = False,
+                 help = """Hold off interrupt acks so they can be
+                        piggybacked on data""")
 
 def parsemode (s):
     try:
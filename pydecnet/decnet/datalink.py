@@ -32,6 +32,198 @@ REGPOLLOUT = select.POLLOUT | POLLERRHUP
 # the normal seconds.
 POLLTS = 1000
 
+# Maximum number of datagrams to receive per poll wakeup, or to send
+# in one batch, and the flag that makes a receive call non-blocking
+# (if the platform has it).
+RECVBATCH = 64
+MSG_DONTWAIT = getattr (socket, "MSG_DONTWAIT", 0)
+
+class RecvBatch (object):
+    """Receive buffers for draining a datagram socket, used by the
+    receive thread of Multinet UDP, GRE, and the Ethernet bridge.
+
+    Rather than doing a poll and a receive call for each datagram,
+    "receive" keeps receiving without waiting until there is nothing
+    more pending, so a busy socket costs one wakeup per batch.  The
+    datagrams are received with recvfrom_into into a pool of buffers
+    allocated once, rather than having each receive allocate a new
+    bytes object, most of which would be discarded after the caller
+    takes what it needs from it.
+    """
+    def __init__ (self, bufsize, limit = RECVBATCH):
+        pool = memoryview (bytearray (bufsize * limit))
+        self.bufs = [ pool[i:i + bufsize]
+                      for i in range (0, bufsize * limit, bufsize) ]
+
+    def receive (self, sock):
+        """Receive the datagrams that are waiting on "sock", which
+        poll has just reported as readable.  Returns a list of (msg,
+        addr) pairs.  Each "msg" is a memoryview into the buffer pool,
+        which is only valid until the next call, so the caller must
+        copy any data it passes on to the node thread.
+
+        An error on the first receive is raised to the caller.  An
+        error after that ends the batch; if the condition persists it
+        will be reported on the next call.
+        """
+        bufs = self.bufs
+        buf = bufs[0]
+        n, addr = sock.recvfrom_into (buf)
+        ret = [ (buf[:n], addr) ]
+        if MSG_DONTWAIT:
+            try:
+                for buf in bufs[1:]:
+                    n, addr = sock.recvfrom_into (buf, 0, MSG_DONTWAIT)
+                    ret.append ((buf[:n], addr))
+            except OSError:
+                # Typically BlockingIOError, meaning nothing more for now
+                pass
+        return ret
+
+# Batched datagram transmit.  Linux has sendmmsg, which sends a batch
+# of datagrams with one system call.  The socket module doesn't offer
+# it, so it is called through ctypes, as pcap.py does for libpcap.
+# Elsewhere, or if it can't be found, the datagrams are sent one at a
+# time.
+_sendmmsg = None
+if sys.platform == "linux":
+    import ctypes
+    
+    class _iovec (ctypes.Structure):
+        _fields_ = (("iov_base", ctypes.c_char_p),
+                    ("iov_len", ctypes.c_size_t))
+
+    class _msghdr (ctypes.Structure):
+        _fields_ = (("msg_name", ctypes.c_char_p),
+                    ("msg_namelen", ctypes.c_uint32),
+                    ("msg_iov", ctypes.POINTER (_iovec)),
+                    ("msg_iovlen", ctypes.c_size_t),
+                    ("msg_control", ctypes.c_void_p),
+                    ("msg_controllen", ctypes.c_size_t),
+                    ("msg_flags", ctypes.c_int))
+
+    class _mmsghdr (ctypes.Structure):
+        _fields_ = (("msg_hdr", _msghdr),
+                    ("msg_len", ctypes.c_uint))
+
+    try:
+        _sendmmsg = ctypes.CDLL (None, use_errno = True).sendmmsg
+        _sendmmsg.argtypes = (ctypes.c_int, ctypes.c_void_p,
+                              ctypes.c_uint, ctypes.c_int)
+        _sendmmsg.restype = ctypes.c_int
+    except (OSError, AttributeError):
+        _sendmmsg = None
+
+def _packaddr (family, addr):
+    # Return the C sockaddr (Linux layout) for a socket module address
+    if family == socket.AF_INET:
+        return struct.pack ("=H", family) + \
+               struct.pack ("!H", addr[1]) + \
+               socket.inet_pton (family, addr[0]) + bytes (8)
+    elif family == socket.AF_INET6:
+        flow, scope = (tuple (addr[2:4]) + (0, 0))[:2]
+        return struct.pack ("=H", family) + \
+               struct.pack ("!HI", addr[1], flow) + \
+               socket.inet_pton (family, addr[0]) + \
+               struct.pack ("=I", scope)
+    raise ValueError ("Unsupported address family {}".format (family))
+
+def sendbatch (sock, msgs, addr):
+    """Send the datagrams in "msgs" on "sock" to address "addr".  Each
+    entry of "msgs" is a tuple of bytes objects, which are sent
+    together (gathered) as one datagram.  Errors on individual
+    datagrams are ignored, because that's the DECnet way.  Returns
+    the number of system calls made.
+    """
+    if _sendmmsg:
+        try:
+            name = _packaddr (sock.family, addr)
+        except (ValueError, OSError, TypeError, IndexError):
+            name = None
+        if name:
+            n = len (msgs)
+            hdrs = (_mmsghdr * n) ()
+            iovs = list ()
+            for h, parts in zip (hdrs, msgs):
+                iov = (_iovec * len (parts)) (*((p, len (p)) for p in parts))
+                iovs.append (iov)
+                m = h.msg_hdr
+                m.msg_name = name
+                m.msg_namelen = len (name)
+                m.msg_iov = iov
+                m.msg_iovlen = len (parts)
+            fd = sock.fileno ()
+            size = ctypes.sizeof (_mmsghdr)
+            base = ctypes.addressof (hdrs)
+            done = calls = 0
+            while done < n:
+                calls += 1
+                r = _sendmmsg (fd, base + done * size, n - done, 0)
+                if r <= 0:
+                    # The next datagram could not be sent; skip it.
+                    r = 1
+                done += r
+            return calls
+    for parts in msgs:
+        try:
+            if len (parts) == 1:
+                sock.sendto (parts[0], addr)
+            else:
+                sock.sendto (b"".join (parts), addr)
+        except (OSError, TypeError):
+            pass
+    return len (msgs)
+
+class DatagramQueue (Element):
+    """Transmit queue for a datalink that sends datagrams on a socket
+    (Multinet UDP, GRE, and the Ethernet bridge).  Datagrams handed to
+    "send" while the node thread works through a burst of work items
+    are held until that work is done, then all sent with one
+    "sendbatch" call by a Flush work item, the same way the stream
+    datalinks coalesce their writes (see PtpDatalink.flush).
+    """
+    def __init__ (self, parent):
+        super ().__init__ (parent)
+        self.q = list ()
+        self.sock = self.addr = None
+        self.flushpending = False
+        # Statistics
+        self.sent = 0
+        self.calls = 0
+
+    def send (self, sock, addr, *parts):
+        """Queue a datagram made up of "parts" (bytes objects, which
+        the caller must not modify) to be sent on "sock" to "addr".
+        """
+        if self.q and (sock is not self.sock or addr != self.addr):
+            # Destination changed, send what we have first
+            self.flush ()
+        self.sock = sock
+        self.addr = addr
+        self.q.append (parts)
+        if len (self.q) >= RECVBATCH:
+            self.flush ()
+        elif not self.flushpending:
+            self.flushpending = True
+            self.node.addwork (Flush (self))
+
+    def flush (self):
+        q = self.q
+        if q:
+            self.q = list ()
+            self.sent += len (q)
+            self.calls += sendbatch (self.sock, q, self.addr)
+
+    def clear (self):
+        "Discard any queued datagrams, for use when closing the socket"
+        self.q = list ()
+        self.sock = None
+
+    def dispatch (self, item):
+        if isinstance (item, Flush):
+            self.flushpending = False
+            self.flush ()
+
 class DatalinkLayer (Element):
     """The datalink layer.  This is mainly a container for the individual
     datalink circuits.
@@ -172,6 +364,14 @@ class Datalink (Element, metaclass = ABCMeta):
         """
         pass
 
+    def txbacklog (self):
+        """Return the number of messages that have been given to this
+        datalink for transmission but not yet actually sent.  Most
+        datalinks send immediately so the default is zero; a datalink
+        with its own flow control (like DDCMP) overrides this.
+        """
+        return 0
+    
     def nice_read_line (self, req, resp):
         r = resp[str (self.name)]
         if req.sumstat ():
@@ -199,6 +399,12 @@ class Port (Element, metaclass = ABCMeta):
         """
         pass
 
+    def txbacklog (self):
+        """Return the transmit backlog of the datalink this port
+        belongs to.
+        """
+        return self.parent.txbacklog ()
+    
     def nice_read_port (self, req, r):
         if req.char ():
             # Characteristics
@@ -257,6 +463,12 @@ class Connected (Work):
 
 class ThreadExit (Work):
     "The receive thread has terminated"
+
+class Flush (Work):
+    """A work item that asks the datalink to transmit the frames
+    queued while handling the preceding work.  See PtpDatalink.flush
+    and DatagramQueue.
+    """
     
 # Point to point port
 
@@ -301,6 +513,9 @@ class PtpCounters (BaseCounters):
         # A subset of the counters defined by the architecture
         self.bytes_sent = self.pkts_sent = 0
         self.bytes_recv = self.pkts_recv = 0
+        # Not architected: the number of writes that carried queued
+        # frames to the connection.
+        self.tx_writes = 0
         
 # Point to point datalink base class
 class PtpDatalink (Datalink, statemachine.StateMachine):
@@ -320,6 +535,10 @@ class PtpDatalink (Datalink, statemachine.StateMachine):
         self.restart_timer = Backoff (2, 120)
         self.is_up = False
         self.restart_now = False
+        # Frames (or pieces of frames) not yet handed to the
+        # connection, and whether a Flush work item is outstanding.
+        self.txq = list ()
+        self.flushpending = False
         
     def open (self):
         # Open and close datalink are ignored, control is via the port
@@ -342,6 +561,44 @@ class PtpDatalink (Datalink, statemachine.StateMachine):
         self.port = port
         return port
 
+    def schedule_flush (self):
+        """Arrange for "flush" to be called once the work items now
+        queued have been handled.
+        """
+        if not self.flushpending:
+            self.flushpending = True
+            self.node.addwork (Flush (self))
+
+    def queue_frame (self, *parts):
+        """Queue a frame, given as one or more buffers, for
+        transmission at the next flush.  This is only supported by
+        subclasses that supply "transmit".
+        """
+        if not self.transmit:
+            raise RuntimeError ("{} datalink does not support queued "
+                                "transmit".format (self.__class__.__name__))
+        self.txq.extend (parts)
+        self.schedule_flush ()
+
+    def flush (self):
+        """Transmit all queued frames.  Stream based datalinks queue
+        the frames they generate while handling one work item (or a
+        sequence of them, such as a burst of sends from the layer
+        above) and write them to the connection with a single call,
+        rather than making a system call per frame.
+        """
+        self.flushpending = False
+        if self.txq:
+            parts = self.txq
+            self.txq = list ()
+            self.counters.tx_writes += 1
+            self.transmit (parts)
+
+    # Subclasses that use queue_frame supply a method "transmit
+    # (self, parts)", which writes the supplied list of buffers to the
+    # connection.  Others leave it as None.
+    transmit = None
+
     def recvall (self, n):
         """Receive a specific number of bytes from self.socket.  
 
@@ -349,11 +606,36 @@ class PtpDatalink (Datalink, statemachine.StateMachine):
         been read.  If the socket connection is lost, or a thread stop
         signal is delivered, it raises an IOError exception.
         """
+        ret = b''
+        while len (ret) < n:
+            ret += self.recvsome (n - len (ret))
+        return ret
+
+    def recvsome (self, n):
+        """Receive up to n bytes from self.socket.
+
+        This function waits until some data is available, then returns
+        what it got, at least one byte.  If the socket connection is
+        lost, or a thread stop signal is delivered, it raises an
+        IOError exception.
+        """
+        return self.recvwait ("recv", n)
+
+    def recvinto (self, buf):
+        """Receive into the supplied writable buffer from self.socket.
+
+        Like recvsome, but the data is placed in "buf" and the return
+        value is the number of bytes received, at least one.
+        """
+        return self.recvwait ("recv_into", buf)
+
+    def recvwait (self, op, arg):
+        # Common code for recvsome and recvinto: wait for data, then
+        # call socket method "op" with argument "arg".
         sock = self.socket
         p = select.poll ()
         p.register (sock, REGPOLLIN)
-        ret = b''
-        while len (ret) < n:
+        while True:
             # Look for traffic
             try:
                 pl = p.poll (POLLTS)
@@ -370,14 +652,13 @@ class PtpDatalink (Datalink, statemachine.StateMachine):
             if mask & select.POLLIN:
                 # Receive a packet
                 try:
-                    m = sock.recv (n - len (ret))
+                    m = getattr (sock, op) (arg)
                 except (AttributeError, OSError, socket.error):
                     logging.trace ("Receive header error", exc_info = True)
                     m = None
                 if not m:
                     raise IOError
-                ret += m
-        return ret
+                return m
 
     def report_up (self):
         "Tell the port owner that this datalink instance is UP"
@@ -436,6 +717,9 @@ class PtpDatalink (Datalink, statemachine.StateMachine):
         elif isinstance (item, Reconnect):
             self.set_state (self.handle_reconnect (item))
             return False
+        elif isinstance (item, Flush):
+            self.flush ()
+            return False
         elif isinstance (item, ThreadExit):
             if self.state != self.shutdown:
                 self.state = self.reconnecting
@@ -669,28 +953,35 @@ class BcDatalink (Datalink):
             ret.append (p)
         return " or ".join (ret)
     
-    def filter (self):
-        "Return PCAP filter string for this datalink"
-        # We'll build a string with an element for each enabled address,
-        # and for each address the prototypes that are used with it.
-        # But if any port is promiscuous then the filter is only a
-        # prototype filter.
+    def filtermap (self):
+        """Return the receive filter for this datalink, as a dictionary
+        mapping each enabled address to the set of prototypes and SAPs
+        that are used with it.  If any port is promiscuous, the return
+        value is None, meaning that the filter is only a prototype
+        filter.
+        """
         protomap = defaultdict (set)
-        promisc = False
         for p, port in self.ports.items ():
             if port.promisc:
-                promisc = True
-                break
+                return None
             protomap[port.macaddr].add (p)
             for a in port.multicast:
                 protomap[a].add (p)
-        if promisc:
+        return { a : ps for a, ps in protomap.items () if a and a != NULLID }
+    
+    def filter (self):
+        "Return PCAP filter string for this datalink"
+        # We'll build a string with an element for each enabled address,
+        # and for each address the prototypes that are used with it.
+        # But if any port is promiscuous then the filter is only a
+        # prototype filter.
+        protomap = self.filtermap ()
+        if protomap is None:
             return self.portfilter (self.ports.keys ())
         ret = list ()
         for a, ps in protomap.items ():
-            if a and a != NULLID:
-                pf = self.portfilter (ps)
-                ret.append ("((ether dst {::}) and ({}))".format (a, pf))
+            pf = self.portfilter (ps)
+            ret.append ("((ether dst {::}) and ({}))".format (a, pf))
         return " or ".join (ret)
 
     def update_filter (self, fs):
@@ -751,6 +1042,31 @@ class BcPort (Port):
             assert sap, "Exactly one of protocol type or SAP address must be specified"
             self.add_sap (sap)
 
+    @staticmethod
+    def msgparts (msg):
+        """Return a list of byte-like pieces that make up the supplied
+        message, and their total length.  If the message is a packet
+        object, it is not encoded into a single buffer; instead the
+        pieces are copied directly into the frame by "fillframe".
+        That way a large payload is copied only once.
+        """
+        if hasattr (msg, "encode_parts"):
+            parts = msg.encode_parts ()
+        else:
+            parts = [ makebytes (msg) ]
+        return parts, sum (len (p) for p in parts)
+
+    @staticmethod
+    def fillframe (f, pos, parts):
+        """Copy the message pieces from "msgparts" into frame buffer f
+        starting at offset pos.  Returns the offset after the data.
+        """
+        for p in parts:
+            e = pos + len (p)
+            f[pos:e] = p
+            pos = e
+        return pos
+    
     @property
     def macaddr (self):
         if self.parent.single_address:
@@ -11,3 +11,6 @@ from . import ddcmp
 # Broadcast
 from . import ethernet
 from . import gre
+
+# Both (in-memory simulation)
+from . import memory
@@ -84,6 +84,10 @@ DEL = 0o377        # DEL - pad after message trailer
 
 DEL1 = byte (DEL)
 DEL2 = DEL1 + DEL1
+# Header start bytes, for searching the input stream
+HDRSTART = (byte (SOH), byte (ENQ), byte (DLE))
+# Read size for stream (TCP or serial) input
+RBUFSIZE = 16384
 
 # Control message types
 ACK   = 1          # Acknowledgment
@@ -109,6 +113,23 @@ class DdcmpCounters (datalink.PtpCounters):
         self.remote_reply_timeouts = 0
         self.local_reply_timeouts = 0
         self.remote_buffer_errors = CTM1 ()
+        # Transmit window and error recovery statistics.  These
+        # aren't architected counters, but they show how well the
+        # window (qmax) fits the line.  REPs sent and received are
+        # counted above as local and remote reply timeouts.
+        self.window_peak = 0
+        self.window_full = 0
+        self._window_sum = 0
+        self.naks_sent = 0
+        self.naks_recv = 0
+        self.retransmits = 0
+
+    @property
+    def window_average (self):
+        "Average number of outstanding messages when a data message is sent"
+        if self.pkts_sent:
+            return round (self._window_sum / self.pkts_sent, 1)
+        return 0
 
 # Mapped counter bit number definitions for the above:
 DE_HCRC = 0
@@ -317,7 +338,7 @@ class Err (Work):
         super ().__init__ (owner)
         self.code = code
         self.resp = None
-        
+
 class _DDCMP (datalink.PtpDatalink):
     counter_class = DdcmpCounters
     
@@ -425,11 +446,17 @@ class _DDCMP (datalink.PtpDatalink):
         # acked) and not yet sent (due to too many unacked).
         self.unack = [ None ] * 256
         self.notsent = queue.Queue ()
+        # Anything not yet transmitted belongs to the old state
+        self.txq.clear ()
         # Stop any timer
         self.node.timers.stop (self)
         
     def cansend (self):
         return (self.n - self.a) < self.qmax
+
+    def txbacklog (self):
+        # Messages waiting for transmit window space
+        return self.notsent.qsize ()
     
     def connected (self):
         # We're connected.  Stop the timer, and start DDCMP protocol
@@ -458,49 +485,108 @@ class _DDCMP (datalink.PtpDatalink):
             self.set_state (self.Istart)
         return self.Istart
 
+    def flush (self):
+        """Send an ACK if one is still needed, then transmit all
+        queued frames.  ACKs are deferred to this point so that data
+        messages sent by the layer above in response to what we just
+        delivered to it can carry the acknowledgment instead.  For the
+        stream transports, the frames produced by all that work -- for
+        example a whole window of retransmissions -- go out in a
+        single write.
+        """
+        if self.ackflag and self.state == self.running:
+            # The Ack is queued (or, for datagram transports, sent)
+            # without scheduling another flush, since one is running.
+            self.send_ack ()
+        super ().flush ()
+
+    def reset_input (self):
+        """Discard any buffered stream input, and mark the link as
+        not in sync.  Called when a stream connection is (re)started.
+        """
+        self.insync = False
+        self.rbuf = bytearray ()
+        self.rpos = 0
+        
+    def fill (self):
+        """Read more stream input into the input buffer.  This waits
+        for at least one byte.  If there is no more input (connection
+        lost or thread stop requested), raises IOError.
+        """
+        data = self.readsome (RBUFSIZE)
+        buf = self.rbuf
+        if self.rpos:
+            # Discard what has been consumed.  This is done here
+            # because it is the only place where the buffer grows,
+            # and there are no views into it outstanding.
+            del buf[:self.rpos]
+            self.rpos = 0
+        buf += data
+
+    def readbytes (self, n):
+        """Return the next n bytes of stream input, waiting for more
+        input as needed.
+        """
+        while len (self.rbuf) - self.rpos < n:
+            self.fill ()
+        p = self.rpos
+        self.rpos = p + n
+        return bytes (self.rbuf[p:p + n])
+    
     def header_search (self):
         """Search for the DDCMP header in the input stream (for serial
         and TCP modes).  The simple scheme of looking for a header start
         and then taking in 7 more bytes doesn't work if the other side
         is repeatedly sending the same control message just after sync
         was lost, and that message has what looks like a header start
-        byte at some other offset in the header.
+        byte at some other offset in the header.  So every header
+        start byte is a candidate, and if its header CRC is bad, the
+        search resumes at the next byte.
+
+        The input is read in large chunks into a buffer, and the search
+        and the header CRC check are done on the buffer in place.
         """
         while True:
-            # Get the first byte.
-            c = self.readbytes (1)
-            while c:
-                h = c[0]
-                if h == ENQ or h == SOH or h == DLE:
-                    # Valid start of header.  Receive the rest of the header.
-                    c += self.readbytes (HDRLEN - len (c))
-                    # Check the Header CRC
-                    crc = CRC16 (c)
-                    if crc.good:
-                        if not self.insync:
-                            logging.trace ("Back in sync on {}", self.name)
-                        self.insync = True
-                        return c
-                    # Header CRC is bad.  If we're in sync, report
-                    # that as a bad header.  If not, treat it as
-                    # message not framed correctly, and silently
-                    # keep looking.
-                    logging.tracepkt ("bad header CRC on {}",
-                                      self.name, pkt = c)
-                    if self.insync:
-                        self.insync = False
-                        self.node.addwork (Err (self, R_HCRC))
-                        self.counters.data_errors_inbound += (1, DE_HCRC)
-                        logging.trace ("Lost sync on {}", self.name)
-                    else:
-                        logging.trace ("Out of sync, another HCRC error on {}",
-                                       self.name)
-                # Search through the 8 bytes we just received to see if
-                # any of them look like another valid header start.
-                # Just keep stripping off bytes from the start one at a
-                # time and re-examining the first of what's left to see
-                # if that too looks like a header.
-                c = c[1:]
+            buf = self.rbuf
+            # Find the first header start byte
+            i = end = len (buf)
+            for h in HDRSTART:
+                j = buf.find (h, self.rpos, end)
+                if j >= 0:
+                    i = end = j
+            # Anything before it is garbage, consume that
+            self.rpos = i
+            if len (buf) - i < HDRLEN:
+                # No header start, or not yet a full header
+                self.fill ()
+                continue
+            with memoryview (buf) as m:
+                c = m[i:i + HDRLEN]
+                # Check the Header CRC
+                good = CRC16 (c).good
+                c.release ()
+            if good:
+                if not self.insync:
+                    logging.trace ("Back in sync on {}", self.name)
+                self.insync = True
+                self.rpos = i + HDRLEN
+                return bytes (buf[i:i + HDRLEN])
+            # Header CRC is bad.  If we're in sync, report that as a
+            # bad header.  If not, treat it as message not framed
+            # correctly, and silently keep looking.
+            logging.tracepkt ("bad header CRC on {}",
+                              self.name, pkt = buf[i:i + HDRLEN])
+            if self.insync:
+                self.insync = False
+                self.node.addwork (Err (self, R_HCRC))
+                self.counters.data_errors_inbound += (1, DE_HCRC)
+                logging.trace ("Lost sync on {}", self.name)
+            else:
+                logging.trace ("Out of sync, another HCRC error on {}",
+                               self.name)
+            # Resume the search at the next byte, it may be the start
+            # of the real header.
+            self.rpos = i + 1
 
     def handle_pkt (self, pkt, c):
         # Handle a parsed packet
@@ -670,6 +756,7 @@ class _DDCMP (datalink.PtpDatalink):
                 self.process_ack (data)
             elif isinstance (data, NakMsg):
                 # Count the error reported by the other side
+                self.counters.naks_recv += 1
                 try:
                     d_err, bit = nak_map[data.subtype]
                     if d_err:
@@ -727,10 +814,11 @@ class _DDCMP (datalink.PtpDatalink):
             return None
         # Done processing the incoming event.  If we now have an ACK to
         # send, that means this wasn't satisfied by an outgoing data
-        # message that resulted from what we just did, so send an
-        # actual ACK message.
+        # message that resulted from what we just did.  Send an actual
+        # ACK message at the next flush, unless data messages sent
+        # by then take care of it.
         if self.ackflag:
-            self.send_ack ()
+            self.schedule_flush ()
 
     # Helper routines for the various states
 
@@ -748,6 +836,7 @@ class _DDCMP (datalink.PtpDatalink):
         self.sendmsg (msg, 0)
 
     def send_nak (self, code):
+        self.counters.naks_sent += 1
         msg = NakMsg (subtype = code)
         # Don't start the timer...
         self.sendmsg (msg, 0)
@@ -811,12 +900,14 @@ class _DDCMP (datalink.PtpDatalink):
         the timeout as a side effect.
         """
         t = self.a
-        pend = self.n - self.a
+        pend = int (self.n - self.a)
+        self.counters.retransmits += pend
         for i in range (pend):
             t += 1
             msg = self.unack[t]
             assert (msg)
-            self.sendmsg (msg, self.acktmr)
+            # Start the timer once, with the last message
+            self.sendmsg (msg, self.acktmr if i == pend - 1 else None)
             
     @setlabel ("Maintenance")
     def Maint (self, data):
@@ -858,11 +949,17 @@ class _DDCMP (datalink.PtpDatalink):
         if self.state == self.running:
             if not self.cansend ():
                 # Can't send now, queue it for when an ACK arrives
+                self.counters.window_full += 1
                 self.notsent.put (data)
                 return
             # Advance the next sequence number.
             n = self.n
             self.n += 1
+            # Window statistics, counting this message
+            out = int (self.n - self.a)
+            self.counters._window_sum += out
+            if out > self.counters.window_peak:
+                self.counters.window_peak = out
             data = makebytes (data)
             mlen = len (data)
             if logging.tracing:
@@ -925,16 +1022,18 @@ class _SerialDDCMP (_DDCMP):
                        self.name, self.dev)
         return True
 
-    def readbytes (self, n):
-        ret = b''
-        while len (ret) < n:
+    def readsome (self, n):
+        # Return what is waiting in the UART buffer (up to n bytes),
+        # or wait for at least one byte.
+        while True:
             if self.rthread and self.rthread.stopnow:
                 raise IOError
-            ret += self.serial.read (n - len (ret))
-        return ret
+            ret = self.serial.read (max (1, min (n, self.serial.in_waiting)))
+            if ret:
+                return ret
     
     def receive_loop (self):
-        self.insync = False
+        self.reset_input ()
         # Start looking for messages.
         while True:
             # Get a good header
@@ -957,14 +1056,17 @@ class _SerialDDCMP (_DDCMP):
         super ().sendmsg (msg, timeout)
         # Just encode the message; CRCs are handled by the encoder.
         msg = msg.encode ()
+        # Append a DEL byte.  No sync bytes in front, they aren't
+        # useful for async connections.
+        msg = msg + DEL1
+        if logging.tracing:
+            logging.tracepkt ("Sending packet on {}",
+                              self.name, pkt = msg)
+        self.queue_frame (msg)
+
+    def transmit (self, parts):
         try:
-            # Append a DEL byte.  No sync bytes in front, they
-            # aren't useful for async connections.
-            msg = msg + DEL1
-            if logging.tracing:
-                logging.tracepkt ("Sending packet on {}",
-                                  self.name, pkt = msg)
-            self.serial.write (msg)
+            self.serial.write (b"".join (parts))
         except (OSError, AttributeError):
             # AttributeError happens if self.serial has been changed
             # to "None"
@@ -1108,61 +1210,53 @@ class _TcpDDCMP (_DDCMP):
         self.conntmr.reset ()
         return True
 
-    def readbytes (self, sz):
-        """Receive "sz" bytes of data from the socket.  This waits until
-        it has that much available.  If the connection was closed, raises
-        OSError; otherwise, it returns exactly the amount requested.
+    def readsome (self, n):
+        """Receive up to n bytes of data from the socket, waiting for
+        at least one.  If the connection was closed, raises IOError.
         """
         if self.telnet:
-            p = b''
-            while len (p) < sz:
-                b = self.recvall (sz - len (p))
-                # Handle escapes.  Note that we only handles escaped
-                # 377, not any other Telnet control codes.
-                e = b.count (DEL1)
+            while True:
+                b = self.telnetpend + self.recvsome (n)
+                # Handle escapes.  Note that we only handle escaped
+                # 377, not any other Telnet control codes.  If the
+                # data ends in the first byte of an escape, hold that
+                # until the rest arrives.
+                e = len (b) - len (b.rstrip (DEL1))
                 if e & 1:
-                    b2 = self.recvall (1)
-                    b += b2
-                if e:
-                    b = b.replace (DEL2, DEL1)
-                p += b
-        else:
-            p = self.recvall (sz)
-        return p
+                    b, self.telnetpend = b[:-1], DEL1
+                else:
+                    self.telnetpend = b""
+                if b:
+                    return b.replace (DEL2, DEL1)
+        return self.recvsome (n)
     
     def receive_loop (self):
-        poll = select.poll ()
-        sock = self.socket
-        poll.register (sock, datalink.REGPOLLIN)
+        self.reset_input ()
+        self.telnetpend = b""
         # Start looking for messages.
         while True:
-            plist = poll.poll (datalink.POLLTS)
-            for fd, event in plist:
-                if event & datalink.POLLERRHUP:
-                    # Error or disconnect, quit.
-                    return
-                # Not error, so it's incoming data.  Get a good header
-                try:
-                    c = self.header_search ()
-                except IOError:
-                    # Stop signal or connection lost, quit
-                    return
-                # Decode via the header base class, which will
-                # identify the actual message type using packet
-                # class indexing and return that.  Tell decode
-                # that the header CRC has already been checked.
-                try:
-                    pkt, x = DMHdr.decode (c, self.readbytes, False)
-                    if logging.tracing and isinstance (pkt, BaseDataMsg):
-                        # We want to log the packet, make sure the
-                        # payload is included as part of the log
-                        # message.  (The "c" argument to handle_pkt is
-                        # used for a tracepkt call; the message
-                        # dispatching uses the "pkt" argument.)
-                        c = (c, pkt.payload)
-                    self.handle_pkt (pkt, c)
-                except DecodeError as e:
-                    logging.tracepkt ("Invalid packet: {}", e, pkt = c)
+            # Get a good header
+            try:
+                c = self.header_search ()
+            except IOError:
+                # Stop signal or connection lost, quit
+                return
+            # Decode via the header base class, which will
+            # identify the actual message type using packet
+            # class indexing and return that.  Tell decode
+            # that the header CRC has already been checked.
+            try:
+                pkt, x = DMHdr.decode (c, self.readbytes, False)
+                if logging.tracing and isinstance (pkt, BaseDataMsg):
+                    # We want to log the packet, make sure the
+                    # payload is included as part of the log
+                    # message.  (The "c" argument to handle_pkt is
+                    # used for a tracepkt call; the message
+                    # dispatching uses the "pkt" argument.)
+                    c = (c, pkt.payload)
+                self.handle_pkt (pkt, c)
+            except DecodeError as e:
+                logging.tracepkt ("Invalid packet: {}", e, pkt = c)
 
     def disconnect (self):
         try:
@@ -1187,15 +1281,18 @@ class _TcpDDCMP (_DDCMP):
         super ().sendmsg (msg, timeout)
         # Just encode the message; CRCs are handled by the encoder.
         msg = msg.encode ()
+        if self.telnet:
+            # Add a DEL after the frame in Telnet mode since
+            # presumably we're talking to a real terminal.
+            msg = msg.replace (DEL1, DEL2) + DEL2
+        if logging.tracing:
+            logging.tracepkt ("Sending packet on {}",
+                              self.name, pkt = msg)
+        self.queue_frame (msg)
+
+    def transmit (self, parts):
         try:
-            if self.telnet:
-                # Add a DEL after the frame in Telnet mode since
-                # presumably we're talking to a real terminal.
-                msg = msg.replace (DEL1, DEL2) + DEL2
-            if logging.tracing:
-                logging.tracepkt ("Sending packet on {}",
-                                  self.name, pkt = msg)
-            self.socket.sendall (msg)
+            self.socket.sendall (b"".join (parts))
         except (OSError, AttributeError):
             # AttributeError happens if socket has been changed to "None"
             self.reconnect ()
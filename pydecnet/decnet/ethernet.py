@@ -13,12 +13,14 @@ import socket
 import struct
 import os
 import sys
+import mmap
 
 from .common import *
 from . import logging
 from . import datalink
 from . import pcap
 from . import host
+from . import bpf
 
 FILL = b'\x42' * 60
 ETH_MTU = 1518
@@ -47,8 +49,7 @@ class EthPort (datalink.BcPort):
         destb = makebytes (dest)
         if len (destb) != 6:
             raise ValueError ("Invalid destination address length")
-        msg = makebytes (msg)
-        l = len (msg)
+        parts, l = self.msgparts (msg)
         f = self.frame
         f[0:6] = destb
         f[6:12] = self.macaddr
@@ -69,9 +70,24 @@ class EthPort (datalink.BcPort):
         else:
             if l > 1500:
                 raise ValueError ("Ethernet packet too long")
+        if self.parent.gather:
+            # The datalink can send a frame given as a list of
+            # pieces, so send the header from the frame buffer and
+            # the payload pieces as they are, without copying them.
+            f = [ memoryview (f)[:self.plstart] ] + parts
+            l += self.plstart
+            self.counters.bytes_sent += l
+            self.counters.pkts_sent += 1
+            if l < 60:
+                f.append (FILL[l:60])
+            if logging.tracing:
+                logging.tracepkt ("Sending packet on {} to {}",
+                                  self.parent.name, dest,
+                                  pkt = b"".join (f))
+            self.parent.send_frame (f)
+            return
         # Fill in the payload and compute total length
-        f[self.plstart:self.plstart + l] = makebytes (msg)
-        l += self.plstart
+        l = self.fillframe (f, self.plstart, parts)
         self.counters.bytes_sent += l
         self.counters.pkts_sent += 1
         # Always send packet padded to min of 60 if need be, whether
@@ -122,11 +138,24 @@ class _Ethernet (datalink.BcDatalink, StopThread):
     def create_port (self, owner, proto = None, sap = None, pad = True):
         return super ().create_port (owner, proto, sap, pad)
 
+    # Set to True by subclasses whose receive thread passes packets
+    # that are only valid for the duration of the receive call (such
+    # as a memoryview into a receive ring).  Packets that are accepted
+    # are then copied before they are handed to the node thread.
+    copy_accepted = False
+    # Set to True by subclasses whose send_frame accepts a list of
+    # buffers (header and payload pieces) as well as a single buffer.
+    gather = False
+    
     def receive (self, plen, packet, ts):
+        """Process a received frame: apply the protocol and address
+        filters, and pass it up if it matches.  Returns True if it was
+        passed up.
+        """
         if not packet:
             # pcap_next returns None if we got a timeout
             return
-        proto = packet[12:14]
+        proto = bytes (packet[12:14])
         try:
             if proto <= b"\x05\xdc":
                 # 802.3 frame, handle that
@@ -142,7 +171,7 @@ class _Ethernet (datalink.BcDatalink, StopThread):
             # No protocol type match, ignore packet
             self.counters.unk_dest += 1
             return
-        dest = packet[:6]
+        dest = bytes (packet[:6])
         src = Macaddr (packet[6:12])
         if src.ismulti ():
             # "source routed"?  Ignore
@@ -150,6 +179,8 @@ class _Ethernet (datalink.BcDatalink, StopThread):
         # Note that we don't count packets that fail the address
         # filter, otherwise we'd count lots of stuff for others.
         if dest == port.macaddr or dest in port.destfilter:
+            if self.copy_accepted:
+                packet = bytes (packet[:plen])
             # We only log packets that make it past the address and
             # protocol type filters.
             if logging.tracing:
@@ -177,6 +208,7 @@ class _Ethernet (datalink.BcDatalink, StopThread):
             self.node.addwork (Received (port.owner,
                                          src = src, packet = payload,
                                          pdu = packet, extra = ts))
+            return True
         else:
             # No address match, count that.  Strictly speaking this is
             # probably only correct for multicast mismatch, but we'll
@@ -195,7 +227,11 @@ class _Ethernet (datalink.BcDatalink, StopThread):
 TUNSETIFF = 0x400454ca
 IFF_TUN = 0x0001
 IFF_TAP = 0x0002
+IFF_MULTI_QUEUE = 0x0100
 IFF_NO_PI = 0x1000
+# _IOW('T', 213, struct sock_fprog)
+TUNATTACHFILTER = 0x40000000 + (struct.calcsize ("HP") << 16) + \
+                  (ord ('T') << 8) + 213
 # sizeof (struct ifreq) is 32 or 40 depending on whether we're on a 32
 # bit or 64 bit system.  So we need 32 - 18 = 14 or 40 - 18 = 22 bytes
 # of padding respectively to make the ifreq struct come out the right
@@ -217,26 +253,61 @@ SIOCGIFFLAGS = 0xc0000000 + (sizeof_ifreq << 16) + (ord ('i') << 8) + 17
 # API specific classes
 if fcntl:
     class _TapEth (_Ethernet):
+        """TUN/TAP device.  On Linux, the device can be opened with
+        several queues (IFF_MULTI_QUEUE).  In that case, each queue
+        has its own receive thread, which reads frames in bursts into
+        preallocated buffers, and frames are sent with a gather write.
+        """
+        tap = None
+        # Attach the receive filter to the device (Linux only)
+        kernel_filter = True
+
+        def __init__ (self, owner, name, dev, config):
+            super ().__init__ (owner, name, dev, config)
+            self.queues = config.queues
+            if self.queues > 1:
+                if sys.platform != "linux":
+                    logging.error ("Multiple TAP queues not supported "
+                                   "on {}, using one", sys.platform)
+                    self.queues = 1
+                else:
+                    self.gather = self.copy_accepted = True
+            self.taps = ()
+            self.qthreads = ()
+            # With several queues, each read by its own thread, the
+            # receive processing (filtering and counting) is done
+            # under this lock, so the counter updates don't race.
+            self.rxlock = threading.Lock ()
+            
         def open (self):
             # Set a dummy value in case we get an error
             self.tap = None
             if sys.platform == "linux":
                 # Linux-specific preparation
-                fd = os.open ("/dev/net/tun", os.O_RDWR)
+                flags = IFF_TAP | IFF_NO_PI
+                if self.queues > 1:
+                    flags |= IFF_MULTI_QUEUE
                 # We need 40 - 18 = 22 bytes of padding to make the
                 # ifreq struct come out the right size; Linux says
                 # it's 40 but what we fill in here only gets us to 18.
                 ifr = struct.pack (ifr_layout, self.dev.encode("ascii"),
-                                   IFF_TAP | IFF_NO_PI)
-                ioctl (fd, TUNSETIFF, ifr)
+                                   flags)
+                fds = list ()
+                for i in range (self.queues):
+                    fd = os.open ("/dev/net/tun", os.O_RDWR)
+                    fds.append (fd)
+                    ioctl (fd, TUNSETIFF, ifr)
             else:
                 if os.path.sep not in self.dev:
                     self.dev = os.path.join ("/dev", self.dev)
-                fd = os.open (self.dev, os.O_RDWR)
-            oldflags = fcntl (fd, F_GETFL, 0)
-            fcntl (fd, F_SETFL, oldflags | os.O_NONBLOCK)
-            self.tap = fd
+                fds = [ os.open (self.dev, os.O_RDWR) ]
+            for fd in fds:
+                oldflags = fcntl (fd, F_GETFL, 0)
+                fcntl (fd, F_SETFL, oldflags | os.O_NONBLOCK)
+            fd = self.tap = fds[0]
+            self.taps = fds
             self.sellist = ( fd, )
+            self.newfilter ()
             # Turn the interface on -- needed only on Mac OS
             if sys.platform == "darwin":
                 req = bytearray (sizeof_ifreq)
@@ -249,21 +320,63 @@ if fcntl:
                 ioctl (s, SIOCSIFFLAGS, req)
                 s.close ()
             super ().open ()
+            # The first queue is handled by the main thread, any
+            # others each get a thread of their own.
+            self.qthreads = [ StopThread (name = "{}.{}".format (self.name, i),
+                                          target = self.rxloop,
+                                          args = (fd,))
+                              for i, fd in enumerate (fds[1:], 1) ]
+            for t in self.qthreads:
+                t.start ()
 
         def close (self):
+            # Stop the receive threads and wait for them to exit
+            # before closing the descriptors they read, so none of
+            # them is left reading a descriptor number that has been
+            # reused for something else.
+            for t in self.qthreads:
+                t.stop (True)
+            self.stop (True)
             super ().close ()
-            try:
-                os.close (self.tap)
-            except Exception:
-                pass
+            for fd in self.taps:
+                try:
+                    os.close (fd)
+                except Exception:
+                    pass
             self.tap = None
+            self.taps = self.qthreads = ()
+
+        def update_filter (self, fs):
+            """On Linux, attach the receive filter to the TAP device
+            as a BPF program, so the kernel discards frames that none
+            of our ports want.  The argument (PCAP filter string) is
+            not used, the program is compiled from the port settings.
+            """
+            if sys.platform != "linux" or not self.kernel_filter \
+               or not self.tap:
+                return
+            prog = bpf.Program (bpf.compile (self))
+            try:
+                ioctl (self.tap, TUNATTACHFILTER, prog.fprog)
+                logging.trace ("dev {} new kernel filter {}", self.dev, fs)
+            except OSError as e:
+                logging.error ("Can't set kernel filter for {}: {}",
+                               self.name, e)
 
         def send_frame (self, buf, skip = None):
             """Send an Ethernet frame.  Ignore any errors, because that's
             the DECnet way.
+
+            With a multi-queue TAP, all frames are sent on the first
+            queue.  Sends only come from the node thread, so there is
+            nothing to gain by spreading them over the queues, and
+            using one keeps the frames in the order they were sent.
             """
             try:
-                os.write (self.tap, buf)
+                if isinstance (buf, list):
+                    os.writev (self.tap, buf)
+                else:
+                    os.write (self.tap, buf)
             except (IOError, TypeError):
                 # TypeError will appear if a message is sent while the
                 # circuit is being closed, because at that point
@@ -271,6 +384,9 @@ if fcntl:
                 pass
 
         def run (self):
+            if self.queues > 1:
+                self.rxloop (self.tap)
+                return
             while True:
                 if self.stopnow or not self.tap:
                     break
@@ -289,15 +405,246 @@ if fcntl:
                     self.receive (len (pkt), pkt, None)
                 except OSError as e:
                     break
+
+        def rxloop (self, fd):
+            """Receive loop for one queue of a multi-queue TAP.  When
+            the queue is readable, read frames until there are no more
+            (EAGAIN) or all the buffers are full, then process them.
+            """
+            bufs = [ bytearray (ETH_MTU) for i in range (datalink.RECVBATCH) ]
+            views = [ memoryview (b) for b in bufs ]
+            sellist = ( fd, )
+            lens = list ()
+            # Each queue thread has its own stop flag.  For the first
+            # queue, this is the datalink's own thread.
+            me = threading.current_thread ()
+            while not me.stopnow:
+                try:
+                    try:
+                        r, w, x = select.select (sellist, (), sellist,
+                                                 ETH_TMO / 1000)
+                    except select.error as e:
+                        r = True
+                    if not r:
+                        continue
+                    lens.clear ()
+                    for b in bufs:
+                        try:
+                            l = os.readv (fd, (b,))
+                        except BlockingIOError:
+                            break
+                        if not l:
+                            break
+                        lens.append (l)
+                    with self.rxlock:
+                        for l, v in zip (lens, views):
+                            self.receive (l, v[:l], None)
+                except OSError as e:
+                    break
 else:
     _TapEth = None
+
+# Definitions for Linux AF_PACKET sockets, from linux/if_packet.h
+SOL_PACKET = 263
+PACKET_ADD_MEMBERSHIP = 1
+PACKET_RX_RING = 5
+PACKET_VERSION = 10
+PACKET_TX_RING = 13
+PACKET_MR_PROMISC = 1
+TPACKET_V3 = 2
+ETH_P_ALL = 3
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+TP_STATUS_AVAILABLE = 0
+TP_STATUS_SEND_REQUEST = 1
+# struct tpacket_req3
+tpacket_req3 = struct.Struct ("=7I")
+# struct packet_mreq
+packet_mreq = struct.Struct ("=iHH8s")
+# Fields of struct tpacket_block_desc starting at offset 8:
+# block_status, num_pkts, offset_to_first_pkt
+BLKHDR = 8
+blkhdr = struct.Struct ("=III")
+blkstatus = struct.Struct ("=I")
+# Fields of struct tpacket3_hdr: tp_next_offset, tp_snaplen, tp_mac
+pkthdr = struct.Struct ("=I8xI8xH")
+# Fields tp_len and tp_status, at offset 16 in struct tpacket3_hdr
+TXHDR = 16
+txhdr = struct.Struct ("=II")
+# Transmit data starts after the aligned struct tpacket3_hdr
+TXDATA = 48
+
+if hasattr (socket, "AF_PACKET"):
+    class _PacketEth (_Ethernet):
+        """Linux AF_PACKET socket with memory mapped receive and
+        transmit rings (TPACKET_V3).
+
+        The kernel fills the receive ring a block of frames at a time,
+        and hands over a block when it is full or when the block
+        timeout expires.  The receive thread then processes every
+        frame in the block in place, without a system call or copy
+        per frame, and returns the block to the kernel.  Only frames
+        that pass the address and protocol filters are copied.  Those
+        filters are also compiled to BPF and attached to the socket,
+        so frames no port wants never get into the ring at all.
+        Transmit frames are copied into the next free slot of the
+        transmit ring and the kernel is told to send them.
+        """
+        # Ring geometry.  Block size must be a multiple of the page
+        # size, frame size a multiple of 16.
+        BLOCKSIZE = 1 << 16
+        RXBLOCKS = 32
+        TXBLOCKS = 2
+        FRAMESIZE = 2048
+        # Receive block timeout, in ms.  A partially filled block is
+        # handed over after this time.
+        RXTMO = 10
+        copy_accepted = True
+        # Attach the receive filter to the socket
+        kernel_filter = True
+        socket = None
+
+        def open (self):
+            self.socket = self.mmap = self.ring = None
+            bs = self.BLOCKSIZE
+            fs = self.FRAMESIZE
+            self.txframes = self.TXBLOCKS * bs // fs
+            self.txbase = self.RXBLOCKS * bs
+            self.txnext = 0
+            try:
+                sock = socket.socket (socket.AF_PACKET, socket.SOCK_RAW,
+                                      socket.htons (ETH_P_ALL))
+            except OSError as e:
+                logging.error ("Can't open packet socket for {}: {}",
+                               self.name, e)
+                return
+            try:
+                sock.setsockopt (SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+                req = tpacket_req3.pack (bs, self.RXBLOCKS, fs,
+                                         self.RXBLOCKS * bs // fs,
+                                         self.RXTMO, 0, 0)
+                sock.setsockopt (SOL_PACKET, PACKET_RX_RING, req)
+                req = tpacket_req3.pack (bs, self.TXBLOCKS, fs,
+                                         self.txframes, 0, 0, 0)
+                sock.setsockopt (SOL_PACKET, PACKET_TX_RING, req)
+                self.mmap = mmap.mmap (sock.fileno (),
+                                       (self.RXBLOCKS + self.TXBLOCKS) * bs,
+                                       mmap.MAP_SHARED,
+                                       mmap.PROT_READ | mmap.PROT_WRITE)
+                sock.bind ((self.dev, ETH_P_ALL))
+                # Always set promiscuous mode
+                mreq = packet_mreq.pack (socket.if_nametoindex (self.dev),
+                                         PACKET_MR_PROMISC, 0, b"")
+                sock.setsockopt (SOL_PACKET, PACKET_ADD_MEMBERSHIP, mreq)
+                self.socket = sock
+                self.newfilter ()
+            except OSError as e:
+                logging.error ("Can't set up packet socket for {}: {}",
+                               self.name, e)
+                if self.mmap:
+                    self.mmap.close ()
+                    self.mmap = None
+                sock.close ()
+                self.socket = None
+                return
+            self.ring = memoryview (self.mmap)
+            super ().open ()
+
+        def close (self):
+            # Wait for the receive thread to exit, since it is
+            # referencing the ring.
+            self.stop (True)
+            sock, m, ring = self.socket, self.mmap, self.ring
+            self.socket = self.mmap = self.ring = None
+            try:
+                ring.release ()
+                m.close ()
+            except Exception:
+                pass
+            try:
+                sock.close ()
+            except Exception:
+                pass
+
+        def update_filter (self, fs):
+            """Attach the receive filter to the socket as a BPF
+            program.  The argument (PCAP filter string) is not used,
+            the program is compiled from the port settings.
+            """
+            sock = self.socket
+            if not self.kernel_filter or not sock:
+                return
+            prog = bpf.Program (bpf.compile (self))
+            try:
+                sock.setsockopt (socket.SOL_SOCKET, bpf.SO_ATTACH_FILTER,
+                                 prog.fprog)
+                logging.trace ("dev {} new kernel filter {}", self.dev, fs)
+            except OSError as e:
+                logging.error ("Can't set kernel filter for {}: {}",
+                               self.name, e)
+
+        def send_frame (self, buf, skip = None):
+            """Send an Ethernet frame.  Ignore any errors, because that's
+            the DECnet way.  That includes a full transmit ring.
+            """
+            ring = self.ring
+            if not ring:
+                return
+            off = self.txbase + self.txnext * self.FRAMESIZE
+            if blkstatus.unpack_from (ring, off + TXHDR + 4)[0] != \
+               TP_STATUS_AVAILABLE:
+                return
+            l = len (buf)
+            ring[off + TXDATA:off + TXDATA + l] = buf
+            txhdr.pack_into (ring, off + TXHDR, l, TP_STATUS_SEND_REQUEST)
+            self.txnext = (self.txnext + 1) % self.txframes
+            try:
+                self.socket.send (b"", socket.MSG_DONTWAIT)
+            except (OSError, AttributeError):
+                pass
+
+        def run (self):
+            ring = self.ring
+            bs = self.BLOCKSIZE
+            poll = select.poll ()
+            poll.register (self.socket, datalink.REGPOLLIN)
+            blk = 0
+            while not self.stopnow:
+                off = blk * bs
+                status, count, pos = blkhdr.unpack_from (ring, off + BLKHDR)
+                if not status & TP_STATUS_USER:
+                    # Nothing ready yet, wait for the kernel
+                    try:
+                        poll.poll (ETH_TMO)
+                    except select.error:
+                        pass
+                    continue
+                # Process all the frames in this block
+                pos += off
+                for i in range (count):
+                    nextoff, snaplen, mac = pkthdr.unpack_from (ring, pos)
+                    start = pos + mac
+                    self.receive (snaplen, ring[start:start + snaplen], None)
+                    pos += nextoff
+                # Give the block back to the kernel
+                blkstatus.pack_into (ring, off + BLKHDR, TP_STATUS_KERNEL)
+                blk = (blk + 1) % self.RXBLOCKS
+else:
+    _PacketEth = None
      
 class _PcapEth (_Ethernet):
+    # Packets are received in batches, into a buffer pool.  The pool
+    # buffers of accepted packets are handed over to the node rather
+    # than copied again (see receive_batch), so copy_accepted is not
+    # needed.
+    
     def __init__ (self, owner, name, dev, config):
         super ().__init__ (owner, name, dev, config)
         self.pcap = pcap.pcapObject ()
         self.opened = False
         self.filter_str = None
+        self.bufsize = config.buffer_size * 1024
+        self.immediate = config.immediate
 
     def update_filter (self, fs):
         """This method is called whenever the set of enabled addresses
@@ -311,7 +658,8 @@ class _PcapEth (_Ethernet):
         
     def open (self):
         # Always set promiscuous mode
-        self.pcap.open_live (self.dev, ETH_MTU, 1, ETH_TMO)
+        self.pcap.create_live (self.dev, ETH_MTU, 1, ETH_TMO,
+                               self.bufsize, self.immediate)
         super ().open ()
         self.opened = True
         logging.trace ("opened {}, pcap handle {}", self.dev, self.pcap.pcap)
@@ -332,12 +680,20 @@ class _PcapEth (_Ethernet):
         except IOError:
             pass
         
+    def receive_batch (self, batch):
+        # Return the indexes of the packets that were passed up, so
+        # the pcap object gives them up rather than reusing their
+        # buffers for the next batch.
+        return [ i for i, (plen, packet, ts) in enumerate (batch)
+                 if self.receive (plen, packet, ts) ]
+        
     def run (self):
         while True:
             if self.stopnow:
                 break
             try:
-                cnt = self.pcap.dispatch (0, self.receive)
+                cnt = self.pcap.dispatch_batch (datalink.RECVBATCH,
+                                                self.receive_batch)
             except pcap._pcap.error:
                 break
 
@@ -346,6 +702,9 @@ class _BridgeEth (_Ethernet):
     external to this process), via UDP packets each carrying an
     Ethernet datagram.
     """
+    # Received frames are views into the receive buffer pool.
+    copy_accepted = True
+    
     def __init__ (self, owner, name, dev, config):
         if config.hwaddr == NULLID:
             config.random_address = True
@@ -353,6 +712,7 @@ class _BridgeEth (_Ethernet):
         self.source = host.SourceAddress (config, config.source_port)
         self.host = host.HostAddress (config.destination, config.dest_port,
                                       self.source)
+        self.txq = datalink.DatagramQueue (self)
         logging.debug ("Ethernet bridge {} initialized on {}, to {}",
                        self.name, self.source, self.host)
         
@@ -362,6 +722,7 @@ class _BridgeEth (_Ethernet):
         
     def close (self):
         super ().close ()
+        self.txq.clear ()
         try:
             self.socket.close ()
         except Exception:
@@ -372,6 +733,7 @@ class _BridgeEth (_Ethernet):
         poll = select.poll ()
         sock = self.socket
         poll.register (sock, datalink.REGPOLLIN)
+        rb = datalink.RecvBatch (1514)
         logging.trace ("Ethernet bridge {} receive thread started", self.name)
         while True:
             # Look for traffic
@@ -384,18 +746,19 @@ class _BridgeEth (_Ethernet):
                     break
                 # Not error, so we have incoming data.
                 try:
-                    msg, addr = sock.recvfrom (1514)
+                    msgs = rb.receive (sock)
                 except socket.error:
-                    msg = None
-                if not msg or len (msg) <= 4:
-                    self.disconnected ()
-                    return
-                if not self.host.valid (addr):
-                    # Not from peer, ignore
-                    continue
-                if msg[6] & 1:
-                    continue   # source routed???  ignore it
-                self.receive (len (msg), msg, addr)
+                    msgs = [ (None, None) ]
+                for msg, addr in msgs:
+                    if not msg or len (msg) <= 4:
+                        self.disconnected ()
+                        return
+                    if not self.host.valid (addr):
+                        # Not from peer, ignore
+                        continue
+                    if msg[6] & 1:
+                        continue   # source routed???  ignore it
+                    self.receive (len (msg), msg, addr)
 
     def send_frame (self, buf, skip = None):
         """Send an Ethernet frame.  Ignore any errors, because that's
@@ -403,9 +766,12 @@ class _BridgeEth (_Ethernet):
         """
         if not self.socket:
             return
+        # The frame is queued, to be sent along with any others sent
+        # while handling the current work.  The sender may reuse its
+        # buffer, so take a copy.
         try:
-            self.socket.sendto (buf, self.host.sockaddr)
-        except (IOError, socket.error, TypeError) as e:
+            self.txq.send (self.socket, self.host.sockaddr, bytes (buf))
+        except (AttributeError, TypeError):
             pass
         
         
@@ -424,6 +790,8 @@ class Ethernet (datalink.Datalink):
                 config.dest_port = int (rport)
         if api == "tap" and _TapEth:
             c = _TapEth
+        elif api == "packet" and _PacketEth:
+            c = _PacketEth
         elif api == "pcap":
             c = _PcapEth
         elif api == "bridge" or api == "udp":
@@ -31,23 +31,21 @@ class GREPort (datalink.BcPort):
         """Send an "Ethernet" frame to the specified address.  Since GRE
         is point to point, the address is ignored.
         """
-        l = len (msg)
-        if logging.tracing:
-            logging.tracepkt ("Sending packet on {}",
-                              self.parent.name, pkt = msg)
+        parts, l = self.msgparts (msg)
         f = self.frame
         if self.pad:
             if l > 1498:
                 raise ValueError ("Ethernet packet too long")
             f[4] = l & 0xff
             f[5] = l >> 8
-            f[6:6 + l] = makebytes (msg)
-            l += 6
+            l = self.fillframe (f, 6, parts)
         else:
             if l > 1500:
                 raise ValueError ("Ethernet packet too long")
-            f[4:4 + l] = msg
-            l += 4
+            l = self.fillframe (f, 4, parts)
+        if logging.tracing:
+            logging.tracepkt ("Sending packet on {}",
+                              self.parent.name, pkt = f[4:l])
         self.counters.bytes_sent += l
         self.counters.pkts_sent += 1
         # We don't do padding, since GRE doesn't require it (it isn't
@@ -80,6 +78,7 @@ class GRE (datalink.BcDatalink, StopThread):
             raise ValueError ("Source port must be specified")
         self.host = host.HostAddress (dest, GREPROTO, self.source)
         self.socket = None
+        self.txq = datalink.DatagramQueue (self)
         logging.debug ("GRE datalink {} initialized:\n"
                        "  Dest:   {}\n"
                        "  Source: {}",
@@ -96,6 +95,7 @@ class GRE (datalink.BcDatalink, StopThread):
         
     def close (self):
         self.stop ()
+        self.txq.clear ()
         if self.socket:
             self.socket.close ()
         self.socket = None
@@ -104,12 +104,14 @@ class GRE (datalink.BcDatalink, StopThread):
         return super ().create_port (owner, proto, pad)
 
     def send_frame (self, buf):
-        """Send an GRE-encapsulated Ethernet frame.  Ignore any errors,
-        because that's the DECnet way.
+        """Send an GRE-encapsulated Ethernet frame.  It is queued, to
+        be sent along with any others sent while handling the current
+        work.  The port reuses its frame buffer, so this takes a copy.
+        Ignore any errors, because that's the DECnet way.
         """
         try:
-            self.socket.sendto (buf, self.host.sockaddr)
-        except (AttributeError, IOError, TypeError):
+            self.txq.send (self.socket, self.host.sockaddr, bytes (buf))
+        except (AttributeError, TypeError):
             pass
         
     def run (self):
@@ -119,6 +121,7 @@ class GRE (datalink.BcDatalink, StopThread):
             return
         p = select.poll ()
         p.register (sock, datalink.REGPOLLIN)
+        rb = datalink.RecvBatch (1504)
         while True:
             try:
                 pl = p.poll (datalink.POLLTS)
@@ -134,57 +137,58 @@ class GRE (datalink.BcDatalink, StopThread):
             if mask & datalink.POLLERRHUP:
                 return
             if mask & select.POLLIN:
-                # Receive a packet
+                # Receive the pending packets
                 try:
-                    msg, addr = sock.recvfrom (1504)
+                    msgs = rb.receive (sock)
                 except (AttributeError, OSError, socket.error):
-                    msg = None
-                if not msg or len (msg) <= 4:
-                    continue
-                if not self.host.valid (addr):
-                    # Not from peer, ignore
                     continue
-                # Skip past the IP header, if we're using IPv4.
-                # Strangely enough, we don't get the header if IPv6.
-                if self.skipIpHdr:
-                    ver, hlen = divmod (msg[0], 16)
-                    if ver == 4:
-                        # IPv4, use the header length to skip past header
-                        # and any options.
-                        pos = 4 * hlen
+                for msg, addr in msgs:
+                    if not msg or len (msg) <= 4:
+                        continue
+                    if not self.host.valid (addr):
+                        # Not from peer, ignore
+                        continue
+                    # Skip past the IP header, if we're using IPv4.
+                    # Strangely enough, we don't get the header if IPv6.
+                    if self.skipIpHdr:
+                        ver, hlen = divmod (msg[0], 16)
+                        if ver == 4:
+                            # IPv4, use the header length to skip past header
+                            # and any options.
+                            pos = 4 * hlen
+                        else:
+                            # Unknown IP header version
+                            logging.trace ("Unknown IP header version {}", ver)
+                            continue
                     else:
-                        # Unknown IP header version
-                        logging.trace ("Unknown IP header version {}", ver)
+                        pos = 0
+                    if logging.tracing:
+                        logging.tracepkt ("Received packet on {}",
+                                          self.name, pkt = msg)
+                    if msg[pos:pos + 2] != greflags:
+                        # Unexpected flags or version in header, ignore
+                        logging.debug ("On {}, unexpected header {}",
+                                       self.name, msg[pos:pos + 2])
                         continue
-                else:
-                    pos = 0
-                if logging.tracing:
-                    logging.tracepkt ("Received packet on {}",
-                                      self.name, pkt = msg)
-                if msg[pos:pos + 2] != greflags:
-                    # Unexpected flags or version in header, ignore
-                    logging.debug ("On {}, unexpected header {}",
-                                   self.name, msg[pos:pos + 2])
-                    continue
-                proto = msg[pos + 2:pos + 4]
-                try:
-                    port = self.ports[proto]
-                except KeyError:
-                    # No protocol type match, ignore msg
-                    self.counters.unk_dest += 1
-                    continue
-                plen = len (msg) - (pos + 4)
-                port.counters.bytes_recv += plen
-                port.counters.pkts_recv += 1
-                if port.pad:
-                    plen2 = msg[pos + 4] + (msg[pos + 5] << 8)
-                    if plen < plen2:
-                        logging.debug ("On {}, msg length field {} " \
-                                       "inconsistent with msg length {}",
-                                       self.name, plen2, plen)
+                    proto = bytes (msg[pos + 2:pos + 4])
+                    try:
+                        port = self.ports[proto]
+                    except KeyError:
+                        # No protocol type match, ignore msg
+                        self.counters.unk_dest += 1
                         continue
-                    msg = memoryview (msg)[pos + 6:pos + 6 + plen2]
-                else:
-                    msg = memoryview (msg)[pos + 4:]
-                self.node.addwork (Received (port.owner,
-                                             src = None, packet = msg))
+                    plen = len (msg) - (pos + 4)
+                    port.counters.bytes_recv += plen
+                    port.counters.pkts_recv += 1
+                    if port.pad:
+                        plen2 = msg[pos + 4] + (msg[pos + 5] << 8)
+                        if plen < plen2:
+                            logging.debug ("On {}, msg length field {} " \
+                                           "inconsistent with msg length {}",
+                                           self.name, plen2, plen)
+                            continue
+                        msg = bytes (msg[pos + 6:pos + 6 + plen2])
+                    else:
+                        msg = bytes (msg[pos + 4:])
+                    self.node.addwork (Received (port.owner,
+                                                 src = None, packet = msg))
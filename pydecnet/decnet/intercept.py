@@ -40,14 +40,17 @@ route headers, since these are optional for most packet types.
 
 4. Intercept, this node is a Phase III or IV router.  Similar to Phase
 II full intercept, but since Phase III/IV networks can drop packets,
-intercept will save a copy of data packets (anything that is
-acknowledged) and will retransmit these if needed (until acknowledged
-or timeout).  (TODO: this packet tracking and timeout handling is not
-yet implemented.)
+intercept will save a copy of data packets (data, interrupt and link
+service messages sent by the Phase II node on an intercepted logical
+link) and will retransmit these if needed (until acknowledged or
+timeout).  Connect and disconnect messages are not saved; for those
+the Phase III/IV node at the other end does the retransmitting, or
+the Phase II user retries the connect.
 """
 
 from .common import *
 from . import events
+from . import timers
 from .nsp_packets import *
 from .routing_packets import RouteHdr, ShortData, LongData
 
@@ -290,7 +293,17 @@ class FullIntercept (BaseIntercept):
             # Phase II node is terminating this connection, delete it
             # from the database if present
             logging.trace ("Removing conn {} for adj {}", nsppkt.srcaddr, adj)
-            self.conndb.pop ((adj.rnodeid, nsppkt.srcaddr), None)
+            self.delconn ((adj.rnodeid, nsppkt.srcaddr))
+
+    def delconn (self, key):
+        "Delete a connection database entry, if present"
+        self.conndb.pop (key, None)
+
+    def acked (self, nsppkt, adj):
+        """Process the ACK fields of a packet being sent to the Phase II
+        node.  Only Phase III/IV intercept needs to do anything here.
+        """
+        pass
 
     def send (self, pkt, adj):
         """Handle sending a packet to a Phase II node.  The supplied
@@ -325,8 +338,10 @@ class FullIntercept (BaseIntercept):
             # Remote end is terminating this connection, delete it
             # from the database if present
             logging.trace ("Removing conn {} for adj {}", nsppkt.dstaddr, adj)
-            self.conndb.pop ((adj.rnodeid, nsppkt.srcaddr), None)
-            self.conndb.pop ((adj.rnodeid, nsppkt.dstaddr), None)
+            self.delconn ((adj.rnodeid, nsppkt.srcaddr))
+            self.delconn ((adj.rnodeid, nsppkt.dstaddr))
+        elif isinstance (nsppkt, AckHdr):
+            self.acked (nsppkt, adj)
         if pkt.srcnode != self.nodeid and not isinstance (nsppkt, AckHdr):
             # It didn't come from this node, so supply a routing
             # header if it is the kind that requires one.
@@ -339,12 +354,222 @@ class FullIntercept (BaseIntercept):
             pkt = pkt.payload
         return True, pkt
 
+class SaveRing:
+    """Copies of the messages sent by the Phase II node on one
+    subchannel of an intercepted logical link, which have not yet been
+    acknowledged by the remote node.
+
+    The ring has a fixed number of slots, indexed by sequence number
+    modulo the ring size, so the memory used per logical link is
+    bounded no matter how far behind the remote node gets.  The size
+    must be a power of two so that indexing is consistent when the
+    sequence number wraps around.  If the ring is full, further
+    messages are forwarded but not saved.
+    """
+    __slots__ = ("slots", "first", "count")
+
+    def __init__ (self, size):
+        self.slots = [ None ] * size
+        self.first = Seq (0)
+        self.count = 0
+
+    def __len__ (self):
+        return self.count
+
+    def __iter__ (self):
+        size = len (self.slots)
+        for i in range (self.count):
+            yield self.slots[(self.first + i) % size]
+
+    def save (self, segnum, msg):
+        """Save a copy of a message with the given segment number.
+        Return True if it was saved (or was saved before), False if
+        there is no room for it.
+        """
+        size = len (self.slots)
+        if not self.count:
+            self.first = segnum
+        elif segnum < self.first:
+            # Already acknowledged
+            return True
+        else:
+            pos = segnum - self.first
+            if pos < self.count:
+                # Sent again by the Phase II node, just keep the
+                # latest copy.
+                self.slots[segnum % size] = msg
+                return True
+            if pos > self.count or self.count == size:
+                # Out of sequence, or no room
+                return False
+        self.slots[segnum % size] = msg
+        self.count += 1
+        return True
+
+    def ack (self, num):
+        """Discard the saved messages up to and including segment
+        number "num".  Return the number of messages discarded.
+        """
+        if not self.count or num < self.first:
+            return 0
+        size = len (self.slots)
+        n = min (num - self.first + 1, self.count)
+        for i in range (n):
+            self.slots[(self.first + i) % size] = None
+        self.first += n
+        self.count -= n
+        return n
+
+class InterceptLink (timers.Timer):
+    """Retransmit state for one intercepted logical link.  This is
+    its own retransmit timer.
+    """
+    __slots__ = ("owner", "key", "srcnode", "dstnode",
+                 "data", "other", "tries", "rtxtime")
+    
+    def __init__ (self, owner, key, srcnode, dstnode):
+        super ().__init__ ()
+        self.owner = owner
+        self.key = key
+        self.srcnode = srcnode
+        self.dstnode = dstnode
+        self.data = SaveRing (owner.DATARING)
+        self.other = SaveRing (owner.OTHERRING)
+        self.tries = 0
+        self.rtxtime = owner.RTXTIME
+
+    def dispatch (self, item):
+        self.owner.timeout (self)
+
 class P4Intercept (FullIntercept):
+    """Full intercept for a Phase III or IV router.
+
+    Phase II NSP counts on the point to point datalink for reliable
+    delivery, so it does not retransmit, but the Phase III/IV network
+    beyond this node may lose packets.  For each intercepted logical
+    link, we save a copy of each data, interrupt and link service
+    message the Phase II node sends, and retransmit them on a timer
+    until the remote node acknowledges them.  A NAK from the remote
+    node triggers an immediate retransmit.  If there is still no
+    acknowledgment after a number of tries, the saved messages are
+    discarded; at that point the remote node will presumably time out
+    the connection.
+    """
+    DATARING = 32       # Data segments saved per link
+    OTHERRING = 4       # Interrupt/Link Service messages saved per link
+    RTXTIME = 5         # Initial retransmit timeout in seconds
+    RTXMAX = 60         # Retransmit timeout limit for backoff
+    RETRIES = 8         # Retransmits before giving up
+    
     def __init__ (self, parent):
         super ().__init__ (parent)
+        self.links = dict ()
+        self.retransmits = 0
         logging.debug ("Initialized full Phase III/IV intercept for {}", parent)
 
-    # TODO: more stuff needed for the Phase III/IV case
+    def recv (self, pkt, adj):
+        ok, ret = super ().recv (pkt, adj)
+        if ok and ret.dstnode != self.nodeid:
+            self.save (ret, adj)
+        return ok, ret
+
+    def save (self, pkt, adj):
+        """Save a copy of a packet being forwarded from the Phase II
+        node, if it is one that the remote node will acknowledge.
+        """
+        try:
+            nsppkt = NspHdr (pkt.payload)
+        except packet.DecodeError:
+            # Already logged when it was parsed to find the route
+            return
+        if isinstance (nsppkt, DataSeg):
+            data = True
+        elif isinstance (nsppkt, (IntMsg, LinkSvcMsg)):
+            data = False
+        else:
+            return
+        key = (adj.rnodeid, nsppkt.srcaddr)
+        if key not in self.conndb:
+            # Not an intercepted logical link
+            return
+        link = self.links.get (key)
+        if not link:
+            link = InterceptLink (self, key, pkt.srcnode, pkt.dstnode)
+            self.links[key] = link
+        ring = link.data if data else link.other
+        if ring.save (nsppkt.segnum, makebytes (pkt.payload)):
+            if not link.islinked ():
+                self.node.timers.start (link, link.rtxtime)
+        else:
+            logging.trace ("intercept {}: can't save {} for link {}",
+                           adj, nsppkt, key)
+
+    def acked (self, nsppkt, adj):
+        link = self.links.get ((adj.rnodeid, nsppkt.dstaddr))
+        if not link:
+            return
+        if isinstance (nsppkt, (DataSeg, AckData)):
+            this, other = link.data, link.other
+        else:
+            this, other = link.other, link.data
+        done = 0
+        nak = False
+        for acknum in (nsppkt.acknum, nsppkt.acknum2):
+            if acknum:
+                done += acknum.chan (this, other).ack (acknum.num)
+                nak = nak or acknum.is_nak ()
+        if done:
+            # Progress, so reset the backoff
+            link.tries = 0
+            link.rtxtime = self.RTXTIME
+        if not link.data and not link.other:
+            self.node.timers.stop (link)
+        elif nak:
+            self.retransmit (link)
+        elif done:
+            self.node.timers.start (link, link.rtxtime)
+
+    def timeout (self, link):
+        if not link.data and not link.other:
+            return
+        link.tries += 1
+        if link.tries > self.RETRIES:
+            logging.debug ("intercept {}: giving up retransmitting for "
+                           "link {}", self.parent, link.key)
+            del self.links[link.key]
+            return
+        link.rtxtime = min (link.rtxtime * 2, self.RTXMAX)
+        self.retransmit (link)
+
+    def retransmit (self, link):
+        """Send all saved messages for the link onward again, and
+        restart its timer.
+        """
+        circ = self.parent
+        for ring in (link.data, link.other):
+            for msg in ring:
+                self.retransmits += 1
+                pkt = ShortData (dstnode = link.dstnode,
+                                 srcnode = link.srcnode,
+                                 rqr = 1, rts = 0, visit = 0,
+                                 payload = msg)
+                pkt.src = circ.adj
+                circ.parent.dispatch (pkt)
+        self.node.timers.start (link, link.rtxtime)
+
+    def delconn (self, key):
+        super ().delconn (key)
+        link = self.links.pop (key, None)
+        if link:
+            self.node.timers.stop (link)
+
+    def adjdown (self, adj):
+        """The circuit to the Phase II node went down, discard all
+        saved messages.
+        """
+        for link in self.links.values ():
+            self.node.timers.stop (link)
+        self.links.clear ()
     
 class P2Intercept (FullIntercept):
     def __init__ (self, parent):
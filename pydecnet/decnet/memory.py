@@ -0,0 +1,356 @@
+#!
+
+"""In-memory datalinks, for simulating networks within one process.
+
+A Memory circuit is attached to a named "wire" (point to point mode)
+or "segment" (LAN mode) given by the device argument.  Circuits of
+different nodes running in the same process that name the same wire
+or segment are connected to each other.  Frames are handed directly to
+the work queue of the receiving node, so there are no sockets or
+receive threads involved.
+
+Transmission can be shaped to model a real link: a fixed delay, a
+transmit rate, and random loss.  The loss decisions come from a
+random number generator seeded from the configuration, so for a given
+configuration the sequence of decisions is the same every time: if
+the Nth frame sent on a circuit is lost in one run, so is the Nth
+frame in the next.  Only that is repeatable, not the run as a whole.
+Delays are measured with the real clock, and the nodes run in their
+own threads, so the timing of events, and therefore which frames are
+sent in what order, can differ from one run to the next.
+"""
+
+import heapq
+import random
+
+from .common import *
+from . import logging
+from . import datalink
+from . import ethernet
+
+# The wires and segments that currently exist, by name.  Each is
+# created when the first circuit attaches to it, and forgotten when
+# the last one detaches.
+_segments = dict ()
+_segments_lock = threading.Lock ()
+
+class _Scheduler (StopThread):
+    """Delivery thread for frames that are delayed by traffic shaping.
+
+    Frames to deliver later are kept in a heap ordered by delivery
+    time.  Frames that are due at the same time are delivered in the
+    order they were sent.  The thread is started when first needed
+    and then stays around (it is a daemon thread, like the others).
+    """
+    def __init__ (self):
+        super ().__init__ (name = "memory-delivery")
+        self.cv = threading.Condition ()
+        self.heap = list ()
+        self.seq = 0
+
+    def schedule (self, due, fun, *args):
+        "Call fun (*args) at time due, in the delivery thread"
+        with self.cv:
+            self.seq += 1
+            heapq.heappush (self.heap, (due, self.seq, fun, args))
+            if not self.is_alive ():
+                self.start ()
+            self.cv.notify ()
+
+    def run (self):
+        while not self.stopnow:
+            with self.cv:
+                while not self.heap:
+                    self.cv.wait ()
+                due = self.heap[0][0]
+                now = time.monotonic ()
+                if due > now:
+                    # Not yet, wait until then or until something
+                    # earlier is scheduled.
+                    self.cv.wait (due - now)
+                    continue
+                due, seq, fun, args = heapq.heappop (self.heap)
+            try:
+                fun (*args)
+            except Exception:
+                logging.exception ("Exception in memory datalink delivery")
+
+scheduler = _Scheduler ()
+
+class Shaper (object):
+    """Traffic shaping for the frames sent by one circuit, as set by
+    its --delay, --rate and --loss configuration parameters.
+    """
+    def __init__ (self, name, config):
+        self.delay = (config.delay or 0) / 1000
+        self.rate = config.rate or 0
+        self.loss = (config.loss or 0) / 100
+        # Seed the random number generator from the circuit name as
+        # well as the configured seed, so every circuit has its own
+        # sequence of loss decisions but the sequences are the same
+        # for each run.
+        self.random = random.Random ("{}:{}".format (config.seed, name))
+        # The time at which the transmitter will finish sending the
+        # frames handed to it so far.
+        self.txdone = 0
+        self.dropped = 0
+        self.direct = not (self.delay or self.rate)
+
+    def due (self, nbytes):
+        """Return the time at which a frame of the given length will
+        arrive at the other end, or None if it is lost.  The frame
+        still takes up transmitter time if it is lost.
+        """
+        now = time.monotonic ()
+        if self.rate:
+            self.txdone = max (self.txdone, now) + nbytes * 8 / self.rate
+            now = self.txdone
+        if self.loss and self.random.random () < self.loss:
+            self.dropped += 1
+            return None
+        return now + self.delay
+
+    def deliver (self, nbytes, fun, *args):
+        """Arrange for fun (*args) to be called to deliver a frame of
+        length "nbytes" to its destination, subject to shaping.
+        """
+        if self.direct and not self.loss:
+            # Fast path: hand it over right now.
+            fun (*args)
+            return
+        due = self.due (nbytes)
+        if due is None:
+            return
+        if self.direct:
+            fun (*args)
+        else:
+            scheduler.schedule (due, fun, *args)
+
+class Segment (object):
+    """A wire or LAN segment, i.e., the set of circuits that are
+    connected to each other.  A wire connects at most two circuits.
+    """
+    def __init__ (self, name, lan):
+        self.name = name
+        self.lan = lan
+        self.members = list ()
+
+    @staticmethod
+    def attach (dl):
+        """Attach the supplied datalink to the wire or segment named by
+        its device argument.  Returns a pair: the Segment object (None
+        if the attach is not allowed), and for a wire, the datalink at
+        the other end if this attach connected the two.
+        """
+        name = dl.config.device
+        with _segments_lock:
+            seg = _segments.get (name)
+            if seg is None:
+                seg = _segments[name] = Segment (name, dl.lan)
+            elif seg.lan != dl.lan:
+                logging.error ("Memory circuit {} mode does not match "
+                               "other circuits on {}", dl.name, name)
+                return None, None
+            if dl in seg.members:
+                return seg, None
+            if not dl.lan and len (seg.members) >= 2:
+                logging.error ("Memory circuit {}: wire {} already "
+                               "has two circuits", dl.name, name)
+                return None, None
+            seg.members.append (dl)
+            if dl.lan or len (seg.members) < 2:
+                return seg, None
+            peer = seg.members[0]
+            dl.peer = peer
+            peer.peer = dl
+            return seg, peer
+
+    def detach (self, dl):
+        """Detach the supplied datalink.  For a wire, if the datalink
+        was connected to the other end, that end is detached as well,
+        and returned so the caller can tell it.  Otherwise the return
+        value is None.
+        """
+        with _segments_lock:
+            if dl not in self.members:
+                return None
+            self.members.remove (dl)
+            peer = None
+            if not self.lan:
+                peer = dl.peer
+                dl.peer = None
+                if peer:
+                    peer.peer = None
+                    if peer in self.members:
+                        self.members.remove (peer)
+            if not self.members and _segments.get (self.name) is self:
+                del _segments[self.name]
+            return peer
+
+    def others (self, dl):
+        "Return the members of the segment other than dl"
+        with _segments_lock:
+            return [ m for m in self.members if m is not dl ]
+
+class _MemoryPtp (datalink.PtpDatalink):
+    """Point to point in-memory datalink.
+
+    When a circuit is started it attaches to its wire.  Once both ends
+    are attached, both report the datalink up.  If either end stops or
+    restarts, it detaches from the wire; the other end then also
+    detaches and starts over, so a restart at one end is seen by the
+    other as it would be on a real datalink.
+    """
+    lan = False
+
+    def __init__ (self, owner, name, config):
+        super ().__init__ (owner, name, config)
+        self.shaper = Shaper (self.tname, config)
+        self.seg = None
+        self.peer = None
+        logging.debug ("Memory datalink {} initialized on wire {}",
+                       self.name, config.device)
+
+    def validate (self, item):
+        if isinstance (item, datalink.Restart):
+            # Treat Restart as Reconnect without holdoff, as Multinet
+            # does.  The disconnect tells the other end.
+            item = datalink.Reconnect (self, True)
+            self.set_state (self.handle_reconnect (item))
+            return False
+        return super ().validate (item)
+
+    def handle_stop (self, item):
+        self.disconnect ()
+        return super ().handle_stop (item)
+
+    @setlabel ("Halted")
+    def s0 (self, item):
+        # There is no receive thread, so the connection is made here
+        # rather than in check_connection.
+        if isinstance (item, datalink.Start):
+            self.connect ()
+            return self.connecting
+
+    def connect (self):
+        self.seg, peer = Segment.attach (self)
+        if peer:
+            # The other end was waiting for us, tell both ends they
+            # are now connected.
+            peer.node.addwork (datalink.Connected (peer))
+            self.node.addwork (datalink.Connected (self))
+
+    def disconnect (self):
+        seg = self.seg
+        self.seg = None
+        if seg:
+            peer = seg.detach (self)
+            if peer:
+                # The other end was connected to us, so it starts
+                # over and waits for us to come back.
+                peer.node.addwork (datalink.Reconnect (peer, True))
+
+    def check_connection (self):
+        # Not used since there is no receive thread.
+        return True
+
+    def receive_loop (self):
+        pass
+
+    def connected (self):
+        self.report_up ()
+        return self.running
+
+    @setlabel ("Running")
+    def running (self, data):
+        # Running state.  This just passes up received messages.
+        if isinstance (data, Received):
+            msg = data.packet
+            if logging.tracing:
+                logging.tracepkt ("Received Memory message on {}",
+                                  self.name, pkt = msg)
+            if self.port:
+                self.counters.bytes_recv += len (msg)
+                self.counters.pkts_recv += 1
+                self.node.addwork (Received (self.port.owner, packet = msg))
+            else:
+                logging.trace ("Message discarded, no port open")
+
+    def send (self, msg, dest = None):
+        peer = self.peer
+        if peer and self.state == self.running:
+            # Make an immutable copy, since the caller may reuse the
+            # buffer once we return.
+            msg = bytes (msg)
+            mlen = len (msg)
+            if logging.tracing:
+                logging.tracepkt ("Sending Memory message on {}",
+                                  self.name, pkt = msg)
+            self.counters.bytes_sent += mlen
+            self.counters.pkts_sent += 1
+            self.shaper.deliver (mlen, peer.node.addwork,
+                                 Received (peer, packet = msg))
+
+class _MemoryLan (ethernet._Ethernet):
+    """LAN in-memory datalink.  This acts like an Ethernet, so it can
+    be used with the same clients (routing, MOP, bridge) as a real
+    one.  Every frame sent is given to all the other circuits attached
+    to the same segment, which apply their address filters to it as
+    an Ethernet interface would.
+    """
+    lan = True
+
+    def __init__ (self, owner, name, dev, config):
+        if config.hwaddr == NULLID:
+            config.random_address = True
+        super ().__init__ (owner, name, dev, config)
+        tname = "{}.{}".format (owner.node.nodename, name)
+        self.shaper = Shaper (tname, config)
+        self.seg = None
+        logging.debug ("Memory LAN {} initialized on segment {}",
+                       self.name, dev)
+
+    def open (self):
+        logging.debug ("Memory LAN {} hardware address is {}",
+                       self.name, self.hwaddr)
+        self.seg = Segment.attach (self)[0]
+
+    def close (self):
+        if self.seg:
+            self.seg.detach (self)
+            self.seg = None
+
+    def send_frame (self, buf, skip = None):
+        """Send a frame to every other circuit on the segment.  If
+        "skip" is supplied, it is the "extra" value of a frame received
+        on this segment (for this datalink, the datalink that sent it)
+        and that circuit is skipped.
+        """
+        seg = self.seg
+        if not seg:
+            return
+        dests = [ m for m in seg.others (self) if m is not skip ]
+        if dests:
+            # The port reuses its frame buffer, so make a copy.
+            frame = bytes (buf)
+            flen = len (frame)
+            self.shaper.deliver (flen, self.fanout, dests, flen, frame)
+
+    def fanout (self, dests, flen, frame):
+        # Give the frame to each destination, which applies its
+        # address filter.  The "extra" argument is this datalink.
+        for m in dests:
+            m.receive (flen, frame, self)
+
+# Factory class -- returns an instance of the appropriate Memory
+# datalink subclass given the mode specified.
+class Memory (datalink.Datalink):
+    def __new__ (cls, owner, name, config):
+        if not config.device:
+            raise ValueError ("Memory circuit requires a wire or segment name")
+        mode = (config.mode or "point").lower ()
+        if mode == "point":
+            return _MemoryPtp (owner, name, config)
+        elif mode == "lan":
+            return _MemoryLan (owner, name, config.device, config)
+        raise ValueError ("Unknown Memory circuit subtype {}".format (mode))
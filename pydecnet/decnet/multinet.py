@@ -19,6 +19,15 @@ from . import datalink
 from . import logging
 from . import host
 
+# Receive buffer size for TCP mode.  This holds at least one maximum
+# size message (64k plus the header) and typically many smaller ones,
+# all obtained by one receive call.
+RBUFSIZE = 128 * 1024
+
+# Maximum number of buffers in one sendmsg call.  This is the Linux
+# and BSD limit (IOV_MAX).
+IOVMAX = 1024
+
 class MultinetUdpPort (datalink.PtpPort):
     """Multinet is exactly like generic point to point except that the
     spurious start message workaround needs to be turned on if we use
@@ -102,7 +111,21 @@ class _Multinet (datalink.PtpDatalink):
             self.reconnect ()
         
 class _TcpMultinet (_Multinet):
+    def connected (self):
+        if self.config.nodelay:
+            # Send small messages right away rather than waiting for
+            # the previous ones to be acknowledged.  Messages are
+            # already combined into one write per burst, see "send".
+            try:
+                self.socket.setsockopt (socket.IPPROTO_TCP,
+                                        socket.TCP_NODELAY, 1)
+            except (AttributeError, OSError):
+                logging.trace ("Error setting TCP_NODELAY", exc_info = True)
+        return super ().connected ()
+
     def disconnect (self):
+        # Anything not yet sent belongs to the old connection
+        self.txq.clear ()
         if self.socket:
             # Shut down the socket, if any
             try:
@@ -119,18 +142,32 @@ class _TcpMultinet (_Multinet):
             
     def receive_loop (self):
         # Receive packets for the TCP modes, after the connection has
-        # been made.
-        while True:
-            # Look for traffic.  Start with the header
-            try:
-                bc = self.recvall (4)
-                bc = int.from_bytes (bc[:2], "little")
-                # Now receive exactly the byte count mentioned
-                msg = self.recvall (bc)
-            except IOError:
-                logging.trace ("Exception in receive loop", exc_info = True)
-                return
-            self.node.addwork (Received (self, packet = msg))
+        # been made.  Data is read into a buffer as it arrives, and
+        # every complete message in it is passed up before the next
+        # receive call.  A partial message at the end is moved to the
+        # start of the buffer and completed by the next receive.
+        buf = bytearray (RBUFSIZE)
+        with memoryview (buf) as mv:
+            end = 0
+            while True:
+                try:
+                    end += self.recvinto (mv[end:])
+                except IOError:
+                    logging.trace ("Exception in receive loop",
+                                   exc_info = True)
+                    return
+                start = 0
+                while end - start >= 4:
+                    bc = buf[start] + (buf[start + 1] << 8)
+                    mend = start + 4 + bc
+                    if mend > end:
+                        break
+                    msg = mv[start + 4:mend].tobytes ()
+                    start = mend
+                    self.node.addwork (Received (self, packet = msg))
+                if start:
+                    end -= start
+                    buf[:end] = mv[start:start + end]
         
     def send (self, msg, dest = None):
         sock = self.socket
@@ -142,15 +179,37 @@ class _TcpMultinet (_Multinet):
                                   self.name, pkt = msg)
             self.counters.bytes_sent += mlen
             self.counters.pkts_sent += 1
-            # TCP mode
+            # TCP mode.  The header and message go into the transmit
+            # queue as separate buffers, to be written along with any
+            # other messages sent in this burst.
             hdr = mlen.to_bytes (2, "little") + b"\000\000"
-            try:
-                self.socket.send (hdr + msg)
-            except (socket.error, AttributeError, OSError):
-                # AttributeError happens if socket has been
-                # changed to "None"
-                logging.trace ("send error", exc_info = True)
-                self.reconnect ()
+            self.queue_frame (hdr, msg)
+
+    def transmit (self, parts):
+        # Write the queued buffers with as few calls as possible,
+        # allowing for partial writes.
+        try:
+            sock = self.socket
+            if not hasattr (sock, "sendmsg"):
+                # Windows does not have sendmsg
+                sock.sendall (b"".join (parts))
+                return
+            i = 0
+            while i < len (parts):
+                n = sock.sendmsg (parts[i:i + IOVMAX])
+                # Skip what was sent, trimming a partly sent buffer
+                while n:
+                    l = len (parts[i])
+                    if n < l:
+                        parts[i] = memoryview (parts[i])[n:]
+                        break
+                    n -= l
+                    i += 1
+        except (socket.error, AttributeError, OSError):
+            # AttributeError happens if socket has been
+            # changed to "None"
+            logging.trace ("send error", exc_info = True)
+            self.reconnect ()
 
 class _ConnectMultinet (_TcpMultinet):
     def __init__ (self, owner, name, config):
@@ -211,6 +270,9 @@ class _ConnectMultinet (_TcpMultinet):
                 return False
             if mask & select.POLLOUT:
                 logging.trace ("Multinet {} connected", self.name)
+                # The connect was done in non-blocking mode; data
+                # transfer is blocking.
+                sock.setblocking (True)
                 return True
 
 class _ListenMultinet (_TcpMultinet):
@@ -293,6 +355,7 @@ class _UdpMultinet (_Multinet):
         self.source = host.SourceAddress (config, config.source_port)
         self.dest = host.HostAddress (config.destination,
                                       config.dest_port, self.source)
+        self.txq = datalink.DatagramQueue (self)
         
     def connect (self):
         self.socket = self.dest.create_udp (self.source)
@@ -300,6 +363,7 @@ class _UdpMultinet (_Multinet):
                        self.name, self.source)
 
     def disconnect (self):
+        self.txq.clear ()
         if self.socket:
             # Close the socket
             try:
@@ -317,6 +381,7 @@ class _UdpMultinet (_Multinet):
         sock = self.socket
         p = select.poll ()
         p.register (sock, datalink.REGPOLLIN)
+        rb = datalink.RecvBatch (1500)
         while True:
             try:
                 pl = p.poll (datalink.POLLTS)
@@ -331,27 +396,31 @@ class _UdpMultinet (_Multinet):
             if mask & datalink.POLLERRHUP:
                 return
             if mask & select.POLLIN:
-                # Receive a packet
+                # Receive the pending packets
                 try:
-                    msg, addr = sock.recvfrom (1500)
+                    msgs = rb.receive (sock)
                 except (AttributeError, OSError, socket.error) as e:
                     logging.trace ("Receive error {}", e)
                     return
-                if not msg or len (msg) <= 4:
-                    logging.trace ("Receive runt packet {!r}", msg)
-                    continue
-                if not self.dest.valid (addr):
-                    # Not from peer, ignore
-                    logging.trace ("Bad sender {}", addr)
-                    continue
-                # Check header?  For now just skip it.
-                msg = msg[4:]
-                self.node.addwork (Received (self, packet = msg))
+                for msg, addr in msgs:
+                    if not msg or len (msg) <= 4:
+                        logging.trace ("Receive runt packet {!r}", msg)
+                        continue
+                    if not self.dest.valid (addr):
+                        # Not from peer, ignore
+                        logging.trace ("Bad sender {}", addr)
+                        continue
+                    # Check header?  For now just skip it.  The
+                    # receive buffer is reused, so this makes the
+                    # copy that is passed up.
+                    msg = bytes (msg[4:])
+                    self.node.addwork (Received (self, packet = msg))
                     
     def send (self, msg, dest = None):
         sock = self.socket
         if sock and self.state == self.running:
-            msg = makebytes (msg)
+            if not isinstance (msg, bytes):
+                msg = bytes (msg)
             mlen = len (msg)
             if logging.tracing:
                 logging.tracepkt ("Sending Multinet message on {}",
@@ -361,12 +430,10 @@ class _UdpMultinet (_Multinet):
             # UDP mode
             hdr = self.seq.to_bytes (2, "little") + b"\000\000"
             self.seq = (self.seq + 1) & 0xffff
-            try:
-                sock.sendto (hdr + msg, self.dest.sockaddr)
-            except (socket.error, AttributeError, OSError):
-                # AttributeError happens if socket has been
-                # changed to "None"
-                logging.trace ("send error", exc_info = True)
+            # Queue it, to be sent along with any others sent while
+            # handling the current work.  The header and message go
+            # out as one datagram without being joined first.
+            self.txq.send (sock, self.dest.sockaddr, hdr, msg)
             
 # Factory class -- returns an instance of the appropriate _Multinet
 # subclass instance given the specific device flavor specified.
@@ -58,6 +58,38 @@ class NspCounters (BaseCounters):
         self.timeout = 0
         self.no_res_rcv = 0
 
+class LinkCounters (BaseCounters):
+    """Counters for a single connection (logical link).  These are
+    kept in addition to the node counters, so traffic on a specific
+    connection can be examined.
+    """
+    linkcounters = [
+        ( "time_since_zeroed", "Time since counters zeroed" ),
+        ( "byt_rcv", "User bytes received" ),
+        ( "byt_xmt", "User bytes sent" ),
+        ( "msg_rcv", "User messages received" ),
+        ( "msg_xmt", "User messages sent" ),
+        ( "seg_rcv", "Data segments received" ),
+        ( "seg_xmt", "Data segments sent" ),
+        ( "rtx", "Packets retransmitted" ),
+        ( "timeout", "Response timeouts" ),
+        ( "stalls", "Flow control stalls" ),
+        ( "stall_time", "Seconds blocked by flow control" )
+    ]
+
+    def __init__ (self, owner):
+        super ().__init__ (owner)
+        self.byt_rcv = 0
+        self.byt_xmt = 0
+        self.msg_rcv = 0
+        self.msg_xmt = 0
+        self.seg_rcv = 0
+        self.seg_xmt = 0
+        self.rtx = 0
+        self.timeout = 0
+        self.stalls = 0
+        self.stall_time = 0
+
 class RunState:
     "Pseudo-packet sent to Session Control to report CC->RUN state change"
 
@@ -71,6 +103,11 @@ class NSPNode (object):
     def __init__ (self):
         # NSP specific node state -- see NSP 4.0.1 spec, table 6.
         self.delay = 0
+        # Smoothed round trip time and its variation, used instead of
+        # the NSP delay estimate if --rtt-estimator srtt is selected.
+        self.srtt = self.rttvar = 0
+        # Count of current connections (logical links) to this node
+        self.links = 0
         self.counters = self.counterclass (self)
 
     def used (self):
@@ -114,6 +151,12 @@ class NSP (Element):
         self.rconnections = dict ()
         self.config = config = config.nsp
         self.maxconns = config.max_connections
+        self.rttmode = getattr (config, "rtt_estimator", "nsp")
+        # Ack policy, see Subchannel.dispatch
+        self.ackafter = getattr (config, "ack_after", 0)
+        self.ackdelay = getattr (config, "ack_delay", Subchannel.HOLDOFF)
+        self.ackadaptive = getattr (config, "adaptive_ack_delay", False)
+        self.piggyback = getattr (config, "ack_piggyback", False)
         # Fixed for now
         self.inact_time = 300
         self.conn_timeout = 30
@@ -135,15 +178,52 @@ class NSP (Element):
     def stop (self):
         logging.debug ("Stopping NSP")
 
-    def get_api (self):
-        return { "version" : nspverstrings[self.nspver],
-                 "max_connections" : self.maxconns,
-                 "connections" : [ c.get_api () for c in self.connections.values () ] }
+    def get_api (self, args = None):
+        """Return the NSP API data.  By default this lists all the
+        connections.  If "count" is given in the arguments, only that
+        many are listed, starting at the lowest local link address
+        that is >= "start" (default 0).  If there are more after
+        that, the reply includes "next", the "start" value to use to
+        get the next batch.
+        """
+        args = args or {}
+        ret = { "version" : nspverstrings[self.nspver],
+                "max_connections" : self.maxconns,
+                "connection_count" : len (self.connections) }
+        start = args.get ("start", 0)
+        count = args.get ("count", None)
+        conns, nxt = self.conn_page (start, count)
+        ret["connections"] = [ c.get_api () for c in conns ]
+        if nxt is not None:
+            ret["next"] = nxt
+        return ret
 
     def api (self, client, reqtype, tag, args):
         if reqtype == "get":
-            return self.get_api ()
+            return self.get_api (args)
         return dict (error = "Unsupported operation", type = reqtype)
+
+    def conn_page (self, start = 0, count = None):
+        """Return a list of up to "count" connections, in order of
+        local link address, starting at address "start", and the
+        address of the next connection after those (or None if there
+        are no more).  If "count" is None, all the connections from
+        "start" on are returned.
+        """
+        # Make it a list to avoid trouble if another thread modifies
+        # the dictionary.
+        keys = sorted (k for k in list (self.connections) if k >= start)
+        if count is not None and len (keys) > count:
+            nxt = keys[count]
+            keys = keys[:count]
+        else:
+            nxt = None
+        ret = list ()
+        for k in keys:
+            c = self.connections.get (k, None)
+            if c:
+                ret.append (c)
+        return ret, nxt
     
     def connect (self, dest, payload):
         """Session control request for an outbound connection.  Returns
@@ -306,10 +386,17 @@ class NSP (Element):
     
     def http_get (self, mobile, parts, qs):
         infos = ( "summary", "status", "counters", "characteristics" )
+        start = 0
         if not parts or parts == ['']:
             what = "summary"
         elif parts[0] in infos:
             what = parts[0]
+            if len (parts) > 1 and what in ("status", "counters"):
+                # Connection list starting point
+                try:
+                    start = int (parts[1])
+                except ValueError:
+                    return None, None
         else:
             return None, None
         active = infos.index (what) + 1
@@ -321,10 +408,13 @@ class NSP (Element):
                              html.sbbutton (mobile, "nsp/characteristics",
                                             "Characteristics", qs))
         sb.contents[active].__class__ = html.sbbutton_active
-        ret = self.html (what)
+        ret = self.html (what, mobile, qs, start)
         return sb, html.main (*ret)
 
-    def html (self, what):
+    # Number of connections per page in the HTTP status display
+    HTML_CONNS = 100
+    
+    def html (self, what, mobile = False, qs = "", start = 0):
         title = "NSP {1} for node {0.nodeid} ({0.name})".format (self.parent.routing, what)
         if what == "summary":
             body = [ "Version: {}".format (nspverstrings[self.nspver]),
@@ -337,6 +427,7 @@ class NSP (Element):
                       "Max connections: {}".format (self.maxconns),
                       "NSP weight: {}".format (self.config.nsp_weight),
                       "NSP delay: {:.2f}".format (self.config.nsp_delay),
+                      "RTT estimator: {}".format (self.rttmode),
                       "Queue limit: {}".format (self.config.qmax),
                       "Max retransmits : {}".format (self.config.retransmits) ]
             ret = [ html.firsttextsection (title, echar) ]
@@ -390,7 +481,7 @@ class NSP (Element):
             else:
                 ret.append (html.textsection ("Node status",
                                               [ "<em>No active nodes</em>" ]))
-            conns = self.html_conns (what)
+            conns = self.html_conns (what, mobile, qs, start)
             ret.append (conns)
             return ret
         if what == "counters":
@@ -423,29 +514,59 @@ class NSP (Element):
             else:
                 ret.append (html.textsection ("Node counters",
                                               [ "<em>No active nodes</em>" ]))
-            # Note that currently there are no connection counters;
-            # traffic on connections is counted in nodes.
+            conns = self.html_conns (what, mobile, qs, start)
+            ret.append (conns)
             return ret
         # Should not get here...
         return [ "not yet implemented" ]
 
-    def html_conns (self, what):
-        # Return an HTML item for the current connections.  For the
-        # moment this only applies to status (there are no connection
-        # counters).
+    def html_conns (self, what, mobile = False, qs = "", start = 0):
+        # Return an HTML item for the current connections, for status
+        # or counters.  With many connections, this is shown in pages
+        # of HTML_CONNS entries each, in order of local link address,
+        # starting with "start".
         title = "Logical links (connections)"
         ret = list ()
         sc = self.parent.session
+        nxt = None
+        table = html.table
+        conns, nxt = self.conn_page (start, self.HTML_CONNS)
         if what == "status":
             hdr = ("LLA", "State", "Object", "Node", "RLA", "Remote object")
-            for k, c in sorted (self.connections.items (),
-                                key = lambda i: (i[1].destnode, i[0])):
-                ret.append ((k, c.state.__name__, sc.html_localuser (c),
-                             c.destnode, c.dstaddr, sc.html_remuser (c)))
-        if ret:
-            return html.tbsection (title, hdr, ret)
-        else:
+            for c in conns:
+                ret.append ((c.srcaddr, c.state.__name__,
+                             sc.html_localuser (c), c.destnode,
+                             c.dstaddr, sc.html_remuser (c)))
+        elif what == "counters":
+            title = "Logical link counters"
+            hdr = ("LLA", "Node", "RLA", "Window", "RTT")
+            table = html.detail_table
+            for c in conns:
+                api = c.get_api ()["counters"]
+                ctr = list ()
+                for fn, lb in c.counters.linkcounters:
+                    v = api[fn]
+                    if isinstance (v, float):
+                        v = "{:.1f}".format (v)
+                    ctr.append (( "{} = ".format (lb), v ))
+                ret.append ([ c.srcaddr, c.destnode, c.dstaddr,
+                              c.data.window (),
+                              "{:.3f}".format (c.rtt), ctr ])
+        if not ret:
             return html.textsection (title, [ "<em>No connections</em>" ])
+        if start == 0 and nxt is None:
+            return html.section (title, table (hdr, ret))
+        links = [ "Connections {} to {} of {}".format (ret[0][0], ret[-1][0],
+                                                   len (self.connections)) ]
+        if start:
+            links.append (html.makelink (mobile, "nsp/{}".format (what),
+                                         "First page", qs))
+        if nxt is not None:
+            links.append (html.makelink (mobile,
+                                         "nsp/{}/{}".format (what, nxt),
+                                         "Next page", qs))
+        return html.section (title, html.div (table (hdr, ret),
+                                              html.lines (*links)))
 
     def read_node (self, req, nodeinfo, resp, links = None):
         # Fill in a NICE read node response record with information
@@ -457,13 +578,9 @@ class NSP (Element):
         # the information type request to see what is wanted.
         if req.sumstat ():
             # summary or status
-            # Count the connections to this node.  TODO: should this
-            # be tracked as state in the NSPNode object?
+            # Count of connections to this node
             if links is None:
-                links = 0
-                for c in self.connections.values ():
-                    if c.destnode == nodeinfo:
-                        links += 1
+                links = nodeinfo.links
             if links:
                 r.active_links = links
             if nodeinfo.delay != 0:
@@ -520,10 +637,7 @@ class NSP (Element):
                         self.read_node (req, n, resp)
                     else:
                         # Active
-                        l = 0
-                        for c in self.connections.values ():
-                            if c.destnode == n:
-                                l += 1
+                        l = n.links
                         if l:
                             self.read_node (req, n, resp, l)
         else:
@@ -535,17 +649,17 @@ class NSP (Element):
                 self.node.nodeinfo (ne, False)
             self.read_node (req, n, resp)
 
-class txqentry (timers.Timer):
+class txqentry (object):
     """An entry in the retransmit queue for a subchannel.
 
-    Each entry has a timer, which is the retransmit timer for that
-    particular packet.
+    There is no timer per entry; instead each subchannel has a single
+    retransmit timer, which runs for the oldest unacknowledged entry
+    in its queue.
     """
     __slots__ = ("packet", "txtime", "channel", "tries",
                  "msgnum", "segnum", "sent")
     
     def __init__ (self, packet, channel, segnum = 0, msgnum = 0):
-        super ().__init__ ()
         self.packet = packet
         self.channel = channel
         self.tries = self.txtime = 0
@@ -562,9 +676,14 @@ class txqentry (timers.Timer):
                 pkt.subtype = NspHdr.CI
         elif isinstance (pkt, AckHdr):
             self.channel.set_acks (pkt)
-        # TODO: Skip this if phase 2 local node?
-        self.channel.node.timers.start (self, self.channel.parent.acktimeout ())
+        lc = self.channel.parent.counters
+        if self.tries:
+            lc.rtx += 1
+        elif isinstance (pkt, DataSeg):
+            lc.seg_xmt += 1
         self.tries += 1
+        # TODO: Skip this if phase 2 local node?
+        self.channel.start_rtx (self)
         if self.txtime == 0 and not pkt.dly:
             # Not currently timing a packet and we're not asking for
             # ack delay on this packet, so start measuring.
@@ -575,18 +694,20 @@ class txqentry (timers.Timer):
     def ack (self):
         """Handle acknowledgment of packet.  Also used when the packet
         is not going to be transmitted again for some other reason
-        (like connection abort).
+        (like connection abort).  The subchannel takes care of the
+        retransmit timer.
         """
-        self.channel.node.timers.stop (self)
         if self.txtime:
-            self.channel.parent.update_delay (self.txtime)
+            self.channel.parent.update_delay (self.txtime, self.tries > 1)
 
-    def dispatch (self, item):
-        """Handle timeout for the packet.
+    def timeout (self):
+        """Handle retransmit timeout for the packet.  This is called
+        by the subchannel for the oldest entry in its queue.
         """
         # Count a timeout
         c = self.channel.parent
         c.destnode.counters.timeout += 1
+        c.counters.timeout += 1
         # See if too many tries.  It's 1 after the first try,
         # incremented in the send operation, so check is >= not >.
         if self.tries >= c.parent.config.retransmits:
@@ -599,8 +720,8 @@ class txqentry (timers.Timer):
             # send Connect Ack.
             logging.trace ("Retransmit limit on {}", self.packet)
             if isinstance (self.packet, ConnInit):
-                # Stop the timer for this packet
-                self.channel.node.timers.stop (self)
+                # Stop the retransmit timer
+                self.channel.node.timers.stop (self.channel.rtxtimer)
             else:
                 # Not CI, so close due to "destination unreachable"
                 disc = DiscInit (reason = UNREACH, data_ctl = b"")
@@ -610,22 +731,103 @@ class txqentry (timers.Timer):
                 c.set_state (c.closed)
             return
         self.sent = False
+        # A timeout is taken as a sign of congestion, so shrink the
+        # transmit window before deciding whether this can be resent.
+        self.channel.congested (self)
         # Don't send just yet if flow control forbids it
         if not isinstance (self.packet, DataSeg) or \
           self.channel.flow_ok (self):
             self.send ()
         
+class ReorderBuffer (object):
+    """The out of order packet cache for a subchannel.  This holds
+    received packets that are ahead of the next expected sequence
+    number, up to "limit" ahead of it.  The packets are kept in a ring
+    of slots indexed by sequence number, so adding a packet and
+    finding the next one that has become in order are both simple
+    lookups.  The ring is the smallest power of two that covers the
+    limit, and it is only allocated when the first out of order
+    packet arrives, so connections that never see any (which is most
+    of them) don't pay for it.
+    """
+    __slots__ = ("slots", "limit", "mask", "count")
+    
+    def __init__ (self, limit):
+        self.slots = None
+        self.limit = limit
+        self.mask = (1 << (limit - 1).bit_length ()) - 1
+        self.count = 0
+
+    def __len__ (self):
+        return self.count
+
+    def add (self, base, num, item):
+        """Save "item" which has sequence number "num".  "base" is
+        the last in-order sequence number received.  Returns True if
+        the item was saved (or was already there), False if it is too
+        far ahead to be held.
+        """
+        if not 0 < int (num - base) <= self.limit:
+            return False
+        if self.slots is None:
+            self.slots = [ None ] * (self.mask + 1)
+        i = num & self.mask
+        if self.slots[i] is None:
+            self.count += 1
+        self.slots[i] = (num, item)
+        return True
+
+    def pop (self, num, default = None):
+        """Remove and return the item with sequence number "num", or
+        "default" if it isn't there.
+        """
+        if not self.count:
+            return default
+        i = num & self.mask
+        e = self.slots[i]
+        if e is None or e[0] != num:
+            return default
+        self.slots[i] = None
+        self.count -= 1
+        return e[1]
+
+    def clear (self):
+        # Free the ring; it will be allocated again if needed.
+        self.slots = None
+        self.count = 0
+        
 class Subchannel (Element, timers.Timer):
     """A subchannel (data or other-data) within an NSP connection.  This
     is where we keep the per-subchannel state: queues, flow control
     parameters, sequence numbers, etc.
 
     The timer base class is for the ack holdoff timer.  Packet timeout
-    is handled on a per-packet basis, by the txqentry class.
+    uses a separate timer, "rtxtimer".  There is just one of those per
+    subchannel, rather than one per packet.  It runs whenever the
+    oldest entry in the retransmit queue has been sent, and expires
+    one ack timeout after the most recent transmission of that entry
+    or the most recent ack that advanced the queue.  On expiration the
+    oldest entry is retransmitted; later entries are not, because the
+    other end holds on to out of order packets, so its ack for the
+    retransmitted packet will cover those as well.  Whatever is still
+    missing after that becomes the oldest entry and is retransmitted
+    in turn.
+
+    The ack policy is set by NSP configuration.  Acks are held off if
+    the other end allows it, for the fixed --ack-delay or, with
+    --adaptive-ack-delay, a quarter of the round trip delay estimate
+    (but no more than --ack-delay), in the hope that the ack can ride
+    along on outgoing data.  --ack-after sets a limit on how many
+    segments may be received before an ack is sent regardless.  With
+    --ack-piggyback, acks for interrupt and link service messages are
+    also held off, so they can be sent as cross-subchannel acks on
+    data subchannel traffic.
     """
-    # Holdoff delay
+    # Default holdoff delay
     HOLDOFF = 0.1
-    
+    # Minimum holdoff delay in adaptive mode
+    HOLDOFFMIN = 0.01
+
     def __init__ (self, parent):
         Element.__init__ (self, parent)
         timers.Timer.__init__ (self)
@@ -638,13 +840,78 @@ class Subchannel (Element, timers.Timer):
         self.maxackseg = 0            # Highest segment number acked
         self.acknum = Seq (0)         # Outbound ack number
         self.ackpending = False       # No deferred ack
+        self.unacked = 0              # Packets received but not yet acked
         # The flow control parameters are remote flow control -- we don't
         # do local flow control other than to request another interrupt
         # each time we get one.  So there are no explicit local flow
         # attributes.
         self.xon = True               # Flow on/off switch
         self.flow = ConnMsg.SVC_NONE  # Outbound flow control selected
-        self.ooo = dict ()            # Pending received out of order packets
+        # Pending received out of order packets.  There is no point
+        # in holding more than the transmit window (qmax) worth, since
+        # a well behaved other end won't send further ahead than that.
+        self.ooo = ReorderBuffer (parent.parent.config.qmax)
+        self.naknum = None            # Ack number last sent as a NAK
+        self.rtxtimer = timers.CallbackTimer (self.retransmit)
+        # Statistics
+        self.ooo_saved = 0            # Out of order packets saved
+        self.ooo_hits = 0             # Packets later taken from the cache
+        self.ooo_dropped = 0          # Too far ahead, discarded
+        self.naks_sent = 0            # NAKs sent for sequence gaps
+        self.fast_rtx = 0             # Retransmits due to received NAK
+        self.acks_sent = 0            # Explicit ack messages sent
+        self.acks_piggybacked = 0     # Acks carried on other messages
+        self.acks_coalesced = 0       # Packets covered by a later ack
+
+    def get_api (self):
+        return { "ooo_saved" : self.ooo_saved,
+                 "ooo_hits" : self.ooo_hits,
+                 "ooo_dropped" : self.ooo_dropped,
+                 "ooo_held" : len (self.ooo),
+                 "naks_sent" : self.naks_sent,
+                 "fast_retransmits" : self.fast_rtx,
+                 "acks_sent" : self.acks_sent,
+                 "acks_piggybacked" : self.acks_piggybacked,
+                 "acks_coalesced" : self.acks_coalesced,
+                 "acks_saved" : self.acks_piggybacked + self.acks_coalesced }
+
+    def holdoff (self):
+        """Return the ack holdoff time.  This is the configured ack
+        delay, or in adaptive mode, a quarter of the round trip delay
+        estimate if that is smaller.
+        """
+        nsp = self.parent.parent
+        if nsp.ackadaptive:
+            delay = self.parent.destnode.delay
+            if delay:
+                return min (nsp.ackdelay, max (self.HOLDOFFMIN, delay / 4))
+        return nsp.ackdelay
+
+    def delay_ok (self, pkt):
+        """Return True if the ack for this packet may be delayed, as
+        far as the packet is concerned.
+        """
+        return pkt.dly
+
+    def start_rtx (self, qe):
+        """Start the retransmit timer, if needed, for a queue entry
+        that has just been sent.  The timer is restarted if the entry
+        is the oldest one in the queue, otherwise it is only started
+        if it is not already running.
+        """
+        if qe is self.pending_ack[0] or not self.rtxtimer.islinked ():
+            self.node.timers.start (self.rtxtimer,
+                                    self.parent.acktimeout (qe.tries - 1))
+
+    def retransmit (self, arg):
+        """Retransmit timer expiration.  Retransmit the oldest
+        unacknowledged entry, if it is still there.
+        """
+        try:
+            qe = self.pending_ack[0]
+        except IndexError:
+            return
+        qe.timeout ()
 
     def dispatch (self, item):
         if isinstance (item, timers.Timeout):
@@ -667,34 +934,56 @@ class Subchannel (Element, timers.Timer):
                 self.send_ack ()
                 return
             elif num != self.acknum + 1:
-                # Not next in sequence, save it
+                # Not next in sequence, save it if there is room
+                if not self.ooo.add (self.acknum, num, item):
+                    logging.trace ("Out of order NSP packet {} too far ahead",
+                                   pkt)
+                    self.ooo_dropped += 1
+                    return
                 if logging.tracing:
                     logging.trace ("Saving out of order NSP packet {}", pkt)
-                self.ooo[num] = item
+                self.ooo_saved += 1
+                # Tell the sender about the gap.
+                self.send_nak ()
                 return
             # It's in sequence.  Process it, as well as packets waiting
             # in the out of order cache that are now in order.
             while item:
                 self.acknum = num
+                if self.ackpending:
+                    # An ack is already due, this one will be covered
+                    # by the same ack.
+                    self.acks_coalesced += 1
                 self.ackpending = True
+                self.unacked += 1
                 self.process_data (item)
                 num += 1
                 # Remove the packet with the next higher sequence number
                 # from the OOO cache, if it is there, and keep going if
                 # so.
                 item = self.ooo.pop (num, None)
+                if item:
+                    self.ooo_hits += 1
+            if self.ooo:
+                # There is still a gap, report that right away rather
+                # than waiting for the ack holdoff.
+                self.send_nak ()
             # Done with in-sequence packets, see if delayed ack is
             # allowed.  The rule is: delay ACK if (a) the packet says
             # it's allowed, and (b) we're both Phase 4, and (c) we
-            # don't have a clean shutdown in progress.  That last rule
-            # ensures there won't be pending ACKs when we get around
-            # to sending the deferred disconnect.
-            if pkt.dly and self.parent.cphase == 4 and not self.parent.shutdown:
+            # don't have a clean shutdown in progress, and (d) we
+            # haven't reached the configured limit of unacknowledged
+            # packets.  Rule (c) ensures there won't be pending ACKs
+            # when we get around to sending the deferred disconnect.
+            ackafter = self.parent.parent.ackafter
+            if self.delay_ok (pkt) and self.parent.cphase == 4 and \
+               not self.parent.shutdown and \
+               not (ackafter and self.unacked >= ackafter):
                 # Delayed ACK allowed, start the ACK holdoff timer if
                 # it isn't already running.
                 if self.ackpending and not self.islinked ():
                     # ACK holdoff timer is not yet running, start it
-                    self.node.timers.start (self, self.HOLDOFF)
+                    self.node.timers.start (self, self.holdoff ())
             elif self.ackpending:
                 # Immediate ACK required and not yet done, send it.
                 # The check covers the case of link service messages
@@ -706,22 +995,46 @@ class Subchannel (Element, timers.Timer):
                 # again.
                 self.send_ack ()
                 
-    def send_ack (self):
+    def send_ack (self, nak = False):
         self.node.timers.stop (self)
         ack = self.parent.makepacket (self.Ack)
-        self.set_acks (ack, True)
+        self.set_acks (ack, True, nak)
+        self.acks_sent += 1
         self.parent.sendmsg (ack)
 
-    def set_acks (self, pkt, explicit = False):
+    def send_nak (self):
+        """Send a NAK for the current ack number, to report that there
+        is a gap in the received sequence.  This is done only once
+        for a given ack number, and only for Phase IV connections.
+        Earlier NSP versions define NAK but some implementations of
+        those don't handle it.
+        """
+        if self.parent.cphase < 4 or self.naknum == self.acknum:
+            return
+        self.naknum = self.acknum
+        self.naks_sent += 1
+        self.send_ack (True)
+        
+    def set_acks (self, pkt, explicit = False, nak = False):
         if explicit or self.ackpending:
+            if not explicit:
+                # Pending ack rides along on a data or interrupt
+                # message, so no explicit ack is needed.
+                self.acks_piggybacked += 1
             self.ackpending = False
+            self.unacked = 0
             self.node.timers.stop (self)
-            pkt.acknum = AckNum (self.acknum)
+            if nak:
+                pkt.acknum = AckNum (self.acknum, AckNum.NAK)
+            else:
+                pkt.acknum = AckNum (self.acknum)
         if self.parent.cphase == 4:
             # Phase IV, we can use cross-subchannel ACK.
             other = self.cross
             if other.ackpending:
                 other.ackpending = False
+                other.unacked = 0
+                other.acks_piggybacked += 1
                 self.node.timers.stop (other)
                 pkt.acknum2 = AckNum (other.acknum, AckNum.XACK)
         
@@ -731,9 +1044,32 @@ class Subchannel (Element, timers.Timer):
                 if self.parent.cphase < 4:
                     logging.debug ("Cross-subchannel ACK/NAK but phase is {}",
                                    self.parent.cphase)
-                self.cross.ack (num.num)
+                chan = self.cross
             else:
-                self.ack (num.num)
+                chan = self
+            chan.ack (num.num)
+            if num.is_nak ():
+                chan.nak (num.num)
+
+    def nak (self, acknum):
+        """Handle a received NAK on this subchannel.  The ack part
+        has already been done; what remains is to retransmit the
+        packet after the one acked, if it is the oldest one waiting
+        for ack, without waiting for the retransmit timeout.
+        """
+        try:
+            qe = self.pending_ack[0]
+        except IndexError:
+            return
+        pkt = qe.packet
+        if not isinstance (pkt, (DataSeg, IntMsg, LinkSvcMsg)) or \
+           pkt.segnum != acknum + 1 or not qe.sent:
+            return
+        if isinstance (pkt, DataSeg) and not self.flow_ok (qe):
+            return
+        logging.trace ("Fast retransmit of {} on NAK", pkt)
+        self.fast_rtx += 1
+        qe.send ()
 
     def ack (self, acknum):
         """Handle a received ack on this subchannel.
@@ -758,6 +1094,14 @@ class Subchannel (Element, timers.Timer):
             acked = self.pending_ack.popleft ()
             acked.ack ()
             self.maxackseg = acked.segnum
+        # The queue advanced, so restart the retransmit timer for what
+        # is now the oldest entry, if that has been sent.
+        if self.pending_ack and self.pending_ack[0].sent:
+            qe = self.pending_ack[0]
+            self.node.timers.start (self.rtxtimer,
+                                    self.parent.acktimeout (qe.tries - 1))
+        else:
+            self.node.timers.stop (self.rtxtimer)
             
     def close (self):
         """Handle connection close actions for this subchannel.  This is
@@ -765,11 +1109,19 @@ class Subchannel (Element, timers.Timer):
         stop timers.
         """
         self.node.timers.stop (self)
+        self.node.timers.stop (self.rtxtimer)
         for pkt in self.pending_ack:
             pkt.ack ()
         self.pending_ack.clear ()
         self.ooo.clear ()
 
+    def congested (self, qe):
+        """Called when a packet on this subchannel has timed out.
+        Only the data subchannel does congestion control, so this is
+        a no-op by default.
+        """
+        pass
+
 class Data_Subchannel (Subchannel):
     # Class for ACKs send from this subchannel
     Ack = AckData
@@ -779,10 +1131,31 @@ class Data_Subchannel (Subchannel):
         super ().__init__ (parent)
         self.qmax = parent.parent.config.qmax
         self.dlymax = self.qmax // 2
+        # Congestion control state, see DEC-TR-353 (Jain, "A
+        # Timeout-Based Congestion Control Scheme for Window Flow-
+        # Controlled Networks").  The congestion window starts out
+        # fully open at qmax.  On a timeout it drops to one segment,
+        # and then opens by one segment per ack until it reaches the
+        # threshold (half the window in effect at the timeout).  Above
+        # the threshold the increase is additive, by one segment per
+        # window's worth of acks.  The window never exceeds qmax.
+        self.congctl = getattr (parent.parent.config,
+                                "congestion_control", True)
+        self.cwnd = self.qmax
+        self.cwthresh = self.qmax
+        # Segment number at which the last window decrease was made.
+        # Timeouts on segments sent before that point don't cause
+        # another decrease, because they are part of the same
+        # congestion event.
+        self.cwrecover = 0
+        # Time at which transmission became blocked by flow control or
+        # the window, or 0 if it isn't.
+        self.stallstart = 0
 
     def process_data (self, item):
         """Process a data packet that is next in sequence.
         """
+        self.parent.counters.seg_rcv += 1
         self.parent.to_sc (item)
 
     def process_ack (self, num):
@@ -794,26 +1167,75 @@ class Data_Subchannel (Subchannel):
             self.parent.disc_rej (*self.parent.pending_disc)
             self.parent.set_state (self.parent.di)
             
+    def ack (self, acknum):
+        """Handle a received ack on this subchannel.  In addition to
+        the common processing, this opens up the congestion window
+        according to the number of data segments acknowledged.
+        """
+        before = self.maxackseg
+        super ().ack (acknum)
+        count = self.maxackseg - before
+        if count > 0:
+            self.opened (count)
+
+    def opened (self, count):
+        """Open the congestion window to account for "count" newly
+        acknowledged data segments.
+        """
+        for i in range (count):
+            if self.cwnd >= self.qmax:
+                break
+            if self.cwnd < self.cwthresh:
+                # Below the threshold: one segment per ack
+                self.cwnd += 1
+            else:
+                # Congestion avoidance: one segment per window
+                self.cwnd += 1 / self.cwnd
+        if self.cwnd > self.qmax:
+            self.cwnd = self.qmax
+
+    def congested (self, qe):
+        """Handle a retransmit timeout on a data segment by closing
+        the congestion window down to one segment.
+        """
+        if not self.congctl or not isinstance (qe.packet, DataSeg) \
+           or qe.segnum < self.cwrecover:
+            return
+        self.cwthresh = max (int (self.cwnd) // 2, 2)
+        self.cwnd = 1
+        self.cwrecover = self.nextseg
+        logging.trace ("NSP congestion on {}, window {} threshold {}",
+                       self.parent, self.cwnd, self.cwthresh)
+
+    def window (self):
+        """Return the current transmit window size in segments,
+        which is the lower of the congestion window and qmax.
+        """
+        if not self.congctl:
+            return self.qmax
+        return min (int (self.cwnd), self.qmax)
+    
     def flow_ok (self, qe):
         """Return True if this queue entry can be transmitted now, False
         if not, according to the current flow control state.
 
         The rule is: this packet can be sent if:
-        1. In flight packet count is <= maxq parameter (20 by default), and
+        1. In flight packet count is <= the current window, which is
+           the congestion window limited by the qmax parameter (20 by
+           default), and
         2. Flow is on (xon/xoff state is "xon"), and
         3. One of:
         a. No flow control, or
         b. segment flow ctl, and this segment <= max allowed segment, or
         c. message flow ctl, and this message <= max allowed message
-
-        TODO: add congestion control per DEC-TR-353 (Raj Jain)
         """
+        win = self.window ()
         if self.pending_ack:
-            maxq = self.pending_ack[0].segnum + self.qmax - 1
+            maxq = self.pending_ack[0].segnum + win - 1
             if qe.segnum > maxq:
                 return False
         else:
-            maxq = self.qmax - 1
+            maxq = win - 1
         return self.xon and qe.segnum <= maxq and \
                (self.flow == ConnMsg.SVC_NONE or
                 (self.flow == ConnMsg.SVC_SEG and qe.segnum <= self.maxseg) or
@@ -856,6 +1278,9 @@ class Data_Subchannel (Subchannel):
             # control permits.
             if not self.flow_ok (qe):
                 # Not allowed to send.
+                if not self.stallstart:
+                    self.stallstart = time.time ()
+                    self.parent.counters.stalls += 1
                 return False
         # Good to go; send it and start the timeout.
         qe.send ()
@@ -894,6 +1319,24 @@ class Data_Subchannel (Subchannel):
                     break
             if isinstance (qe.packet, DataSeg):
                 self.maxseqsent = max (self.maxseqsent, qe.packet.segnum)
+        else:
+            # Everything has been sent, so we're no longer stalled.
+            self.unstall ()
+
+    def unstall (self):
+        """Account for the end of a flow control stall, if one was in
+        progress.
+        """
+        if self.stallstart:
+            self.parent.counters.stall_time += time.time () - self.stallstart
+            self.stallstart = 0
+
+    def stall_time (self):
+        "Return the total stall time, including any stall in progress."
+        ret = self.parent.counters.stall_time
+        if self.stallstart:
+            ret += time.time () - self.stallstart
+        return ret
         
 class Other_Subchannel (Subchannel):
     # Class for ACKs send from this subchannel
@@ -922,6 +1365,14 @@ class Other_Subchannel (Subchannel):
         else:
             self.process_ls (pkt)
 
+    def delay_ok (self, pkt):
+        """Interrupt and link service messages do not have a delayed
+        ack flag, but if piggybacking is enabled we hold off their
+        acks anyway, so they can be sent as cross-subchannel acks on
+        data subchannel messages.
+        """
+        return self.parent.parent.piggyback
+
     def process_ls (self, pkt):
         """Process a link service packet that updates the interrupt
         subchannel, i.e., an "Interrupt request" packet in the NSP spec
@@ -1018,6 +1469,10 @@ class Connection (Element, statemachine.StateMachine):
         self.rstssegbug = False
         # Initialize the data segment reassembly list
         self.asmlist = list ()
+        # Per-connection counters, and the most recent round trip
+        # time measurement.
+        self.counters = LinkCounters (self)
+        self.rtt = 0
         self.data = Data_Subchannel (self)
         # We use the optional "multiple other-data messages allowed at a time"
         # model, rather than the one at a time model that the NSP spec uses.
@@ -1044,6 +1499,7 @@ class Connection (Element, statemachine.StateMachine):
                 else:
                     self.destnode = self.node.nodeinfo (self.node.nodeid)
             self.destnode.counters.con_rcv += 1
+            self.destnode.links += 1
             self.dstaddr = pkt.srcaddr
             self.parent.rconnections[(self.dest, self.dstaddr)] = self
             self.setphase (pkt)
@@ -1077,6 +1533,7 @@ class Connection (Element, statemachine.StateMachine):
                 raise UnknownNode from None
             dest = self.dest = self.destnode.get_dest ()
             self.destnode.counters.con_xmt += 1
+            self.destnode.links += 1
             ci = self.makepacket (ConnInit, payload = payload,
                                   fcopt = ConnMsg.SVC_NONE,
                                   info = self.parent.nspver,
@@ -1117,9 +1574,21 @@ class Connection (Element, statemachine.StateMachine):
     def get_api (self):
         ret = { "local_addr" : self.srcaddr,
                 "remote_addr" : self.dstaddr,
-                "state" : self.state.__name__ }
+                "state" : self.state.__name__,
+                "window" : self.data.window (),
+                "rtt" : self.rtt,
+                "data" : self.data.get_api (),
+                "interrupt" : self.other.get_api () }
+        ctr = { f : getattr (self.counters, f)
+                for f, lb in self.counters.linkcounters }
+        ctr["stall_time"] = self.data.stall_time ()
+        ret["counters"] = ctr
         if self.destnode:
             ret["node"] = str (self.destnode)
+            ret["rto"] = self.acktimeout ()
+            if self.parent.rttmode == "srtt":
+                ret["srtt"] = self.destnode.srtt
+                ret["rttvar"] = self.destnode.rttvar
         return ret
             
     def close (self):
@@ -1128,6 +1597,7 @@ class Connection (Element, statemachine.StateMachine):
         """
         self.node.timers.stop (self)
         del self.parent.connections[self.srcaddr]
+        self.destnode.links -= 1
         # dstaddr isn't set yet if we're closing due to timeout after
         # CI, or CI returned to sender.
         if self.dstaddr:
@@ -1140,16 +1610,25 @@ class Connection (Element, statemachine.StateMachine):
             self.parent.rconnections.pop ((self.node.nodeid, self.dstaddr), None)
         self.parent.ret_id (self.srcaddr)
         # Clean up the subchannels
+        self.data.unstall ()
         self.data.close ()
         self.other.close ()
         logging.trace ("Deleted connection {} to {}", self.srcaddr, self.dest)
         return self.closed
 
-    def setsockopt (self, rstssegbug = False, **kwds):
+    def setsockopt (self, rstssegbug = None, congestion = None, **kwds):
         """Set connection options or flags not directly related to any
-        standard connection API call.
+        standard connection API call.  "rstssegbug" turns on the RSTS
+        segment workaround; "congestion" turns data subchannel
+        congestion control on or off for this connection.  Options
+        that are omitted keep their current setting.
         """
-        self.rstssegbug = rstssegbug
+        if rstssegbug is not None:
+            self.rstssegbug = rstssegbug
+        if congestion is not None:
+            self.data.congctl = bool (congestion)
+            if not congestion:
+                self.data.cwnd = self.data.qmax
         
     def accept (self, payload = b""):
         """Accept an incoming connection, using the supplied payload
@@ -1245,14 +1724,26 @@ class Connection (Element, statemachine.StateMachine):
             raise WrongState
         self.destnode.counters.byt_xmt += len (data)
         self.destnode.counters.msg_xmt += 1
+        self.counters.byt_xmt += len (data)
+        self.counters.msg_xmt += 1
         bom = 1
         dl = len (data)
+        # The segments refer to a single buffer for the message via
+        # memoryview slices rather than copies.  The buffer is
+        # released when the last segment has been acknowledged and its
+        # queue entry discarded.  The payload is copied just once,
+        # when the segment is built into the datalink frame.  If the
+        # caller gave us something mutable, take a copy first since
+        # segments may be retransmitted long after we return.
+        if not isinstance (data, bytes):
+            data = bytes (data)
+        mv = memoryview (data)
         for i in range (0, dl, self.segsize):
             eom = 0
             if dl - i <= self.segsize:
                 eom = 1
             pkt = self.makepacket (DataSeg, bom = bom, eom = eom,
-                                   payload = data[i:i + self.segsize])
+                                   payload = mv[i:i + self.segsize])
             bom = 0
             self.data.send (pkt)
         return True
@@ -1273,6 +1764,8 @@ class Connection (Element, statemachine.StateMachine):
             raise IntLength
         self.destnode.counters.byt_xmt += len (data)
         self.destnode.counters.msg_xmt += 1
+        self.counters.byt_xmt += len (data)
+        self.counters.msg_xmt += 1
         sc = self.other
         pkt = self.makepacket (IntMsg, payload = data,
                                segnum = sc.seqnum)
@@ -1321,15 +1814,28 @@ class Connection (Element, statemachine.StateMachine):
                 # Single segment message, pass it up as is.
             nc.byt_rcv += len (pkt.payload)
             nc.msg_rcv += 1
+            self.counters.byt_rcv += len (pkt.payload)
+            self.counters.msg_rcv += 1
         elif isinstance (pkt, IntMsg):
             nc.byt_rcv += len (pkt.payload)
             nc.msg_rcv += 1
+            self.counters.byt_rcv += len (pkt.payload)
+            self.counters.msg_rcv += 1
         item.reject = reject
         item.src = self
         item.connection = self
         self.node.addwork (item, self.node.session)
         
-    def update_delay (self, txtime):
+    def update_delay (self, txtime, retransmitted = False):
+        """Update the round trip delay estimate for the remote node,
+        given the time the acknowledged packet was first sent.
+        "retransmitted" is True if the packet was sent more than once.
+        """
+        if txtime and not retransmitted:
+            # Remember the latest measurement for this connection
+            self.rtt = time.time () - txtime
+        if self.parent.rttmode == "srtt":
+            return self.update_srtt (txtime, retransmitted)
         if txtime and self.destnode:
             delta = time.time () - txtime
             # Make the time estimate at least one second.  That might
@@ -1351,7 +1857,48 @@ class Connection (Element, statemachine.StateMachine):
                 # the algorithm doesn't deal with that sanely.
                 self.destnode.delay = 5
 
-    def acktimeout (self):
+    def update_srtt (self, txtime, retransmitted):
+        """Update the smoothed round trip time and round trip time
+        variation estimates, as specified for TCP in RFC 6298.  Per
+        Karn's rule, packets that were retransmitted are not used,
+        since we can't tell which transmission the ack is for.
+        """
+        if not txtime or not self.destnode or retransmitted:
+            return
+        n = self.destnode
+        delta = time.time () - txtime
+        if n.srtt:
+            n.rttvar += (abs (n.srtt - delta) - n.rttvar) / 4
+            n.srtt += (delta - n.srtt) / 8
+        else:
+            # First measurement
+            n.srtt = delta
+            n.rttvar = delta / 2
+        # Keep the NSP delay (which is what NICE and the node API
+        # report) in step with the smoothed estimate.
+        n.delay = n.srtt
+
+    # Retransmit timeout limits and clock granularity for the SRTT
+    # based timeout.
+    RTOMIN = 1
+    RTOMAX = 60
+    GRANULARITY = 0.1
+    
+    def acktimeout (self, tries = 0):
+        """Return the retransmit timeout for a packet that has been
+        sent "tries" times so far.
+        """
+        if self.parent.rttmode == "srtt":
+            n = self.destnode
+            if n.srtt:
+                rto = n.srtt + max (self.GRANULARITY, 4 * n.rttvar)
+                rto = max (rto, self.RTOMIN)
+            else:
+                rto = 2
+            # Exponential backoff for retransmissions
+            if tries:
+                rto *= 2 ** min (tries, 6)
+            return min (rto, self.RTOMAX)
         if self.destnode.delay:
             return self.destnode.delay * self.parent.config.nsp_delay
         return 2    # Spec says default is 5 but 2 is plenty nowadays
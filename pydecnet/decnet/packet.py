@@ -1007,12 +1007,35 @@ class Packet (Field, metaclass = packet_encoding_meta):
         """Encode the packet according to the current attributes.  The
         resulting packet data is returned.
         """
-        data = [ ]
+        return b''.join (self._encode_parts ([ ]))
+
+    def encode_parts (self, data = None):
+        """Encode the packet according to the current attributes, but
+        return the encoding as a list of byte-like pieces rather than
+        joining them.  If the payload is itself a packet, its pieces
+        are added to the list rather than encoding it separately, so
+        a payload that is a memoryview into a large buffer is copied
+        only when the pieces are finally put together.  If "data" is
+        supplied, the pieces are appended to that list.
+        """
+        if data is None:
+            data = [ ]
+        if type (self).encode is not Packet.encode:
+            # Class has its own encoder, so just use that.
+            data.append (self.encode ())
+            return data
+        return self._encode_parts (data)
+
+    def _encode_parts (self, data):
         for ftype, fname, args in self._codetable:
             try:
                 if fname:
                     # Simple field, get its value
                     val = getattr (self, fname, None)
+                    if ftype is PAYLOAD and isinstance (val, Packet):
+                        # Nested packet, add its pieces directly.
+                        val.encode_parts (data)
+                        continue
                     # Check type and/or supply default
                     val = ftype.checktype (fname, val)
                     if val is not None:
@@ -1024,7 +1047,7 @@ class Packet (Field, metaclass = packet_encoding_meta):
                 logging.exception ("Error encoding {} {}",
                                    ftype.__name__, fname)
                 raise
-        return b''.join (data)
+        return data
 
     @classmethod
     def decode (cls, buf, *decodeargs):
@@ -1073,9 +1096,10 @@ class Packet (Field, metaclass = packet_encoding_meta):
     def __len__ (self):
         """Return the packet length, i.e., the length of the encoded
         packet data.  Note that this builds the encoding, so this is not
-        all that efficient and should be used sparingly.
+        all that efficient and should be used sparingly.  The pieces are
+        counted without joining them, which saves copying the payload.
         """
-        return len (bytes (self))
+        return sum (len (p) for p in self.encode_parts ())
 
     def __bool__ (self):
         return True
@@ -1097,6 +1121,9 @@ class Packet (Field, metaclass = packet_encoding_meta):
                 continue
             v = getattr (self, a, None)
             if v is not None:
+                if isinstance (v, memoryview):
+                    # Show the data, not the memoryview object
+                    v = bytes (v)
                 ret.append ("{}={}".format (a, v))
         return "{}({})".format (self.__class__.__name__, ", ".join (ret))
 
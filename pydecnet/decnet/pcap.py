@@ -160,6 +160,21 @@ def _findlib ():
         _pcaplib.pcap_setfilter.restype = c_int
         _pcaplib.pcap_geterr.argtypes = (c_void_p,)
         _pcaplib.pcap_geterr.restype = c_char_p
+        _pcaplib.pcap_create.argtypes = (c_char_p, c_char * PCAP_ERRBUF_SIZE)
+        _pcaplib.pcap_create.restype = c_void_p
+        for f in ("snaplen", "promisc", "timeout", "buffer_size"):
+            f = getattr (_pcaplib, "pcap_set_" + f)
+            f.argtypes = (c_void_p, c_int)
+            f.restype = c_int
+        _pcaplib.pcap_activate.argtypes = (c_void_p,)
+        _pcaplib.pcap_activate.restype = c_int
+        # Immediate mode was added in libpcap 1.5
+        try:
+            f = _pcaplib.pcap_set_immediate_mode
+            f.argtypes = (c_void_p, c_int)
+            f.restype = c_int
+        except AttributeError:
+            pass
         
 class _pcap (object):
     """This class exists simply to match the naming conventions
@@ -224,6 +239,45 @@ class _pcapCallback (object):
         buf = cast (buf, POINTER (c_ubyte * hdr.caplen))
         buf = bytes (buf.contents)
         self.fun (hdr.len, buf, float (hdr.ts.tv_sec) + hdr.ts.tv_usec / 1000000.)
+
+class _pcapBatch (object):
+    """The callback for pcap.dispatch_batch.  It copies each packet
+    into the next slot of a buffer pool that is allocated once and
+    reused, and collects a list of (length, buffer, timestamp) tuples
+    where the buffer is a read-only memoryview of the slot.  The
+    caller may keep some of those buffers; their slots are then
+    handed over and replaced by new ones (see "keep").
+    """
+    def __init__ (self, snaplen, count):
+        self.snaplen = snaplen
+        self.count = count
+        self.slots = [ None ] * count
+        self.addrs = [ None ] * count
+        for i in range (count):
+            self.newslot (i)
+        self.batch = list ()
+
+    def newslot (self, i):
+        slot = bytearray (self.snaplen)
+        self.slots[i] = slot
+        self.addrs[i] = addressof (c_ubyte.from_buffer (slot))
+        
+    def __call__ (self, unused, hdr, buf):
+        hdr = hdr.contents
+        n = min (hdr.caplen, self.snaplen)
+        i = len (self.batch)
+        memmove (self.addrs[i], buf, n)
+        view = memoryview (self.slots[i]).toreadonly ()
+        self.batch.append ((hdr.len, view[:n],
+                            hdr.ts.tv_sec + hdr.ts.tv_usec / 1000000.))
+
+    def keep (self, kept):
+        """The packets at the indexes in "kept" have been handed to
+        someone who holds on to them, so give each a new slot.  The
+        old one stays around for as long as a reference to it does.
+        """
+        for i in kept:
+            self.newslot (i)
         
 class pcapObject (object):
     """Encapsulation of most of the libpcap methods
@@ -232,6 +286,8 @@ class pcapObject (object):
         _findlib ()
         self.pcap = None
         self.filterprog = bpf_program ()
+        self.snaplen = PCAP_MTU
+        self.batcher = self.batchcb = None
         
     def close (self):
         if self.pcap:
@@ -254,11 +310,53 @@ class pcapObject (object):
             name = name.encode ("latin1", "ignore")
         errbuf = create_string_buffer (PCAP_ERRBUF_SIZE)
         self.close ()
+        self.snaplen = mtu
         self.pcap = _pcaplib.pcap_open_live (name, mtu, promisc,
                                              timeout, errbuf)
         if not self.pcap:
             logging.error ("PCAP open failure, status {}", cvterrbuf (errbuf))
         return self.pcap
+
+    def create_live (self, name, mtu = PCAP_MTU, promisc = False,
+                     timeout = 0, bufsize = 0, immediate = False):
+        """Open a live data stream, like open_live, but with control
+        over the kernel capture buffer size (in bytes, 0 to use the
+        libpcap default) and immediate mode.  In immediate mode,
+        packets are delivered as soon as they arrive rather than
+        when the capture buffer fills or the timeout expires.
+        """
+        _findlib ()
+        if isinstance (name, str):
+            name = name.encode ("latin1", "ignore")
+        errbuf = create_string_buffer (PCAP_ERRBUF_SIZE)
+        self.close ()
+        self.snaplen = mtu
+        p = _pcaplib.pcap_create (name, errbuf)
+        if not p:
+            logging.error ("PCAP create failure, status {}",
+                           cvterrbuf (errbuf))
+            return None
+        _pcaplib.pcap_set_snaplen (p, mtu)
+        _pcaplib.pcap_set_promisc (p, promisc)
+        _pcaplib.pcap_set_timeout (p, timeout)
+        if bufsize:
+            _pcaplib.pcap_set_buffer_size (p, bufsize)
+        if immediate:
+            try:
+                _pcaplib.pcap_set_immediate_mode (p, 1)
+            except AttributeError:
+                logging.error ("PCAP immediate mode not supported")
+        ret = _pcaplib.pcap_activate (p)
+        if ret:
+            s = _pcaplib.pcap_geterr (p).decode ("latin1", "ignore")
+            if ret < 0:
+                logging.error ("PCAP activate failure {}: {}", ret, s)
+                _pcaplib.pcap_close (p)
+                return None
+            # Positive values are warnings
+            logging.debug ("PCAP activate warning {}: {}", ret, s)
+        self.pcap = p
+        return p
     
     def inject (self, buf):
         """Send a buffer.  Returns the number of bytes sent.
@@ -280,6 +378,36 @@ class pcapObject (object):
         cb = _dispatch_callback_type (_pcapCallback (fun))
         _pcaplib.pcap_dispatch (self.pcap, count, cb, None)
 
+    def dispatch_batch (self, count, fun):
+        """Retrieve up to "count" packets and pass them to "fun" in a
+        single call, as a list of (packet length, packet buffer,
+        timestamp) tuples.  Like dispatch, this waits for at most the
+        timeout given at open, and returns what the kernel has
+        delivered by then.  "fun" is not called if there are no
+        packets.  Returns the number of packets.
+
+        The packet buffers are memoryviews of a buffer pool owned by
+        this object.  They are only valid until the next call, unless
+        "fun" keeps them: it may return a list of the indexes in the
+        batch of the packets it kept, and those buffers are then
+        handed over to it rather than reused.  So a packet that is
+        passed on is copied just once, out of the libpcap buffer.
+        """
+        _findlib ()
+        if not self.pcap:
+            raise _pcap.error ("pcap.dispatch_batch on closed handle")
+        b = self.batcher
+        if not b or b.count < count or b.snaplen != self.snaplen:
+            b = self.batcher = _pcapBatch (self.snaplen, count)
+            self.batchcb = _dispatch_callback_type (b)
+        b.batch = batch = list ()
+        _pcaplib.pcap_dispatch (self.pcap, count, self.batchcb, None)
+        if batch:
+            kept = fun (batch)
+            if kept:
+                b.keep (kept)
+        return len (batch)
+
     def setfilter (self, s):
         """Compile a PCAP filter expression, then make it the current
         filter.
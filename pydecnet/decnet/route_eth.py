@@ -6,6 +6,7 @@
 
 import re
 import time
+import heapq
 
 from .common import *
 from .routing_packets import *
@@ -247,28 +248,31 @@ class LanCircuit (timers.Timer):
                 elif self.dr:
                     r.adjacent_node = self.dr.adjnode ().nodename
 
-class NiCacheEntry (timers.Timer):
+class NiCacheEntry (object):
     """An entry in the on-Ethernet cache.  Or rather, in the previous hop
     cache, which is in Phase IV plus.  The difference is that it doesn't
     depend on the on-NI bit, but instead remembers the source MAC address
     of incoming traffic as the "previous hop".
+
+    Entries don't have timers of their own.  Instead, each records the
+    cache epoch in which it was last refreshed.  The circuit advances
+    the epoch periodically, and at that point removes the entries that
+    have not been refreshed for more than "epochs" epochs.  So the
+    cache time is between "epochs" and "epochs" + 1 times the epoch
+    length.
     """
-    __slots__ = ("id", "prevhop", "circuit")
+    __slots__ = ("id", "prevhop", "epoch")
     cachetime = 60
+    epochs = 4
+    # Maximum number of entries.  When the cache is full, the entries
+    # that have gone unused the longest are removed to make room.
+    cachemax = 1024
     
-    def __init__ (self, id, prevhop, circuit):
-        super ().__init__ ()
-        self.circuit = circuit
+    def __init__ (self, id, prevhop, epoch):
         self.id = id
-        self.alive (prevhop)
-        
-    def dispatch (self, item):
-        self.circuit.cache_expire (self.id)
-
-    def alive (self, prevhop):
         self.prevhop = prevhop
-        self.circuit.node.timers.start (self, self.cachetime)
-
+        self.epoch = epoch
+        
     def get_api (self):
         return { "node" : self.id,
                  "prevhop" : self.prevhop }
@@ -292,12 +296,24 @@ class EndnodeLanCircuit (LanCircuit):
         # Common code looks for this:
         self.adjacencies = dict ()
         self.prevhops = dict ()
+        self.cacheepoch = 0
+        self.cachetimer = timers.CallbackTimer (self.cache_sweep)
         # We need this because the routing module wants packets to
         # come with their source adjacency, and we don't have such a thing.
         # It doesn't really need anything other than the adjacency's
         # circuit, so we'll give it that much.
         self.dadj = self.DummyAdj (self)
 
+    def start (self):
+        self.node.timers.start (self.cachetimer,
+                                NiCacheEntry.cachetime / NiCacheEntry.epochs)
+        super ().start ()
+
+    def stop (self):
+        self.node.timers.stop (self.cachetimer)
+        self.prevhops.clear ()
+        super ().stop ()
+        
     def extrachar (self, r):
         "Add any node type dependent characteristics"
         # None for endnodes
@@ -375,10 +391,15 @@ class EndnodeLanCircuit (LanCircuit):
         else:
             if isinstance (item, (LongData, ShortData)):
                 try:
-                    self.prevhops[item.srcnode].alive (item.src)
+                    e = self.prevhops[item.srcnode]
+                    e.prevhop = item.src
+                    e.epoch = self.cacheepoch
                 except KeyError:
+                    if len (self.prevhops) >= NiCacheEntry.cachemax:
+                        self.cache_trim ()
                     self.prevhops[item.srcnode] = NiCacheEntry (item.srcnode,
-                                                                item.src, self)
+                                                                item.src,
+                                                                self.cacheepoch)
             item.src = self.dadj
             self.parent.dispatch (item)
 
@@ -387,6 +408,28 @@ class EndnodeLanCircuit (LanCircuit):
             del self.prevhops[id]
         except KeyError:
             pass
+
+    def cache_sweep (self, arg):
+        # Start a new cache epoch, and remove the entries that have
+        # now gone unused too long.
+        self.cacheepoch += 1
+        oldest = self.cacheepoch - NiCacheEntry.epochs
+        old = [ k for k, v in self.prevhops.items () if v.epoch < oldest ]
+        for k in old:
+            del self.prevhops[k]
+        self.node.timers.start (self.cachetimer,
+                                NiCacheEntry.cachetime / NiCacheEntry.epochs)
+
+    def cache_trim (self):
+        # The cache is full.  Remove just enough of the least recently
+        # used entries (those last used in the oldest epoch) to make
+        # room for one more.  Entries used in the same epoch are
+        # removed in the order they were added.
+        n = len (self.prevhops) - NiCacheEntry.cachemax + 1
+        old = heapq.nsmallest (n, self.prevhops.items (),
+                               key = lambda e: e[1].epoch)
+        for k, v in old:
+            del self.prevhops[k]
         
     def send (self, pkt, nexthop, tryhard = False):
         """Send pkt to nexthop.  Normally returns True because it always
@@ -449,6 +492,16 @@ class RoutingLanCircuit (LanCircuit):
             self.pktindex = pktindex (ShortData, LongData, RouterHello,
                                       EndnodeHello, L1Routing, L2Routing)
         self.minrouterblk = ETHMTU
+        self.routerschanged ()
+
+    def routerschanged (self):
+        """Note that the set of router adjacencies, or the state of
+        one of them, has changed.  This discards the cached E-list
+        for our hello message and the cached best remote designated
+        router candidate; they will be recomputed when next needed.
+        """
+        self.helloelist = None
+        self.bestrtr = False
 
     def extrachar (self, r):
         "Add any node type dependent characteristics"
@@ -457,6 +510,7 @@ class RoutingLanCircuit (LanCircuit):
     
     def stop (self):
         self.node.timers.stop (self.drtimer)
+        self.flush_pacer ()
         self.sendhello (empty = True)
         time.sleep (0.1)
         # Do it again to make sure
@@ -494,13 +548,17 @@ class RoutingLanCircuit (LanCircuit):
         self.holdoff = False
         h = self.hello
         if empty:
-            rslist = b''
+            h.elist = bytes (Elist (rslist = b''))
         else:
-            rslist = b''.join ([ bytes (RSent (router = a.nodeid,
-                                               prio = a.priority,
-                                               twoway = (a.state == UP)))
-                                 for a in self.routers () ])
-        h.elist = bytes (Elist (rslist = rslist))
+            # The router list rarely changes, so the encoded E-list is
+            # kept and reused until routerschanged is called.
+            if self.helloelist is None:
+                rslist = b''.join ([ bytes (RSent (router = a.nodeid,
+                                                   prio = a.priority,
+                                                   twoway = (a.state == UP)))
+                                     for a in self.routers () ])
+                self.helloelist = bytes (Elist (rslist = rslist))
+            h.elist = self.helloelist
         self.datalink.send (h, ALL_ROUTERS)
         if self.isdr:
             self.datalink.send (h, ALL_ENDNODES)
@@ -557,6 +615,7 @@ class RoutingLanCircuit (LanCircuit):
                     a = self.adjacencies[id] = adjacency.Adjacency (self, item)
                     logging.trace ("New adjacency from {}", item)
                     a.state = INIT
+                    self.routerschanged ()
                     # Check that the RSlist is not too long
                     rslist = list (self.routers ())
                     if len (rslist) > self.nr:
@@ -593,27 +652,35 @@ class RoutingLanCircuit (LanCircuit):
                     self.deladj (a, reason = "address_change")
                     return
                 # Process the received E-list and see if two-way state changed.
-                # First look to see if our entry is in there.
-                rslist = Elist (item.elist).rslist
-                selfent = None
-                while rslist:
-                    ent, rslist = RSent.decode (rslist)
-                    if ent.router == self.parent.nodeid:
-                        if ent.prio != self.prio:
-                            logging.error ("Node {} has our prio as {} rather than {}",
-                                           id, ent.prio, self,prio)
-                            self.deladj (a, reason = "data_errors")
-                            return
-                        selfent = ent
-                        break
-                if selfent:
-                    # We're listed, which means two way communication,
-                    # so set the adjacency "up"
-                    if logging.tracing:
+                # First look to see if our entry is in there.  A
+                # neighbor's E-list changes only when its router list
+                # does, so if it is the same as last time, so is the
+                # answer.
+                elist = item.elist
+                if elist != a.elist:
+                    rslist = Elist (elist).rslist
+                    selfent = None
+                    while rslist:
+                        ent, rslist = RSent.decode (rslist)
+                        if ent.router == self.parent.nodeid:
+                            if ent.prio != self.prio:
+                                logging.error ("Node {} has our prio as {} rather than {}",
+                                               id, ent.prio, self.prio)
+                                self.deladj (a, reason = "data_errors")
+                                return
+                            selfent = ent
+                            break
+                    if selfent and logging.tracing:
                         logging.trace ("self entry in received hello is {}",
                                        selfent)
+                    a.elist = elist
+                    a.listed = selfent is not None
+                if a.listed:
+                    # We're listed, which means two way communication,
+                    # so set the adjacency "up"
                     if a.state == INIT:
                         a.state = UP
+                        self.routerschanged ()
                         self.datalink.counters.last_up = Timestamp ()
                         self.node.logevent (events.adj_up,
                                             entity = events.CircuitEventEntity (self),
@@ -633,6 +700,7 @@ class RoutingLanCircuit (LanCircuit):
                         # a.down deleted it.
                         self.adjacencies[id] = a
                         a.state = INIT
+                        self.routerschanged ()
                         hellochange = True
                 # Update the DR state, if needed
                 self.calcdr ()
@@ -673,11 +741,16 @@ class RoutingLanCircuit (LanCircuit):
         set of known routers.  Returns self for local node, or the router
         list entry otherwise.
         """
-        routers = list (self.routers (False))
-        if routers:
-            # Look for the best remote router, if there are any
-            dr = max (routers, key = sortkey)
-        if not routers or self.drkey > sortkey (dr):
+        if self.bestrtr is False:
+            # Look for the best remote router, if there are any.  The
+            # answer is kept until the router adjacencies change.
+            routers = list (self.routers (False))
+            if routers:
+                self.bestrtr = max (routers, key = sortkey)
+            else:
+                self.bestrtr = None
+        dr = self.bestrtr
+        if dr is None or self.drkey > sortkey (dr):
             return self
         else:
             return dr
@@ -755,6 +828,7 @@ class RoutingLanCircuit (LanCircuit):
         # related state
         if a.ntype != ENDNODE:
             # Router adjacency, update DR state and send an updated hello
+            self.routerschanged ()
             self.calcdr ()
             self.newhello ()
             self.update_blk ()
@@ -143,8 +143,11 @@ class PtpCircuit (statemachine.StateMachine):
         if self.isrustate ():
             # One of the RU states
             self.datalink.counters.cir_down += 1
+            if self.ntype == PHASE2:
+                self.intercept.adjdown (self)
             if self.adj:
                 self.adj.down ()
+        self.flush_pacer ()
         logging.trace ("{} restart due to {}", self.name, msg)
         if event:
             self.node.logevent (event, entity = entity, **kwargs)
@@ -964,9 +967,12 @@ class PtpCircuit (statemachine.StateMachine):
     def down (self):
         """Take the adjacency down. 
         """
+        if self.ntype == PHASE2 and self.isrustate ():
+            self.intercept.adjdown (self)
         if self.adj:
             self.adj.down ()
         self.adj = self.loopadj = None
+        self.flush_pacer ()
 
     def adj_timeout (self, adj):
         """Take the adjacency down and restart the circuit.  This is
@@ -7,6 +7,9 @@
 import time
 import array
 import sys
+import os
+import json
+from collections import deque
 
 from .common import *
 from .routing_packets import *
@@ -79,12 +82,19 @@ fieldlist = (("Time since counters zeroed", "time_since_zeroed"),
              ("Bytes sent", "bytes_sent"),
              ("Data blocks received", "pkts_recv"),
              ("Data blocks sent", "pkts_sent"),
+             ("Transmit writes", "tx_writes"),
              # DDCMP counters
              ("Data errors inbound", "data_errors_inbound", ddcmp_de_map),
              ("Data errors outbound", "data_errors_outbound", ddcmp_de_map),
              ("Remote reply timeouts", "remote_reply_timeouts"),
              ("Local reply timeouts", "local_reply_timeouts"),
              ("Remote buffer errors", "remote_buffer_errors", ddcmp_be_map),
+             ("NAKs sent", "naks_sent"),
+             ("NAKs received", "naks_recv"),
+             ("Data blocks retransmitted", "retransmits"),
+             ("Transmit window peak", "window_peak"),
+             ("Transmit window average", "window_average"),
+             ("Transmit window full", "window_full"),
              # Ethernet counters.  Technically these are line
              # counters.
              ("Multicast bytes received", "mcbytes_recv"),
@@ -169,6 +179,23 @@ class Circuit (Element):
         else:
             self.cost = config.cost
         self.t1 = config.t1
+        # If a bandwidth budget for routing messages is configured,
+        # routing updates are paced out through a token bucket
+        # rather than sent back to back.
+        bw = getattr (config, "routing_bandwidth", 0)
+        if bw:
+            self.pacer = Pacer (self, bw)
+        else:
+            self.pacer = None
+
+    def flush_pacer (self):
+        """Discard any routing messages still waiting to be paced
+        out, for use when the circuit goes down or is stopped.  They
+        would be stale by the time the circuit comes back, and a new
+        adjacency gets a complete update in any case.
+        """
+        if self.pacer:
+            self.pacer.stop ()
 
     def init_counters (self):
         # A subset of the counters defined by the architecture
@@ -815,6 +842,10 @@ class RouteInfo (object):
     def __init__ (self, adjacency, maxidx, l2 = False):
         self._adjacency = adjacency
         self.hops, self.cost = allocvecs (maxidx)
+        # The destinations whose entries came from a warm restart
+        # checkpoint and have not yet been confirmed by routing
+        # messages from the neighbor.
+        self.provisional = set ()
         if adjacency:
             circ = adjacency.circuit
         self.nodeid = None
@@ -850,6 +881,11 @@ class L1Router (BaseRouter):
         self.maxvisits = rconfig.maxvisits
         self.minhops, self.mincost = allocvecs (rconfig.maxnodes)
         self.oadj = [ UNREACHABLE ] * (self.maxnodes + 1)
+        # Path splitting.  If enabled, opaths has for each destination
+        # either None (a single path) or a tuple of the equal cost
+        # output adjacencies that traffic is spread over.
+        self.pathsplits = getattr (rconfig, "path_splits", 1)
+        self.opaths = [ None ] * (self.maxnodes + 1)
         BaseRouter.__init__ (self, parent, config)
         self.oadj[self.tid] = self.selfadj
         self.l1info = dict ()
@@ -857,6 +893,13 @@ class L1Router (BaseRouter):
         # to record information for all the endnode adjacencies
         # Note that this one also keeps a per-ID adjacency pointer.
         self.l1info[ENDNODE] = EndnodesRouteInfo (self.maxnodes)
+        # Warm restart support
+        self.warm = None
+        fn = getattr (rconfig, "checkpoint", None)
+        if fn:
+            self.checkpoint = Checkpoint (self, fn, rconfig.checkpoint_interval)
+        else:
+            self.checkpoint = None
         
     def adj_up (self, adj):
         """Take the appropriate actions for an adjacency that has
@@ -882,6 +925,8 @@ class L1Router (BaseRouter):
                     tid = self.nodeid.tid
                     self.selfadj.routeinfo.hops[tid] = 0
                     self.selfadj.routeinfo.cost[tid] = 0
+                elif self.warm and self.warm.restore (adj, False):
+                    self.route (0, self.maxnodes)
                 adj.circuit.setsrm (0, self.maxnodes)
         else:
             # End node or Phase II node.  Since Phase II nodes can't
@@ -933,15 +978,29 @@ class L1Router (BaseRouter):
     def start (self):
         super ().start ()
         self.up ()
+        if self.checkpoint:
+            self.checkpoint.start ()
+
+    def stop (self):
+        if self.checkpoint:
+            self.checkpoint.stop ()
+        super ().stop ()
         
     def routemsg (self, item, info, route, maxid):
         adj = item.src
         maxreach = 0
+        # Entries from the neighbor replace any provisional data for
+        # those destinations.  A complete update may take several
+        # routing messages, so only the destinations covered by this
+        # one are confirmed.
+        prov = info.provisional
         for k, v in item.entries (adj.circuit):
             if k > maxid:
                 if v != (INFHOPS, INFCOST):
                     maxreach = max (maxreach, k)
                 continue
+            if prov:
+                prov.discard (k)
             oldv = info.hops[k], info.cost[k]
             if oldv != v:
                 info.hops[k], info.cost[k] = v
@@ -975,12 +1034,14 @@ class L1Router (BaseRouter):
             minhops = self.aminhops
             mincost = self.amincost
             oadj = self.aoadj
+            opaths = self.aopaths
             setsrm = self.setasrm
         else:
             routeinfodict = self.l1info
             minhops = self.minhops
             mincost = self.mincost
             oadj = self.oadj
+            opaths = self.opaths
             setsrm = self.setsrm
         self.check ()
         for i in range (start, end + 1):
@@ -995,6 +1056,24 @@ class L1Router (BaseRouter):
                     besta = r.adjacency (i)
             if bestc > self.maxcost or besth > self.maxhops:
                 besth, bestc, besta = INFHOPS, INFCOST, UNREACHABLE
+            if self.pathsplits > 1:
+                # Path splitting is enabled, so find all the
+                # adjacencies that offer a path of the best cost.
+                # These are sorted so the order (and with it the
+                # path chosen for a given flow) doesn't depend on the
+                # order in which the adjacencies came up.
+                paths = None
+                if besta and besta is not self.selfadj:
+                    paths = [ r.adjacency (i)
+                              for r in routeinfodict.values ()
+                              if r.cost[i] == bestc and
+                                 r.hops[i] <= self.maxhops ]
+                    if len (paths) > 1:
+                        paths.sort (key = self.adjkey)
+                        paths = tuple (paths[:self.pathsplits])
+                    else:
+                        paths = None
+                opaths[i] = paths
             if minhops[i] != besth or mincost[i] != bestc:
                 minhops[i] = besth
                 mincost[i] = bestc
@@ -1010,6 +1089,12 @@ class L1Router (BaseRouter):
                 # another.
                 rchange = not besta or not oadj[i]
                 oadj[i] = besta
+                if rchange and besta and self.warm and \
+                   self.warm.wasreachable (i, l2):
+                    # Destination is coming back after a warm
+                    # restart, as far as the rest of the network is
+                    # concerned it never went away.
+                    rchange = False
                 if rchange and besta is not self.selfadj:
                     # Note that reachable events are not logged if the
                     # output adjacency is SelfAdj.  Those happen at
@@ -1138,6 +1223,22 @@ class L1Router (BaseRouter):
         except IndexError:
             return OUT_OF_RANGE
 
+    def findpaths (self, dest):
+        """Find the set of equal cost output adjacencies for this
+        destination address, if path splitting applies to it.
+
+        Returns None if there is only a single path.
+        """
+        area, tid = dest.split ()
+        if area != self.homearea:
+            if self.tiver != tiver_ph4:
+                return None
+            tid = 0
+        try:
+            return self.opaths[tid]
+        except IndexError:
+            return None
+        
     def send (self, data, dest, rqr = False, tryhard = False):
         """Send NSP data to the given destination.  rqr is True to
         request return to sender (done for CI messages).  tryhard is
@@ -1178,6 +1279,14 @@ class L1Router (BaseRouter):
         dest = pkt.dstnode
         srcadj = pkt.src
         a = self.findoadj (dest)
+        if a and self.pathsplits > 1 and a is not self.selfadj:
+            paths = self.findpaths (dest)
+            if paths:
+                # There are several equal cost paths.  Pick one based
+                # on source and destination address, so all the
+                # packets of a given flow (NSP connection) go the same
+                # way and arrive in order.
+                a = paths[hash ((int (pkt.srcnode), int (dest))) % len (paths)]
         if a:
             # Destination is reachable.  Send it, unless
             # we're at the visit limit
@@ -1293,6 +1402,8 @@ class L1Router (BaseRouter):
                     adj = self.oadj[i]
                     if adj == self.selfadj:
                         adj = "Self"
+                    elif self.opaths[i]:
+                        adj = ", ".join (str (a) for a in self.opaths[i])
                     data.append ([ name, self.minhops[i],
                                    self.mincost[i], adj ])
             ret.append (html.tbsection ("Level 1 routing table", hdr, data))
@@ -1362,6 +1473,7 @@ class L2Router (L1Router):
         self.amaxcost = rconfig.amaxcost
         self.aminhops, self.amincost = allocvecs (rconfig.maxarea)
         self.aoadj = [ UNREACHABLE ] * (self.maxarea + 1)
+        self.aopaths = [ None ] * (self.maxarea + 1)
         L1Router.__init__ (self, parent, config)
         self.attached = False
         self.l2info = dict ()
@@ -1381,6 +1493,8 @@ class L2Router (L1Router):
                 self.selfadj.arouteinfo.hops[area] = 0
                 self.selfadj.arouteinfo.cost[area] = 0
                 self.aoadj[area] = self.selfadj
+            elif self.warm and self.warm.restore (adj, True):
+                self.aroute (1, self.maxarea)
         else:
             adj.arouteinfo = None
         # Call the base class method to do any L1 adjacency up actions
@@ -1461,6 +1575,18 @@ class L2Router (L1Router):
                 return False
         return super ().findoadj (dest)
 
+    def findpaths (self, dest):
+        """Find the set of equal cost output adjacencies for this
+        destination address, if path splitting applies to it.
+        """
+        area = dest.area
+        if self.attached and area != self.homearea:
+            try:
+                return self.aopaths[area]
+            except IndexError:
+                return None
+        return super ().findpaths (dest)
+
     def check (self):
         super ().check ()
         try:
@@ -1544,6 +1670,258 @@ class L2Router (L1Router):
         else:
             super ().nice_read (req, resp)
                         
+class Checkpoint (Element, timers.Timer):
+    """Periodic checkpoint of routing state, for warm restart.  Every
+    "interval" seconds (and at shutdown) the routing matrix columns
+    of the router adjacencies, the resulting minimum hops and cost
+    vectors, and the list of adjacencies are written to the
+    checkpoint file.  The file is written as JSON, to a new file which
+    is then renamed, so a crash while writing doesn't lose the
+    previous checkpoint.
+    """
+    def __init__ (self, routing, fn, interval):
+        Element.__init__ (self, routing)
+        timers.Timer.__init__ (self)
+        self.routing = routing
+        self.fn = fn
+        self.interval = interval
+
+    def start (self):
+        # Look for a checkpoint from a previous run, then start the
+        # periodic save.
+        self.load ()
+        self.node.timers.start (self, self.interval)
+
+    def stop (self):
+        self.node.timers.stop (self)
+        self.save ()
+        
+    def dispatch (self, item):
+        if isinstance (item, timers.Timeout):
+            self.save ()
+            self.node.timers.start (self, self.interval)
+
+    @staticmethod
+    def adjkey (adj):
+        return "{} {}".format (adj.circuit.name, int (adj.nodeid))
+    
+    def encode_json (self):
+        r = self.routing
+        # Collect the adjacencies.  The adjacencies dictionary has
+        # only one per neighbor node, so pick up the router
+        # adjacencies from the routing matrix as well, in case there
+        # are parallel circuits to a neighbor.
+        l2info = getattr (r, "l2info", {})
+        alist = set (r.adjacencies.values ())
+        alist.update (k for k in r.l1info
+                      if isinstance (k, adjacency.Adjacency))
+        alist.update (l2info)
+        alist.discard (r.selfadj)
+        adjs = list ()
+        l1 = dict ()
+        l2 = dict ()
+        for a in sorted (alist, key = self.adjkey):
+            k = self.adjkey (a)
+            adjs.append (dict (circuit = a.circuit.name,
+                               id = int (a.nodeid), ntype = a.ntype))
+            if a in r.l1info:
+                ri = r.l1info[a]
+                l1[k] = [ list (ri.hops), list (ri.cost) ]
+            if a in l2info:
+                ri = l2info[a]
+                l2[k] = [ list (ri.hops), list (ri.cost) ]
+        ret = dict (id = int (r.nodeid), time = time.time (),
+                    adjacencies = adjs, l1 = l1,
+                    minhops = list (r.minhops), mincost = list (r.mincost))
+        if isinstance (r, L2Router):
+            ret.update (l2 = l2, aminhops = list (r.aminhops),
+                        amincost = list (r.amincost))
+        return ret
+
+    def save (self):
+        try:
+            with open (self.fn + ".new", "wt") as f:
+                json.dump (self.encode_json (), f)
+            os.replace (self.fn + ".new", self.fn)
+        except Exception:
+            logging.exception ("Error writing routing checkpoint {}", self.fn)
+
+    def load (self):
+        r = self.routing
+        try:
+            with open (self.fn, "rt") as f:
+                d = json.load (f)
+        except OSError:
+            logging.debug ("No routing checkpoint {}, cold start", self.fn)
+            return
+        except ValueError:
+            logging.error ("Routing checkpoint {} is invalid, cold start",
+                           self.fn)
+            return
+        age = time.time () - d.get ("time", 0)
+        if d.get ("id") != int (r.nodeid) or age > r.config.t1:
+            # Wrong node, or so old that the rest of the network has
+            # long since forgotten us.
+            logging.debug ("Routing checkpoint {} is stale, cold start",
+                           self.fn)
+            return
+        r.warm = WarmRestart (r, d, 2 * r.config.bct1)
+        logging.info ("Warm restart from routing checkpoint of {:.0f} "
+                      "seconds ago, {} adjacencies", age,
+                      len (d.get ("adjacencies", ())))
+
+class WarmRestart (Element, timers.Timer):
+    """The warm restart state.  This exists for a short time after
+    startup from a checkpoint.  While it exists, when a router
+    adjacency comes up whose routing matrix column is in the
+    checkpoint, that column is loaded from it as provisional data, so
+    routes through that neighbor are available right away.
+    Provisional entries are replaced as the neighbor's routing
+    messages supply them; when the warm restart period ends, any
+    entries still provisional are discarded.  Also, during that period the
+    return of a destination that was reachable at checkpoint time is
+    not logged as a reachability change.
+    """
+    def __init__ (self, routing, data, aging):
+        Element.__init__ (self, routing)
+        timers.Timer.__init__ (self)
+        self.routing = routing
+        self.data = data
+        self.node.timers.start (self, aging)
+
+    def restore (self, adj, l2):
+        col = self.data.get ("l2" if l2 else "l1", {})
+        try:
+            hops, cost = col[Checkpoint.adjkey (adj)]
+        except KeyError:
+            return False
+        ri = adj.arouteinfo if l2 else adj.routeinfo
+        n = min (len (ri.hops), len (hops))
+        ri.hops[:n] = bytearray (hops[:n])
+        ri.cost[:n] = array.array ("H", cost[:n])
+        ri.provisional = set (range (n))
+        logging.debug ("Provisional {} routing data for {} from checkpoint",
+                       "area" if l2 else "level 1", format (adj))
+        return True
+
+    @staticmethod
+    def discard (ri):
+        # Mark the unconfirmed destinations in "ri" unreachable
+        for i in ri.provisional:
+            ri.hops[i] = INFHOPS
+            ri.cost[i] = INFCOST
+        ri.provisional = set ()
+
+    def wasreachable (self, i, l2):
+        try:
+            return self.data["amincost" if l2 else "mincost"][i] != INFCOST
+        except (KeyError, IndexError):
+            return False
+
+    def dispatch (self, item):
+        if isinstance (item, timers.Timeout):
+            # End of the warm restart period.  Discard any
+            # provisional data that hasn't been confirmed by now.
+            r = self.routing
+            r.warm = None
+            l1 = l2 = False
+            for ri in r.l1info.values ():
+                if ri.provisional:
+                    self.discard (ri)
+                    l1 = True
+            for ri in getattr (r, "l2info", {}).values ():
+                if ri.provisional:
+                    self.discard (ri)
+                    l2 = True
+            if l2:
+                r.aroute (1, r.maxarea)
+            if l1:
+                r.route (0, r.maxnodes)
+            logging.info ("Warm restart complete")
+                    
+class Pacer (Element, timers.Timer):
+    """Routing message pacing for a circuit.  This is a token bucket
+    that meters out the routing messages built by the update processes
+    of the circuit (both level 1 and level 2) at the configured rate,
+    so that a full update on a slow circuit does not lock out data
+    traffic for a long time.  The bucket holds one second worth of
+    tokens; a message may be sent whenever the bucket is not empty,
+    which may take it negative if the message is larger than the
+    tokens on hand.
+
+    In addition, the transmit backlog of the datalink is used as
+    feedback: while data messages are waiting to be sent, routing
+    messages are held back, up to T2 seconds, so they don't add to
+    the queue.  After that they are sent anyway, so routing
+    information can't be locked out indefinitely by heavy traffic.
+    """
+    def __init__ (self, circ, bandwidth):
+        Element.__init__ (self, circ)
+        timers.Timer.__init__ (self)
+        self.rate = bandwidth / 8    # in bytes per second
+        self.depth = self.rate
+        self.tokens = self.depth
+        self.last = time.time ()
+        self.pending = deque ()
+        self.deferred = None
+
+    def queue (self, update, pkts, complete):
+        """Queue the supplied list of routing messages from the given
+        update process.  If "complete" is True, these messages carry
+        all the routing data, so any messages from that same update
+        process still waiting to be sent are obsolete and are
+        discarded.
+        """
+        if complete and self.pending:
+            self.pending = deque (e for e in self.pending
+                                  if e[0] is not update)
+        for p in pkts:
+            self.pending.append ((update, makebytes (p)))
+        self.run ()
+
+    def run (self):
+        # Send as many of the pending messages as the token bucket and
+        # datalink backlog allow.
+        now = time.time ()
+        self.tokens = min (self.depth,
+                           self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        datalink = self.parent.datalink
+        delay = 0
+        while self.pending:
+            if self.tokens <= 0:
+                # Out of tokens; wait until the bucket is back to
+                # non-empty.
+                delay = -self.tokens / self.rate
+                break
+            if datalink.txbacklog ():
+                # Data waiting in the datalink, see if we've been
+                # holding off long enough.  Once we have, everything
+                # pending goes out (as the bucket allows) even if the
+                # backlog persists.
+                if self.deferred is None:
+                    self.deferred = now
+                if now - self.deferred < T2:
+                    delay = JIFFY
+                    break
+            else:
+                self.deferred = None
+            update, p = self.pending.popleft ()
+            datalink.send (p, dest = route_eth.ALL_ROUTERS)
+            self.tokens -= len (p)
+        if self.pending:
+            self.node.timers.start (self, max (delay, JIFFY))
+
+    def stop (self):
+        "Stop the pacer, discarding any messages not yet sent"
+        self.node.timers.stop (self)
+        self.pending.clear ()
+        self.deferred = None
+        
+    def dispatch (self, item):
+        if isinstance (item, timers.Timeout):
+            self.run ()
+            
 class Update (Element, timers.Timer):
     """Update process for a circuit
     """
@@ -1618,8 +1996,11 @@ class Update (Element, timers.Timer):
             pkts = pkts[startpos:] + pkts[:startpos]
             logging.trace ("Sending {} update ({}) packets",
                            len (pkts), self.pkttype.__name__)
-            for p in pkts:
-                self.parent.datalink.send (p, dest = route_eth.ALL_ROUTERS)
+            if self.parent.pacer:
+                self.parent.pacer.queue (self, pkts, not self.anysrm)
+            else:
+                for p in pkts:
+                    self.parent.datalink.send (p, dest = route_eth.ALL_ROUTERS)
             self.lastupdate = time.time ()
             if self.anysrm:
                 # Not periodic update; find the delta from the last
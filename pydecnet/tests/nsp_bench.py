@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+
+"""NSP throughput benchmark.
+
+This connects two in-process nodes, each with its own NSP and Session
+Control layers, over an in-memory "wire" that takes the place of the
+routing layer: every packet one node's NSP sends is encoded and handed
+to the other node's NSP as a received packet.  Timers are real timer
+wheels, ticked from the benchmark loop, so ack holdoff and retransmit
+timing behave as they would in a running node.
+
+Messages are sent either to a sink object, which simply counts what
+it receives, or to the built-in MIRROR object (object 25), which echoes
+each message back.  For the sink, latency is the time from the send
+call to delivery at the sink; for MIRROR it is the round trip time.
+A fixed number of messages is kept outstanding at any time.
+
+The runs sweep NSP segment size, the --qmax setting, and the flow
+control mode.  PyDECnet NSP always asks its peer for no flow control,
+so to measure the segment and message modes, the benchmark sets the
+mode on both ends and the receiving node's Session Control issues
+data requests (Link Service messages) as it consumes data, the way a
+flow controlling DECnet implementation would.
+
+Because of the file name it is not included in the standard suite of
+unit tests.  Run it by file name from the top of the source tree:
+
+    python3 tests/nsp_bench.py [--workload sink,mirror] [--count N]
+
+For example, to compare segment sizes with a larger queue limit:
+
+    python3 tests/nsp_bench.py --segsize 128,256,512 --qmax 40
+"""
+
+import argparse
+import os
+import sys
+import time
+from collections import deque
+
+pydecnet = os.path.normpath (os.path.join (os.path.dirname (__file__), ".."))
+sys.path.insert (0, pydecnet)
+
+from tests.dntest import *
+from decnet import nsp
+from decnet import session
+from decnet import routing
+from decnet import timers
+
+# Object number of the sink
+SINK = 128
+# Timer tick for the benchmark timer wheels
+TICK = 0.01
+
+flowmodes = { "none" : nsp.ConnMsg.SVC_NONE,
+              "seg" : nsp.ConnMsg.SVC_SEG,
+              "msg" : nsp.ConnMsg.SVC_MSG }
+
+class Application (Element):
+    """The sink object.  Session Control finds this by importing the
+    module name of this file.  It accepts any connection and
+    reports each arriving message to the benchmark.
+    """
+    def __init__ (self, parent, obj):
+        super ().__init__ (parent)
+
+    def dispatch (self, item):
+        if isinstance (item, session.ConnectInit):
+            item.connection.accept ()
+        elif isinstance (item, session.Data):
+            bench.delivered ()
+
+class Client (Element):
+    """The connecting end.  It notes connection state changes, and
+    reports each arriving message (MIRROR reply) to the benchmark.
+    """
+    def __init__ (self, parent):
+        super ().__init__ (parent)
+        self.accepted = self.closed = False
+
+    def dispatch (self, item):
+        if isinstance (item, session.Accept):
+            self.accepted = True
+        elif isinstance (item, session.Data):
+            bench.delivered ()
+        elif isinstance (item, (session.Disconnect, session.Reject)):
+            self.closed = True
+
+class BenchSession (session.Session):
+    """Session Control that issues flow control requests as data is
+    consumed, if a flow control mode other than "none" is in effect.
+    """
+    flow = nsp.ConnMsg.SVC_NONE
+    credit = 0
+    segsize = 0
+
+    def dispatch (self, item):
+        if isinstance (item, Received) and self.flow != nsp.ConnMsg.SVC_NONE:
+            pkt = item.packet
+            nc = item.connection
+            if isinstance (pkt, (nsp.ConnInit, nsp.ConnConf)):
+                # Use the requested flow control mode for data we send.
+                nc.data.flow = self.flow
+                if isinstance (pkt, nsp.ConnConf):
+                    # Outbound connection is now running, issue the
+                    # initial credit.
+                    self.grant (nc, self.credit)
+            elif isinstance (pkt, nsp.RunState):
+                # Inbound connection is now running.
+                self.grant (nc, self.credit)
+            elif isinstance (pkt, nsp.DataSeg):
+                # Data was consumed, issue more credit.
+                if self.flow == nsp.ConnMsg.SVC_SEG:
+                    # This is the whole message, reassembled by NSP
+                    n = len (pkt.payload)
+                    self.grant (nc, max (1, (n + self.segsize - 1)
+                                            // self.segsize))
+                else:
+                    self.grant (nc, 1)
+        super ().dispatch (item)
+
+    def grant (self, nc, count):
+        # The request count field is a signed byte, so large grants
+        # are sent in pieces.
+        while count > 0:
+            n = min (count, 127)
+            count -= n
+            pkt = nc.makepacket (nsp.LinkSvcMsg,
+                                 segnum = nc.other.seqnum,
+                                 fcmod = nsp.LinkSvcMsg.NO_CHANGE,
+                                 fcval_int = nsp.LinkSvcMsg.DATA_REQ,
+                                 fcval = n)
+            nc.other.seqnum += 1
+            nc.other.send (pkt)
+
+def mknode (nodeid, qmax):
+    n = t_node ()
+    n.nodeid = nodeid
+    n.phase = 4
+    n.ntype = routing.L2ROUTER
+    # Plain methods rather than Mocks, which would record every call
+    n.addwork = n.dispatcher.addwork
+    n.enable_dispatcher (False)
+    n.timers = timers.TimerWheel (n, TICK, 400)
+    config = container ()
+    config.nsp = container ()
+    config.nsp.max_connections = 255
+    config.nsp.nsp_delay = 2
+    config.nsp.nsp_weight = 3
+    config.nsp.qmax = qmax
+    config.nsp.retransmits = 5
+    config.session = container ()
+    config.object = [ ]
+    n.routing = container ()
+    n.routing.nodeinfo = container ()
+    n.routing.nodeinfo.counters = routing.ExecCounters (n.routing.nodeinfo, n)
+    n.nsp = nsp.NSP (n, config)
+    n.session = BenchSession (n, config)
+    n.nsp.start ()
+    n.session.start ()
+    return n
+
+def connect (a, b):
+    # Hook up the two nodes.  The packet is encoded here, so the cost
+    # of encoding and decoding is included, as it would be on a real
+    # circuit.
+    def sender (src, dst):
+        def send (pkt, dest, rqr = False, tryhard = False):
+            w = Received (owner = dst.nsp, src = src.nodeid,
+                          packet = bytes (pkt), rts = False)
+            dst.addwork (w)
+        return send
+    a.routing.send = sender (a, b)
+    b.routing.send = sender (b, a)
+
+class Bench:
+    def __init__ (self, args, workload, flow, qmax, segsize):
+        self.args = args
+        self.workload = workload
+        self.qmax = qmax
+        self.segsize = segsize
+        self.a = mknode (Nodeid (1, 1), qmax)
+        self.b = mknode (Nodeid (1, 2), qmax)
+        # Session Control sees only complete messages, so in segment
+        # mode the receiver needs credit for at least one whole
+        # message or it would never issue more.
+        credit = qmax
+        if flow == "seg":
+            credit = max (credit, (args.msgsize + segsize - 1) // segsize)
+        for n in (self.a, self.b):
+            n.session.flow = flowmodes[flow]
+            n.session.credit = credit
+            n.session.segsize = segsize
+        connect (self.a, self.b)
+        session.ModuleObject (self.b.session, __name__, SINK, "SINK")
+        self.nodes = (self.a, self.b)
+        self.last = time.perf_counter ()
+
+    def pump (self, done, limit = 60):
+        """Process work and timers until done () returns True.
+        """
+        t0 = time.perf_counter ()
+        while not done ():
+            busy = False
+            for n in self.nodes:
+                if not n.dispatcher.workqueue.empty ():
+                    n.dispatcher.dispatch ()
+                    busy = True
+            now = time.perf_counter ()
+            while now - self.last >= TICK:
+                self.last += TICK
+                for n in self.nodes:
+                    w = n.timers
+                    w.pos = (w.pos + 1) % w.maxtime
+                    if w.expirations ():
+                        busy = True
+            if not busy:
+                time.sleep (TICK / 10)
+            if now - t0 > limit:
+                raise RuntimeError ("Benchmark run stalled")
+
+    def sendone (self):
+        self.sendtimes.append (time.perf_counter ())
+        self.sent += 1
+        self.conn.send_data (self.msg)
+
+    def delivered (self):
+        now = time.perf_counter ()
+        self.lat.append (now - self.sendtimes.popleft ())
+        self.recv += 1
+        if self.sent < self.count:
+            self.sendone ()
+
+    def run (self):
+        args = self.args
+        client = Client (self.a.session)
+        conn = session.InternalConnector (self.a.session, client, "bench")
+        obj = 25 if self.workload == "mirror" else SINK
+        self.conn = conn = conn.connect (self.b.nodeid, obj, b"")
+        self.pump (lambda: client.accepted)
+        nc = conn.nspconn
+        nc.segsize = self.segsize
+        # The mirror echoes, so both directions use the segment size
+        for c in self.b.nsp.connections.values ():
+            c.segsize = self.segsize
+        if self.workload == "mirror":
+            # Function code "loop" followed by the data
+            self.msg = b"\x00" + bytes (args.msgsize - 1)
+        else:
+            self.msg = bytes (args.msgsize)
+        self.count = args.count
+        self.sendtimes = deque ()
+        self.lat = list ()
+        self.sent = self.recv = 0
+        t0 = time.perf_counter ()
+        for i in range (min (args.outstanding, self.count)):
+            self.sendone ()
+        self.pump (lambda: self.recv == self.count)
+        t1 = time.perf_counter ()
+        rtx = nc.counters.rtx
+        conn.disconnect ()
+        self.pump (lambda: not self.a.nsp.connections and
+                   not self.b.nsp.connections)
+        lat = sorted (self.lat)
+        dt = t1 - t0
+        return (self.count / dt,
+                self.count * args.msgsize / dt / 1e6,
+                lat[len (lat) // 2] * 1e3,
+                lat[min (len (lat) - 1, len (lat) * 99 // 100)] * 1e3,
+                rtx)
+
+def intlist (s):
+    return [ int (i) for i in s.split (",") ]
+
+def strlist (s):
+    return s.split (",")
+
+def main ():
+    global bench
+    p = argparse.ArgumentParser (description = "NSP throughput benchmark")
+    p.add_argument ("--workload", type = strlist, default = [ "sink" ],
+                    help = """Comma separated list of workloads, "sink"
+                           and/or "mirror" (default: sink)""")
+    p.add_argument ("--flow", type = strlist,
+                    default = [ "none", "seg", "msg" ],
+                    help = """Comma separated list of flow control modes,
+                           "none", "seg" and/or "msg" (default: all)""")
+    p.add_argument ("--qmax", type = intlist, default = [ 8, 20, 64 ],
+                    help = "Comma separated list of qmax values")
+    p.add_argument ("--segsize", type = intlist, default = [ 256, MSS ],
+                    help = "Comma separated list of NSP segment sizes")
+    p.add_argument ("--msgsize", type = int, default = 4096,
+                    help = "Message size in bytes (default: 4096)")
+    p.add_argument ("--count", type = int, default = 2000,
+                    help = "Messages per run (default: 2000)")
+    p.add_argument ("--outstanding", type = int, default = 8,
+                    help = "Messages outstanding at a time (default: 8)")
+    args = p.parse_args ()
+    for w in args.workload:
+        if w not in ("sink", "mirror"):
+            p.error ("Unknown workload {}".format (w))
+    for f in args.flow:
+        if f not in flowmodes:
+            p.error ("Unknown flow control mode {}".format (f))
+    for s in args.segsize:
+        if not 1 <= s <= MSS:
+            p.error ("Segment size must be in range 1 to {}".format (MSS))
+        if "seg" in args.flow and (args.msgsize + s - 1) // s > 127:
+            p.error ("Segment flow control needs messages of at most "
+                     "127 segments")
+    lc = container ()
+    lc.log_config = lc.log_file = lc.syslog = lc.chroot = None
+    lc.keep = lc.uid = lc.gid = 0
+    lc.daemon = False
+    lc.log_level = loglevel
+    logging.start (lc)
+    print ("Workload Flow  Qmax Segsize     Msg/s      MB/s  "
+           "p50 ms   p99 ms  Rtx")
+    for w in args.workload:
+        for f in args.flow:
+            for q in args.qmax:
+                for s in args.segsize:
+                    bench = Bench (args, w, f, q, s)
+                    mps, mbs, p50, p99, rtx = bench.run ()
+                    print ("{:<8s} {:<5s}{:>5d} {:>7d} {:>9.0f} {:>9.2f} "
+                           "{:>7.2f} {:>8.2f} {:>4d}"
+                           .format (w, f, q, s, mps, mbs, p50, p99, rtx))
+
+if __name__ == "__main__":
+    main ()
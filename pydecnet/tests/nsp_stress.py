@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+"""NSP connection table stress benchmark.
+
+This opens and closes a large number of loopback connections through
+Session Control and NSP, using the built-in MIRROR object as the
+responder, and reports connection setup latency and the memory used
+per connection.  Each loopback connection uses two NSP connections
+(one for each end), so the default count fills the connection table
+for the default --max-connections of 4095.
+
+Because of the file name it is not included in the standard suite of
+unit tests.  Run it by file name:
+
+    python3 tests/nsp_stress.py [--max-connections N] [--count N]
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+pydecnet = os.path.normpath (os.path.join (os.path.dirname (__file__), ".."))
+sys.path.insert (0, pydecnet)
+
+from tests.dntest import *
+from decnet import nsp
+from decnet import session
+from decnet import routing
+
+class Client (Element):
+    """The connecting end, which just notes when each connection
+    reaches the run state.
+    """
+    def __init__ (self, parent):
+        super ().__init__ (parent)
+        self.accepted = 0
+        self.closed = 0
+
+    def dispatch (self, item):
+        if isinstance (item, session.Accept):
+            self.accepted += 1
+        elif isinstance (item, (session.Disconnect, session.Reject)):
+            self.closed += 1
+
+class Timers:
+    # Timer stubs that don't record calls, so they don't distort the
+    # memory numbers the way a Mock would.
+    start = jstart = staticmethod (start_timer)
+    stop = staticmethod (stop_timer)
+
+def setup (maxconns):
+    n = t_node ()
+    lc = container ()
+    lc.log_config = lc.log_file = lc.syslog = lc.chroot = None
+    lc.keep = lc.uid = lc.gid = 0
+    lc.daemon = False
+    lc.log_level = loglevel
+    logging.start (lc)
+    n.phase = 4
+    n.ntype = routing.L2ROUTER
+    n.addwork = n.dispatcher.addwork
+    n.enable_dispatcher (False)
+    n.timers = Timers ()
+    config = container ()
+    config.nsp = container ()
+    config.nsp.max_connections = maxconns
+    config.nsp.nsp_delay = 2
+    config.nsp.nsp_weight = 3
+    config.nsp.qmax = 20
+    config.nsp.retransmits = 5
+    config.session = container ()
+    config.object = [ ]
+    n.routing = container ()
+    n.routing.nodeinfo = container ()
+    n.routing.nodeinfo.counters = routing.ExecCounters (n.routing.nodeinfo, n)
+    def rsend (pkt, dest, rqr = False, tryhard = False):
+        # Everything is addressed to ourselves, so loop it back.
+        w = Received (owner = n.nsp, src = n.nodeid,
+                      packet = bytes (pkt), rts = False)
+        n.addwork (w)
+    n.routing.send = rsend
+    n.nsp = nsp.NSP (n, config)
+    n.session = session.Session (n, config)
+    n.nsp.start ()
+    n.session.start ()
+    return n
+
+def main ():
+    p = argparse.ArgumentParser (description = "NSP connection stress test")
+    p.add_argument ("--max-connections", type = int, default = 4095,
+                    help = "NSP connection limit (default: 4095)")
+    p.add_argument ("--count", type = int, default = 0,
+                    help = """Loopback connections to open (default:
+                           as many as fit)""")
+    p.add_argument ("--rounds", type = int, default = 3,
+                    help = "Number of open/close rounds (default: 3)")
+    args = p.parse_args ()
+    count = args.count or (args.max_connections - 1) // 2
+    n = setup (args.max_connections)
+    sc = n.session
+    client = Client (sc)
+    conn = session.InternalConnector (sc, client, "stress")
+    for r in range (args.rounds):
+        client.accepted = client.closed = 0
+        # Memory is measured in the first round only, since tracing
+        # allocations slows things down a lot.
+        trace = r == 0
+        if trace:
+            tracemalloc.start ()
+            m0 = tracemalloc.get_traced_memory ()[0]
+        lat = list ()
+        conns = list ()
+        t0 = time.perf_counter ()
+        for i in range (count):
+            # Setup latency is the time from the connect call until
+            # the accept has been delivered.  Work items are queued
+            # during the connect call, as they would be in a running
+            # node, then processed.
+            t = time.perf_counter ()
+            conns.append (conn.connect (0, 25, b""))
+            n.dispatcher.dispatch ()
+            lat.append (time.perf_counter () - t)
+        t1 = time.perf_counter ()
+        if trace:
+            m1 = tracemalloc.get_traced_memory ()[0]
+            tracemalloc.stop ()
+        nconns = len (n.nsp.connections)
+        assert client.accepted == count, client.accepted
+        # Exercise the listing paths with the table full
+        t = time.perf_counter ()
+        start = 0
+        while True:
+            ret = n.nsp.get_api ({ "start" : start, "count" : 100 })
+            if "next" not in ret:
+                break
+            start = ret["next"]
+        tl = time.perf_counter () - t
+        t3 = time.perf_counter ()
+        for c in conns:
+            c.disconnect ()
+            n.dispatcher.dispatch ()
+        t2 = time.perf_counter ()
+        assert not n.nsp.connections, len (n.nsp.connections)
+        lat.sort ()
+        print ("Round {}: {} loopback connections ({} NSP connections)"
+               .format (r + 1, count, nconns))
+        print ("  open: {:.3f} s total, {:.1f} us mean, "
+               "{:.1f} us median, {:.1f} us 99th percentile"
+               .format (t1 - t0, (t1 - t0) / count * 1e6,
+                        lat[count // 2] * 1e6,
+                        lat[min (count - 1, count * 99 // 100)] * 1e6))
+        if trace:
+            print ("  (timing includes memory tracing overhead)")
+            print ("  memory: {:.0f} bytes per NSP connection"
+                   .format ((m1 - m0) / nconns))
+        print ("  paged API listing: {:.1f} ms".format (tl * 1e3))
+        print ("  close: {:.3f} s total, {:.1f} us per connection"
+               .format (t2 - t3, (t2 - t3) / count * 1e6))
+
+if __name__ == "__main__":
+    main ()
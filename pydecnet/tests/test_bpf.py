@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+"""Unit tests for the BPF receive filter compiler.
+"""
+
+from tests.dntest import *
+
+from decnet import bpf
+from decnet import datalink
+
+def run (prog, frame):
+    # A minimal interpreter for the subset of classic BPF that the
+    # compiler generates.  Returns the return value of the program.
+    a = 0
+    pc = 0
+    while True:
+        code, jt, jf, k = prog[pc]
+        pc += 1
+        if code == bpf.LDW:
+            a = int.from_bytes (frame[k:k + 4], "big")
+        elif code == bpf.LDH:
+            a = int.from_bytes (frame[k:k + 2], "big")
+        elif code == bpf.LDB:
+            a = frame[k]
+        elif code == bpf.JEQ:
+            pc += jt if a == k else jf
+        elif code == bpf.JA:
+            pc += k
+        elif code == bpf.RET:
+            return k
+        else:
+            raise ValueError ("Bad opcode {:x}".format (code))
+
+class _Port (datalink.BcPort):
+    def send (self, msg, dest = None):
+        pass
+
+# The leading underscore keeps this out of the datalink type list
+class _Dl (datalink.BcDatalink):
+    port_class = _Port
+
+    def open (self):
+        pass
+
+    def close (self):
+        pass
+
+class test_compile (DnTest):
+    def setUp (self):
+        super ().setUp ()
+        config = container ()
+        config.single_address = False
+        self.dl = _Dl (self.node, "dl-0", config)
+        self.dl.hwaddr = Macaddr ("02-03-04-05-06-07")
+
+    def port (self, proto = None, sap = None):
+        return self.dl.create_port (self.node, proto, sap)
+
+    def frame (self, dst, proto):
+        return Macaddr (dst) + Macaddr ("AA-00-04-00-2A-04") + proto + \
+               bytes (46)
+
+    def accepts (self, dst, proto):
+        return run (bpf.compile (self.dl), self.frame (dst, proto)) != 0
+
+    def test_empty (self):
+        # Nothing enabled, accept everything like an empty PCAP filter
+        self.assertTrue (self.accepts ("AA-00-04-00-03-04", b"\x60\x03"))
+
+    def test_addr (self):
+        p = self.port (ROUTINGPROTO)
+        self.assertTrue (self.accepts ("02-03-04-05-06-07", b"\x60\x03"))
+        self.assertFalse (self.accepts ("02-03-04-05-06-08", b"\x60\x03"))
+        self.assertFalse (self.accepts ("02-03-04-06-06-07", b"\x60\x03"))
+        self.assertFalse (self.accepts ("02-03-04-05-06-07", b"\x60\x04"))
+        p.macaddr = Macaddr (Nodeid (1, 3))
+        self.assertFalse (self.accepts ("02-03-04-05-06-07", b"\x60\x03"))
+        self.assertTrue (self.accepts ("AA-00-04-00-03-04", b"\x60\x03"))
+
+    def test_multicast (self):
+        r = self.port (ROUTINGPROTO)
+        l = self.port (LOOPPROTO)
+        r.add_multicast (Macaddr ("AB-00-00-03-00-00"))
+        l.add_multicast (Macaddr ("CF-00-00-00-00-00"))
+        self.assertTrue (self.accepts ("AB-00-00-03-00-00", b"\x60\x03"))
+        self.assertFalse (self.accepts ("AB-00-00-03-00-00", b"\x90\x00"))
+        self.assertTrue (self.accepts ("CF-00-00-00-00-00", b"\x90\x00"))
+        self.assertFalse (self.accepts ("CF-00-00-00-00-00", b"\x60\x03"))
+        self.assertFalse (self.accepts ("AB-00-00-04-00-00", b"\x60\x03"))
+        # Both ports use the hardware address
+        self.assertTrue (self.accepts ("02-03-04-05-06-07", b"\x60\x03"))
+        self.assertTrue (self.accepts ("02-03-04-05-06-07", b"\x90\x00"))
+        r.remove_multicast (Macaddr ("AB-00-00-03-00-00"))
+        self.assertFalse (self.accepts ("AB-00-00-03-00-00", b"\x60\x03"))
+
+    def test_sap (self):
+        p = self.port (sap = 0x42)
+        self.assertTrue (self.accepts ("02-03-04-05-06-07", b"\x00\x2e\x42"))
+        self.assertFalse (self.accepts ("02-03-04-05-06-07", b"\x00\x2e\x43"))
+        p.add_sap (0x43)
+        self.assertTrue (self.accepts ("02-03-04-05-06-07", b"\x00\x2e\x43"))
+        # Protocol type and SAP in the same clause
+        p.add_proto (ROUTINGPROTO)
+        self.assertTrue (self.accepts ("02-03-04-05-06-07", b"\x60\x03"))
+        self.assertTrue (self.accepts ("02-03-04-05-06-07", b"\x00\x2e\x42"))
+        self.assertFalse (self.accepts ("02-03-04-05-06-07", b"\x60\x04"))
+
+    def test_promisc (self):
+        r = self.port (ROUTINGPROTO)
+        l = self.port (LOOPPROTO)
+        l.set_promiscuous (True)
+        self.assertIsNone (self.dl.filtermap ())
+        self.assertTrue (self.accepts ("AA-00-04-00-07-04", b"\x60\x03"))
+        self.assertTrue (self.accepts ("AB-00-00-04-00-00", b"\x90\x00"))
+        self.assertFalse (self.accepts ("AA-00-04-00-07-04", b"\x60\x04"))
+
+    def test_program (self):
+        self.port (ROUTINGPROTO)
+        prog = bpf.compile (self.dl)
+        p = bpf.Program (prog)
+        self.assertEqual (len (p.buf.raw), len (prog) * 8 + 1)
+        code, jt, jf, k = bpf.sock_filter.unpack_from (p.buf.raw)
+        self.assertEqual ((code, jt, jf, k), prog[0])
+
+if __name__ == "__main__":
+    unittest.main ()
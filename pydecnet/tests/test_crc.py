@@ -99,6 +99,35 @@ class Test_lib_crc32 (DnTest):
             c2 = self.cls (v).value
             self.assertEqual (c1, c2)
 
+    def test_bytes (self):
+        # The library is used for this CRC; check it against the table
+        # driven byte at a time method, with arbitrary starting values.
+        self.assertEqual (self.cls.update, self.cls._update_crc32)
+        for l, v in randomdata (100, 8, 4096, 8):
+            v = v.to_bytes (l // 8, "little")
+            c1 = self.cls ()
+            c2 = self.cls ()
+            c1._value = c2._value = random.getrandbits (32)
+            c1.update (v)
+            c2._update_bytes (v)
+            self.assertEqual (c1.value, c2.value)
+
+class Test_lib_hqx (DnTest):
+    """Test the CCITT CRC-16, which is done by binascii, against the
+    table driven byte at a time method.
+    """
+    class cls (crc.CRC, poly = 0x1021, initial = True, reversed = False):
+        pass
+
+    def test_random (self):
+        self.assertEqual (self.cls.update, self.cls._update_hqx)
+        for l, v in randomdata (100, 8, 4096, 8):
+            v = v.to_bytes (l // 8, "little")
+            c1 = self.cls (v)
+            c2 = self.cls ()
+            c2._update_bytes (v)
+            self.assertEqual (c1.value, c2.value)
+
 class crctestbase (DnTest):
     """Base class for testing a CRC with chosen parameters against
     the reference implementation.  The test case classes are derived
@@ -217,6 +246,33 @@ class crctestbase (DnTest):
             c.update_bits (c.value, c.width)
             self.assertTrue (c.good)
 
+    def test_sliced (self):
+        """Check the CRC calculation for buffers of various types and
+        lengths, including short ones that aren't done a word at a time.
+        """
+        for l, v in randomdata (100, 8, 800, 8):
+            c1 = self.ref_crc (v, l)
+            if self.reversed:
+                data = v.to_bytes (l // 8, "little")
+            else:
+                data = v.to_bytes (l // 8, "big")
+            for d in data, bytearray (data), memoryview (data), list (data):
+                self.assertEqual (c1, self.cls (d).value)
+
+    def test_combine (self):
+        """Check combining the CRCs of two pieces of a buffer.
+        """
+        for l, v in randomdata (100, 8, 2000, 8):
+            c1 = self.ref_crc (v, l)
+            if self.reversed:
+                data = v.to_bytes (l // 8, "little")
+            else:
+                data = v.to_bytes (l // 8, "big")
+            p = random.randrange (len (data) + 1)
+            a = self.cls (data[:p]).value
+            b = self.cls (data[p:]).value
+            self.assertEqual (c1, self.cls.combine (a, b, len (data) - p))
+
 # Generate the specific test cases.  We do this by generating the
 # classes dynamically, and adding them as module level names through
 # the "global" dict.  
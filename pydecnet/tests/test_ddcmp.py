@@ -5,6 +5,9 @@
 import socket
 import select
 import os
+import struct
+import termios
+from fcntl import ioctl
 
 from tests.dntest import *
 from decnet import datalink
@@ -89,6 +92,114 @@ class TestPackets (DnTest):
         b2 = data.encode ()
         self.assertEqual (b, b2)
             
+class ErrCount:
+    # Stand-in for an error counter with reason bits
+    def __init__ (self):
+        self.count = 0
+
+    def __iadd__ (self, arg):
+        self.count += arg[0]
+        return self
+    
+class Framer:
+    # Just enough of a stream mode DDCMP to run the framing code on
+    # a canned byte stream delivered in chunks of random size.
+    reset_input = ddcmp._DDCMP.reset_input
+    fill = ddcmp._DDCMP.fill
+    readbytes = ddcmp._DDCMP.readbytes
+    header_search = ddcmp._DDCMP.header_search
+    name = "framer"
+    
+    def __init__ (self, data, events):
+        self.data = data
+        self.node = self
+        self.events = events
+        self.counters = container ()
+        self.counters.data_errors_inbound = ErrCount ()
+        self.reset_input ()
+
+    def readsome (self, n):
+        if not self.data:
+            raise IOError
+        n = min (n, random.randrange (1, 20))
+        ret, self.data = self.data[:n], self.data[n:]
+        return ret
+
+    def addwork (self, item):
+        self.events.append (item.code)
+
+class TestFraming (DnTest):
+    def oldsearch (self, read, events):
+        # The byte at a time header search algorithm, for reference
+        while True:
+            c = read (1)
+            while c:
+                if c[0] in (ddcmp.ENQ, ddcmp.SOH, ddcmp.DLE):
+                    c += read (ddcmp.HDRLEN - len (c))
+                    if ddcmp.CRC16 (c).good:
+                        self.insync = True
+                        return c
+                    if self.insync:
+                        self.insync = False
+                        events.append (ddcmp.R_HCRC)
+                c = c[1:]
+
+    def stream (self):
+        ret = list ()
+        for i in range (300):
+            h = ddcmp.AckMsg (resp = ddcmp.Seq (random.randrange (256)))
+            h = h.encode ()
+            r = random.random ()
+            if r < 0.4:
+                ret.append (h)
+            elif r < 0.7:
+                # Damaged header
+                i = random.randrange (1, len (h))
+                ret.append (h[:i] + bytes ([ h[i] ^ 0x10 ]) + h[i + 1:])
+            else:
+                # Garbage, with lots of header start bytes
+                ret.append (bytes (random.choice ((ddcmp.ENQ, ddcmp.SOH,
+                                                   ddcmp.DLE, 0, 0xff, 5))
+                                   for i in range (random.randrange (12))))
+        return b"".join (ret)
+    
+    def test_resync (self):
+        "Buffered header search matches byte at a time search"
+        for n in range (20):
+            data = self.stream ()
+            old = list ()
+            self.insync = False
+            pos = 0
+            def read (n):
+                nonlocal pos
+                if pos + n > len (data):
+                    raise IOError
+                pos += n
+                return data[pos - n:pos]
+            try:
+                while True:
+                    old.append (self.oldsearch (read, old))
+            except IOError:
+                pass
+            new = list ()
+            f = Framer (data, new)
+            try:
+                while True:
+                    new.append (f.header_search ())
+            except IOError:
+                pass
+            self.assertEqual (old, new)
+            self.assertEqual (f.counters.data_errors_inbound.count,
+                              old.count (ddcmp.R_HCRC))
+
+    def test_readbytes (self):
+        "Data after a header comes from the same buffer"
+        h = ddcmp.AckMsg (resp = ddcmp.Seq (3)).encode ()
+        f = Framer (b"\x42" * 10 + h + b"0123456789" * 50, [ ])
+        self.assertEqual (f.header_search (), h)
+        self.assertEqual (f.readbytes (500), b"0123456789" * 50)
+        self.assertRaises (IOError, f.readbytes, 1)
+        
 class DDCMPbase (DnTest):
     # Default DDCMP QMax is 7, but we use 2 for most tests
     qmax = 2
@@ -196,6 +307,14 @@ class DDCMPbase (DnTest):
         b = self.receivepdu ()
         return b
 
+    def more_frames (self, t = 0.2):
+        "Check for more frames, ignoring any fill bytes"
+        time.sleep (t)
+        if not self.data_ready (0):
+            return False
+        b = self.socket.recv (1500)
+        return bool (b.strip (bytes ((ddcmp.SYN, ddcmp.DEL))))
+
 class CommonTests:
     def test_xmit (self):
         self.start1 ()
@@ -278,6 +397,52 @@ class CommonTests:
         "Receive inbound message that also Acks the STACK"
         self.test_rcv1 (False)
 
+    def test_piggyback (self):
+        "Ack carried by a data message sent in reply"
+        self.start1 ()
+        def reply (w):
+            if isinstance (w, Received):
+                self.rport.send (testsdu (2), None)
+        self.node.dispatch.side_effect = reply
+        self.sendpdu (self.pdu (1, testsdu ()))
+        # The reply carries the Ack, so there is no separate Ack message
+        b = self.receivedata ()
+        self.assertEqual (b, self.pdu (1, testsdu (2), resp = 1))
+        self.assertFalse (self.more_frames ())
+        self.node.dispatch.side_effect = None
+
+    def test_counters (self):
+        "Transmit window and NAK counters"
+        self.start1 ()
+        for n in range (3):
+            self.rport.send (testsdu (n), None)
+        for n in range (2):
+            p, b = ddcmp.DMHdr.decode (self.receivedata ())
+            self.assertEqual (p.payload, testsdu (n))
+        c = self.dmc.counters
+        self.assertEqual (c.window_peak, 2)
+        self.assertEqual (c.window_full, 1)
+        self.assertEqual (c.window_average, 1.5)
+        # NAK with nothing acknowledged, both get retransmitted
+        self.sendpdu (ddcmp.NakMsg (resp = 0, subtype = ddcmp.R_CRC))
+        for n in range (2):
+            p, b = ddcmp.DMHdr.decode (self.receivedata ())
+            self.assertEqual (p.payload, testsdu (n))
+        self.assertEqual (c.naks_recv, 1)
+        self.assertEqual (c.retransmits, 2)
+        self.assertEqual (c.pkts_sent, 2)
+        self.assertEqual (c.data_errors_outbound, 1)
+        # Now Ack them, the third goes out
+        self.sendpdu (ddcmp.AckMsg (resp = 2))
+        p, b = ddcmp.DMHdr.decode (self.receivedata ())
+        self.assertEqual (p.payload, testsdu (2))
+        self.assertEqual (c.window_peak, 2)
+        # A REP with the wrong number gets a NAK
+        self.sendpdu (b"\x05\x03\x00\x00\x01\x01\x84\x05")
+        p, b = ddcmp.DMHdr.decode (self.receivedata ())
+        self.assertIsInstance (p, ddcmp.NakMsg)
+        self.assertEqual (c.naks_sent, 1)
+
     def test_restart_remote (self):
         "Test handling of remote protocol restart"
         self.start3 ()
@@ -702,6 +867,25 @@ class DdcmpTcp (DdcmpStream):
 
 class StreamTests:
     "Tests for the various kinds of stream based DDCMP implementations"
+    def test_coalesce (self):
+        "Frames sent by one work item go out in a single write"
+        self.start1 ()
+        # Let the receive thread finish dispatching
+        time.sleep (0.1)
+        writes = self.dmc.counters.tx_writes
+        self.node.enable_dispatcher (False)
+        self.rport.send (testsdu (0), None)
+        self.rport.send (testsdu (1), None)
+        # Nothing is written until the flush
+        self.assertFalse (self.more_frames ())
+        self.assertEqual (len (self.dmc.txq), 2)
+        self.node.enable_dispatcher ()
+        self.node.dispatcher.dispatch ()
+        for n in range (2):
+            p, b = ddcmp.DMHdr.decode (self.receivedata ())
+            self.assertEqual (p.payload, testsdu (n))
+        self.assertEqual (self.dmc.counters.tx_writes, writes + 1)
+
     def test_hcrc_resync (self):
         "Test Header CRC based resynchronization"
         # Rep (num = 1) message will produce a response if received
@@ -1002,6 +1186,8 @@ class PipeSerial:
         # The first pipe is the UUT output, the second its input.
         self.r1, self.w1 = os.pipe ()
         self.r2, self.w2 = os.pipe ()
+        self.closed = False
+        self.lock = threading.Lock ()
 
     def Serial (self, *args, **kwargs):
         "Create (open) the serial port object"
@@ -1020,6 +1206,12 @@ class PipeSerial:
         ret = os.read (self.r2, n)
         return ret
 
+    @property
+    def in_waiting (self):
+        # Number of bytes ready to be read
+        return struct.unpack ("i", ioctl (self.r2, termios.FIONREAD,
+                                          bytes (4)))[0]
+    
     def write (self, data):
         os.write (self.w1, data)
 
@@ -1027,6 +1219,15 @@ class PipeSerial:
         pass
     
     def close (self):
+        # Both the test and the DDCMP datalink close this object, and
+        # the datalink may do so late, from a work item handled after
+        # the test has ended.  Only the first close releases the file
+        # descriptors, since by the time of the second one their
+        # numbers may already have been reused by the next test.
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
         os.close (self.r1)
         os.close (self.w1)
         os.close (self.r2)
@@ -11,6 +11,7 @@ import sys
 import struct
 
 from decnet import ethernet
+from decnet import pcap
 
 class EthTest (DnTest):
     tdata = b"four score and seven years ago"
@@ -297,14 +298,14 @@ class EthTest (DnTest):
             self.postPacket (hdr + self.lelen (pkt) + pkt, False)
         
 class TestEthPcap (EthTest):
-    spec = "eth-0 --mode pcap"
+    spec = "eth-0 --mode pcap --buffer-size 2048 --immediate"
     
     def setUp (self):
         ethernet.pcap._pcap.error = Exception ("Pcap test error")
         self.ppatch = unittest.mock.patch ("decnet.ethernet.pcap")
         self.ppatch.start ()
         self.pcap = ethernet.pcap.pcapObject.return_value
-        self.pd = self.pcap.dispatch
+        self.pd = self.pcap.dispatch_batch
         self.pd.return_value = 0
         self.pd.side_effect = self.pdispatch
         self.pq = queue.Queue ()
@@ -316,13 +317,19 @@ class TestEthPcap (EthTest):
         self.ppatch.stop ()
         
     def pdispatch (self, n, fun):
+        # Deliver whatever is queued, as a batch of memoryviews like
+        # the real thing.
         try:
-            pkt = self.pq.get (timeout = 0.1)
-            fun (len (pkt), pkt, 0)
-            self.pq.task_done ()
-            return 1
+            batch = [ self.pq.get (timeout = 0.1) ]
+            while len (batch) < n and not self.pq.empty ():
+                batch.append (self.pq.get ())
         except queue.Empty:
             return 0
+        self.kept = fun ([ (len (pkt), memoryview (bytearray (pkt)), 0)
+                           for pkt in batch ])
+        for pkt in batch:
+            self.pq.task_done ()
+        return len (batch)
         
     def postPacket (self, pkt, wait = True):
         if len (pkt) < 60:
@@ -334,6 +341,56 @@ class TestEthPcap (EthTest):
         inject = self.pcap.inject.call_args
         self.assertIsNotNone (inject)
         return bytes (inject[0][0])
+
+    def test_open (self):
+        self.pcap.create_live.assert_called_once_with ("eth-0",
+                                                       ethernet.ETH_MTU, 1,
+                                                       ethernet.ETH_TMO,
+                                                       2048 * 1024, True)
+
+    def test_batch (self):
+        # Several packets in one batch are all delivered, in order.
+        # They are passed up in their receive buffers, which are
+        # handed over rather than copied.
+        rcirc = self.circ ()
+        self.rport = self.eth.create_port (rcirc, ROUTINGPROTO)
+        self.rport.macaddr = Macaddr (Nodeid (1, 3))
+        hdr = b"\xaa\x00\x04\x00\x03\x04\xaa\x00\x04\x00\x2a\x04\x60\x03"
+        self.pd.side_effect = None
+        self.pd.return_value = 0
+        time.sleep (0.2)
+        for i in range (10):
+            d = self.tdata + bytes ([ i ])
+            self.pq.put (self.pad (hdr + self.lelen (d) + d))
+        self.pd.side_effect = self.pdispatch
+        self.pq.join ()
+        for i in range (10):
+            w = self.lastdispatch (10, rcirc, back = 9 - i,
+                                   itype = Received)
+            self.assertEqual (bytes (w.packet), self.tdata + bytes ([ i ]))
+            self.assertIsInstance (w.pdu, memoryview)
+        self.assertEqual (self.rport.counters.pkts_recv, 10)
+        self.assertEqual (self.kept, list (range (10)))
+        
+    def test_pool (self):
+        # The pcap batch buffer pool: buffers that are kept are
+        # replaced, the others are reused.
+        b = pcap._pcapBatch (64, 2)
+        hdr = pcap.pcap_pkthdr ()
+        def deliver (data):
+            hdr.caplen = hdr.len = len (data)
+            b (None, pcap.pointer (hdr), data)
+        deliver (b"first")
+        deliver (b"second")
+        (l1, p1, ts), (l2, p2, ts) = b.batch
+        self.assertEqual (bytes (p1), b"first")
+        self.assertTrue (p1.readonly)
+        b.keep ([ 0 ])
+        b.batch = list ()
+        deliver (b"third")
+        deliver (b"fourth")
+        self.assertEqual (bytes (p1), b"first")
+        self.assertEqual (bytes (p2[:6]), b"fourth")
         
 # It would be nice just to read/write another /dev/tapN interface to do
 # these tests, but for that to work there has to be a bridge between
@@ -398,6 +455,231 @@ class TestEthTap (EthTest):
         self.assertIsNotNone (write)
         return bytes (write[0][1])
 
+# The packet socket tests use a veth pair, so the test talks to the
+# Ethernet being tested through the other end of that pair.  Creating
+# one requires root.
+vethdev = "pdtest0"
+vethpeer = "pdtest1"
+tapdev = "pdtap0"
+
+def quiet (dev):
+    # Turn off IPv6 so the kernel doesn't send anything, and bring
+    # the interface up.
+    try:
+        with open ("/proc/sys/net/ipv6/conf/{}/disable_ipv6"
+                   .format (dev), "w") as f:
+            f.write ("1")
+    except OSError:
+        pass
+    os.system ("ip link set {} up".format (dev))
+
+class PeerEthTest (EthTest):
+    # Base class for tests that exchange frames with the Ethernet
+    # under test through a packet socket on the interface at the other
+    # end.  Subclasses set "peer" to the name of that interface and
+    # "eclass" to the Ethernet class being tested.
+    def setUp (self):
+        self.socket = socket.socket (socket.AF_PACKET, socket.SOCK_RAW,
+                                     socket.htons (ethernet.ETH_P_ALL))
+        self.socket.bind ((self.peer, ethernet.ETH_P_ALL))
+        self.socket.settimeout (1)
+        # The inherited tests check that frames that don't match are
+        # counted, so leave those to the Python filter.
+        self.kpatch = unittest.mock.patch.object (self.eclass,
+                                                  "kernel_filter", False)
+        self.kpatch.start ()
+        super ().setUp ()
+        # Count the frames the Ethernet has processed, so postPacket
+        # can wait for that rather than sleeping a fixed time.
+        self.rxcount = 0
+        receive = self.eth.receive
+        def counted (*args):
+            try:
+                return receive (*args)
+            finally:
+                self.rxcount += 1
+        self.eth.receive = counted
+
+    def tearDown (self):
+        super ().tearDown ()
+        self.kpatch.stop ()
+        self.socket.close ()
+
+    def postPacket (self, pkt, wait = True):
+        if len (pkt) < 60:
+            pkt += bytes (60 - len (pkt))
+        n = self.rxcount
+        self.socket.send (pkt)
+        if wait:
+            # Wait until it has been processed, but no longer than
+            # the ring block timeout (plus some margin) in case the
+            # kernel filter discarded it.
+            for i in range (50):
+                if self.rxcount > n:
+                    break
+                time.sleep (0.002)
+
+    def lastSent (self):
+        while True:
+            b = self.socket.recv (1514)
+            if b[12:14] in (ROUTINGPROTO, LOOPPROTO):
+                return b
+
+    def test_burst (self):
+        # Frames that arrive together are all delivered, in order
+        rcirc = self.circ ()
+        self.rport = self.eth.create_port (rcirc, ROUTINGPROTO)
+        self.rport.macaddr = Macaddr (Nodeid (1, 3))
+        hdr = b"\xaa\x00\x04\x00\x03\x04\xaa\x00\x04\x00\x2a\x04\x60\x03"
+        for i in range (50):
+            d = self.tdata + bytes ([ i ])
+            self.socket.send (self.pad (hdr + self.lelen (d) + d))
+        time.sleep (0.2)
+        for i in range (50):
+            w = self.lastdispatch (50, rcirc, back = 49 - i,
+                                   itype = Received)
+            self.assertEqual (bytes (w.packet), self.tdata + bytes ([ i ]))
+            # The packet was copied out of the ring
+            self.assertIsInstance (w.pdu, bytes)
+
+    def test_kernelfilter (self):
+        # With the filter attached to the socket, frames for other
+        # addresses or protocols never get to the receive thread.
+        self.eth.kernel_filter = True
+        rcirc = self.circ ()
+        self.rport = self.eth.create_port (rcirc, ROUTINGPROTO)
+        self.rport.macaddr = Macaddr (Nodeid (1, 3))
+        self.rport.add_multicast (Macaddr ("AB-00-00-03-00-00"))
+        src = b"\xaa\x00\x04\x00\x2a\x04"
+        d = self.lelen (self.tdata) + self.tdata
+        for dst, proto in ((b"\xaa\x00\x04\x00\x07\x04", b"\x60\x03"),
+                           (b"\xab\x00\x00\x04\x00\x00", b"\x60\x03"),
+                           (b"\xaa\x00\x04\x00\x03\x04", b"\x60\x04"),
+                           (b"\xab\x00\x00\x03\x00\x00", b"\x90\x00")):
+            self.postPacket (dst + src + proto + d)
+        self.assertEqual (self.eth.counters.unk_dest, 0)
+        self.assertEqual (self.eth.counters.bytes_recv, 0)
+        # Frames that match are still delivered
+        self.postPacket (b"\xaa\x00\x04\x00\x03\x04" + src +
+                         b"\x60\x03" + d)
+        w = self.lastdispatch (1, rcirc, itype = Received)
+        self.assertEqual (bytes (w.packet), self.tdata)
+        self.postPacket (b"\xab\x00\x00\x03\x00\x00" + src +
+                         b"\x60\x03" + d)
+        w = self.lastdispatch (2, rcirc, itype = Received)
+        self.assertEqual (bytes (w.packet), self.tdata)
+        self.assertEqual (self.eth.counters.unk_dest, 0)
+        self.assertEqual (self.eth.counters.mcbytes_recv, 60)
+        # Removing the multicast address updates the kernel filter
+        self.rport.remove_multicast (Macaddr ("AB-00-00-03-00-00"))
+        self.postPacket (b"\xab\x00\x00\x03\x00\x00" + src +
+                         b"\x60\x03" + d)
+        self.assertEqual (self.eth.counters.unk_dest, 0)
+        self.assertEqual (self.eth.counters.mcbytes_recv, 60)
+
+class TestEthPacket (PeerEthTest):
+    spec = "{} --mode packet".format (vethdev)
+    peer = vethpeer
+    eclass = ethernet._PacketEth
+
+    @classmethod
+    def setUpClass (cls):
+        if not ethernet._PacketEth or os.getuid () != 0:
+            raise unittest.SkipTest ("Packet socket tests must be run as root on Linux")
+        if os.system ("ip link add {} type veth peer name {} 2>/dev/null"
+                      .format (vethdev, vethpeer)):
+            raise unittest.SkipTest ("Can't create veth pair")
+        for d in (vethdev, vethpeer):
+            quiet (d)
+
+    @classmethod
+    def tearDownClass (cls):
+        os.system ("ip link del {}".format (vethdev))
+
+    def test_xmitburst (self):
+        # More frames than there are slots in the transmit ring
+        self.rport = self.eth.create_port (self.node, ROUTINGPROTO)
+        self.rport.macaddr = Macaddr (Nodeid (1, 3))
+        n = self.eth.txframes * 2
+        for i in range (n):
+            self.rport.send (self.tdata + bytes ([ i & 0xff ]),
+                             Macaddr (Nodeid (1, 42)))
+        for i in range (n):
+            b = self.lastSent ()
+            self.assertEqual (b[16:16 + len (self.tdata) + 1],
+                              self.tdata + bytes ([ i & 0xff ]))
+
+class TestEthTapMq (PeerEthTest):
+    spec = "{} --mode tap --queues 4".format (tapdev)
+    peer = tapdev
+    eclass = ethernet._TapEth
+
+    @classmethod
+    def setUpClass (cls):
+        if not ethernet._TapEth or not hasattr (socket, "AF_PACKET") \
+           or os.getuid () != 0:
+            raise unittest.SkipTest ("Multi-queue TAP tests must be run as root on Linux")
+        if os.system ("ip tuntap add dev {} mode tap multi_queue 2>/dev/null"
+                      .format (tapdev)):
+            raise unittest.SkipTest ("Can't create multi-queue TAP")
+        quiet (tapdev)
+
+    @classmethod
+    def tearDownClass (cls):
+        os.system ("ip link del {}".format (tapdev))
+
+    def test_queues (self):
+        self.assertEqual (len (self.eth.taps), 4)
+        self.assertEqual (len (self.eth.qthreads), 3)
+        for t in self.eth.qthreads:
+            self.assertTrue (t.is_alive ())
+
+    def test_counters (self):
+        # Frames arriving on all the queues are counted exactly, since
+        # the queue threads process them one at a time.
+        rcirc = self.circ ()
+        self.rport = self.eth.create_port (rcirc, ROUTINGPROTO)
+        self.rport.macaddr = Macaddr (Nodeid (1, 3))
+        d = self.lelen (self.tdata) + self.tdata + bytes (14)
+        for i in range (400):
+            # Vary the source address so the frames are spread over
+            # the queues; every other one is for another node.
+            src = b"\xaa\x00\x04\x00" + (i + 1).to_bytes (2, "little")
+            dst = b"\xaa\x00\x04\x00" + (b"\x03\x04", b"\x07\x04")[i & 1]
+            self.socket.send (dst + src + b"\x60\x03" + d)
+        for i in range (50):
+            if self.rport.counters.pkts_recv + \
+               self.eth.counters.unk_dest == 400:
+                break
+            time.sleep (0.02)
+        self.assertEqual (self.rport.counters.pkts_recv, 200)
+        self.assertEqual (self.rport.counters.bytes_recv, 200 * 60)
+        self.assertEqual (self.eth.counters.unk_dest, 200)
+        
+    def test_close (self):
+        # Close waits for all the queue threads to exit
+        threads = self.eth.qthreads
+        self.eth.close ()
+        for t in threads:
+            self.assertFalse (t.is_alive ())
+        self.assertFalse (self.eth.is_alive ())
+
+    def test_gather (self):
+        # Frames are sent as header plus payload pieces
+        self.rport = self.eth.create_port (self.node, ROUTINGPROTO)
+        self.rport.macaddr = Macaddr (Nodeid (1, 3))
+        with unittest.mock.patch ("decnet.ethernet.os.writev",
+                                  wraps = os.writev) as w:
+            self.rport.send (self.tdata, Macaddr (Nodeid (1, 42)))
+        iov = w.call_args[0][1]
+        self.assertEqual (len (iov), 3)
+        self.assertEqual (bytes (iov[1]), self.tdata)
+        b = self.lastSent ()
+        self.assertEqual (len (b), 60)
+        self.assertEqual (b[:16], b"\xaa\x00\x04\x00\x2a\x04"
+                          b"\xaa\x00\x04\x00\x03\x04\x60\x03\x1e\x00")
+        self.assertEqual (b[16:46], self.tdata)
+
 class TestEthUdp (EthTest):
     def setUp (self):
         # First open the Ethernet
@@ -105,6 +105,20 @@ class GreTest (DnTest):
         self.assertEqual (self.lport.counters.bytes_recv, 30)
         self.assertEqual (self.rport.counters.bytes_recv, 32)
 
+    def test_rcvburst (self):
+        # Several packets arriving back to back are all delivered, in
+        # order.
+        rcirc = self.circ ()
+        self.rport = self.gre.create_port (rcirc, ROUTINGPROTO)
+        for i in range (10):
+            d = self.tdata + bytes ([ i ])
+            self.postPacket (b"\x00\x00\x60\x03" + self.lelen (d) + d)
+        time.sleep (0.2)
+        for i in range (10):
+            w = self.lastdispatch (10, rcirc, back = 9 - i, itype = Received)
+            self.assertEqual (w.packet, self.tdata + bytes ([ i ]))
+        self.assertEqual (self.rport.counters.pkts_recv, 10)
+
     def test_xmit (self):
         self.rport = self.gre.create_port (self.node, ROUTINGPROTO)
         self.lport = self.gre.create_port (self.node, LOOPPROTO, pad = False)
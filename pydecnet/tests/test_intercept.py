@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+"""Unit tests for Phase III/IV intercept retransmission.
+"""
+
+from tests.dntest import *
+
+from decnet import intercept
+from decnet.nsp_packets import *
+from decnet.routing_packets import RouteHdr, ShortData, P2BareNSP
+from decnet.node import Nodeinfo
+
+# Connect Initiate from the Phase II node, link address 3
+ci = b"\x18\x00\x00\x03\x00\x01\x01\x00\x01hello"
+
+class test_ring (DnTest):
+    def test_save (self):
+        r = intercept.SaveRing (4)
+        for i in range (4):
+            self.assertTrue (r.save (Seq (4094 + i), i))
+        self.assertEqual (len (r), 4)
+        # Full
+        self.assertFalse (r.save (Seq (2), 4))
+        # Duplicate replaces the saved copy
+        self.assertTrue (r.save (Seq (4095), 11))
+        self.assertEqual (list (r), [ 0, 11, 2, 3 ])
+        # Ack across the sequence number wrap
+        self.assertEqual (r.ack (Seq (0)), 3)
+        self.assertEqual (list (r), [ 3 ])
+        # Old ack does nothing, nor does saving an acked message
+        self.assertEqual (r.ack (Seq (4094)), 0)
+        self.assertTrue (r.save (Seq (4095), 12))
+        self.assertEqual (list (r), [ 3 ])
+        # Out of sequence is refused
+        self.assertFalse (r.save (Seq (4), 4))
+        self.assertTrue (r.save (Seq (2), 4))
+        self.assertEqual (r.ack (Seq (2)), 2)
+        self.assertEqual (len (r), 0)
+        self.assertEqual (r.slots, [ None ] * 4)
+
+class test_p4intercept (DnTest):
+    def setUp (self):
+        super ().setUp ()
+        self.r = unittest.mock.Mock ()
+        self.r.name = "NEMO"
+        self.r.nodeid = self.node.nodeid
+        for n, name in ((self.node.nodeid, "NEMO"),
+                        (Nodeid (1, 66), "TOPS20"),
+                        (Nodeid (1, 130), "REM130")):
+            info = Nodeinfo (None, n)
+            info.nodename = name
+            self.node.addnodeinfo (info)
+        self.c = unittest.mock.Mock ()
+        self.c.node = self.node
+        self.c.parent = self.c.routing = self.r
+        self.c.id = self.c.rnodeid = Nodeid (1, 66)
+        self.c.rnodename = "TOPS20"
+        self.i = intercept.P4Intercept (self.c)
+        ok, pkt = self.i.recv (RouteHdr (dstnode = "REM130",
+                                         srcnode = "TOPS20",
+                                         payload = ci), self.c)
+        self.assertTrue (ok)
+        self.assertEqual (pkt.dstnode, Nodeid (1, 130))
+        # Connect Init is not saved
+        self.assertFalse (self.i.links)
+
+    def fromp2 (self, nsppkt):
+        ok, pkt = self.i.recv (P2BareNSP (payload = bytes (nsppkt)), self.c)
+        self.assertTrue (ok)
+        self.assertEqual (pkt.dstnode, Nodeid (1, 130))
+        return pkt
+
+    def top2 (self, nsppkt):
+        pkt = ShortData (dstnode = Nodeid (1, 66), srcnode = Nodeid (1, 130),
+                         rqr = 0, rts = 0, visit = 0,
+                         payload = bytes (nsppkt))
+        ok, pkt = self.i.send (pkt, self.c)
+        self.assertTrue (ok)
+        return pkt
+
+    def senddata (self, count):
+        for i in range (1, count + 1):
+            self.fromp2 (DataSeg (dstaddr = 7, srcaddr = 3, segnum = Seq (i),
+                                  payload = b"data%d" % i))
+
+    def test_retransmit (self):
+        self.senddata (3)
+        link = self.i.links[(Nodeid (1, 66), 3)]
+        self.assertEqual (len (link.data), 3)
+        self.assertTrue (link.islinked ())
+        # Remote acks the first two
+        self.top2 (AckData (dstaddr = 3, srcaddr = 7, acknum = AckNum (2)))
+        self.assertEqual (len (link.data), 1)
+        self.assertEqual (self.r.dispatch.call_count, 0)
+        DnTimeout (link)
+        self.assertEqual (self.r.dispatch.call_count, 1)
+        pkt = self.r.dispatch.call_args[0][0]
+        self.assertIsInstance (pkt, ShortData)
+        self.assertEqual (pkt.dstnode, Nodeid (1, 130))
+        self.assertEqual (pkt.srcnode, Nodeid (1, 66))
+        d = NspHdr (pkt.payload)
+        self.assertIsInstance (d, DataSeg)
+        self.assertEqual (d.segnum, 3)
+        self.assertEqual (d.payload, b"data3")
+        self.assertEqual (link.rtxtime, 2 * link.owner.RTXTIME)
+        self.assertTrue (link.islinked ())
+        # Ack of the rest stops the timer
+        self.top2 (AckData (dstaddr = 3, srcaddr = 7, acknum = AckNum (3)))
+        self.assertEqual (len (link.data), 0)
+        self.assertFalse (link.islinked ())
+        self.assertEqual (link.rtxtime, link.owner.RTXTIME)
+
+    def test_other (self):
+        self.senddata (1)
+        self.fromp2 (IntMsg (dstaddr = 7, srcaddr = 3, segnum = Seq (1),
+                             payload = b"int"))
+        link = self.i.links[(Nodeid (1, 66), 3)]
+        self.assertEqual (len (link.other), 1)
+        # Data message from the remote with cross subchannel ack of
+        # the interrupt.
+        self.top2 (DataSeg (dstaddr = 3, srcaddr = 7, segnum = Seq (1),
+                            acknum = AckNum (1, AckNum.XACK),
+                            payload = b"reply"))
+        self.assertEqual (len (link.other), 0)
+        self.assertEqual (len (link.data), 1)
+        self.top2 (AckOther (dstaddr = 3, srcaddr = 7,
+                             acknum2 = AckNum (1, AckNum.XACK)))
+        self.assertEqual (len (link.data), 0)
+        self.assertFalse (link.islinked ())
+
+    def test_nak (self):
+        self.senddata (3)
+        self.top2 (AckData (dstaddr = 3, srcaddr = 7,
+                            acknum = AckNum (1, AckNum.NAK)))
+        # Immediate retransmit of what is still saved
+        self.assertEqual (self.r.dispatch.call_count, 2)
+        d = NspHdr (self.r.dispatch.call_args_list[0][0][0].payload)
+        self.assertEqual (d.segnum, 2)
+
+    def test_giveup (self):
+        self.senddata (1)
+        key = (Nodeid (1, 66), 3)
+        link = self.i.links[key]
+        for i in range (link.owner.RETRIES):
+            DnTimeout (link)
+        self.assertEqual (self.r.dispatch.call_count, link.owner.RETRIES)
+        self.assertEqual (link.rtxtime, link.owner.RTXMAX)
+        DnTimeout (link)
+        self.assertNotIn (key, self.i.links)
+        self.assertFalse (link.islinked ())
+
+    def test_disconnect (self):
+        self.senddata (2)
+        link = self.i.links[(Nodeid (1, 66), 3)]
+        self.top2 (DiscInit (dstaddr = 3, srcaddr = 7, reason = 0,
+                             data_ctl = b""))
+        self.assertFalse (self.i.links)
+        self.assertFalse (self.i.conndb)
+        self.assertFalse (link.islinked ())
+
+    def test_adjdown (self):
+        self.senddata (2)
+        link = self.i.links[(Nodeid (1, 66), 3)]
+        self.i.adjdown (self.c)
+        self.assertFalse (self.i.links)
+        self.assertFalse (link.islinked ())
+
+    def test_local (self):
+        # Traffic for a link to this node (link address 4) is not saved
+        lci = ci[:3] + b"\x04" + ci[4:]
+        ok, pkt = self.i.recv (RouteHdr (dstnode = "NEMO", srcnode = "TOPS20",
+                                         payload = lci), self.c)
+        self.assertEqual (pkt.dstnode, self.node.nodeid)
+        d = DataSeg (dstaddr = 9, srcaddr = 4, segnum = Seq (1),
+                     payload = b"local")
+        ok, pkt = self.i.recv (P2BareNSP (payload = bytes (d)), self.c)
+        self.assertEqual (pkt.dstnode, self.node.nodeid)
+        self.assertFalse (self.i.links)
+        self.senddata (1)
+        self.assertEqual (list (self.i.links), [ (Nodeid (1, 66), 3) ])
+
+if __name__ == "__main__":
+    unittest.main ()
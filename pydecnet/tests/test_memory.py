@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+from tests.dntest import *
+
+from decnet import memory
+from decnet import ethernet
+
+wirenum = 0
+def nextwire ():
+    # Use a new wire name for each test, so nothing left over from a
+    # previous test can interfere.
+    global wirenum
+    wirenum += 1
+    return "wire{}".format (wirenum)
+
+class MemoryTest (DnTest):
+    def setUp (self):
+        super ().setUp ()
+        self.wire = nextwire ()
+        self.node2 = t_node ()
+        self.node2.nodename = "DORY"
+
+    def mkcirc (self, node, name, args = ""):
+        spec = "circuit {} Memory {} {}".format (name, self.wire, args)
+        return memory.Memory (node, name, self.config (spec))
+
+class MemoryPtpTest (MemoryTest):
+    args = ""
+
+    def setUp (self):
+        super ().setUp ()
+        self.mkpair ()
+
+    def mkpair (self):
+        self.dl1 = self.mkcirc (self.node, "mem-0", self.args)
+        self.dl2 = self.mkcirc (self.node2, "mem-1", self.args)
+        self.port1 = self.dl1.create_port (self.node)
+        self.port2 = self.dl2.create_port (self.node2)
+
+    def tearDown (self):
+        self.port1.close ()
+        self.port2.close ()
+        self.assertNotIn (self.wire, memory._segments)
+        super ().tearDown ()
+
+    def start (self):
+        self.port1.open ()
+        self.assertEqual (self.node.dispatch.call_count, 0)
+        self.port2.open ()
+        self.assertUp ()
+        w = self.lastdispatch (1, self.node2, itype = datalink.DlStatus)
+        self.assertEqual (w.status, w.UP)
+
+class TestMemoryPtp (MemoryPtpTest):
+    def test_start (self):
+        self.assertIsInstance (self.dl1, memory._MemoryPtp)
+        self.start ()
+        self.assertIs (self.dl1.peer, self.dl2)
+        self.assertIs (self.dl2.peer, self.dl1)
+
+    def test_send (self):
+        self.start ()
+        self.port1.send (testsdu ())
+        w = self.lastdispatch (2, self.node2, itype = Received)
+        self.assertEqual (w.packet, testsdu ())
+        self.port2.send (b"reply")
+        w = self.lastdispatch (2, itype = Received)
+        self.assertEqual (w.packet, b"reply")
+        self.assertEqual (self.dl1.counters.pkts_sent, 1)
+        self.assertEqual (self.dl1.counters.bytes_sent, len (testsdu ()))
+        self.assertEqual (self.dl1.counters.pkts_recv, 1)
+        self.assertEqual (self.dl1.counters.bytes_recv, 5)
+        self.assertEqual (self.dl2.counters.pkts_recv, 1)
+        self.assertEqual (self.dl2.counters.bytes_recv, len (testsdu ()))
+
+    def test_copy (self):
+        # The sender may reuse its buffer after the send
+        self.start ()
+        buf = bytearray (testsdu ())
+        self.port1.send (buf)
+        buf[0:4] = b"five"
+        w = self.lastdispatch (2, self.node2, itype = Received)
+        self.assertEqual (w.packet, testsdu ())
+
+    def test_stop (self):
+        self.start ()
+        self.port1.close ()
+        w = self.lastdispatch (2, itype = datalink.DlStatus)
+        self.assertEqual (w.status, w.DOWN)
+        w = self.lastdispatch (2, self.node2, itype = datalink.DlStatus)
+        self.assertEqual (w.status, w.DOWN)
+        # Nothing goes across while the other end is stopped
+        self.port2.send (testsdu ())
+        self.assertEqual (self.node.dispatch.call_count, 2)
+        # Start it again, now both are back up
+        self.port1.open ()
+        self.assertUp (3)
+        w = self.lastdispatch (3, self.node2, itype = datalink.DlStatus)
+        self.assertEqual (w.status, w.UP)
+
+    def test_restart (self):
+        self.start ()
+        self.port2.restart ()
+        # The other end sees the restart as down then up
+        self.assertUp (3)
+        w = self.lastdispatch (3, self.node2, itype = datalink.DlStatus)
+        self.assertEqual (w.status, w.UP)
+        w = self.lastdispatch (3, back = 1, itype = datalink.DlStatus)
+        self.assertEqual (w.status, w.DOWN)
+
+    def test_noqueue (self):
+        # Memory circuits send directly, they can't queue frames
+        with self.assertRaises (RuntimeError):
+            self.dl1.queue_frame (testsdu ())
+        self.assertFalse (self.dl1.txq)
+
+    def test_third (self):
+        # A wire connects only two circuits
+        self.start ()
+        dl3 = self.mkcirc (self.node, "mem-2")
+        port3 = dl3.create_port (self.node)
+        port3.open ()
+        self.assertIsNone (dl3.seg)
+        self.assertEqual (logging.error.call_count, 1)
+        self.assertEqual (self.node.dispatch.call_count, 1)
+
+    def test_mismatch (self):
+        # Point to point and LAN circuits can't share a name
+        self.start ()
+        dl3 = self.mkcirc (self.node, "mem-2", "--mode lan")
+        self.assertIsInstance (dl3, ethernet._Ethernet)
+        dl3.open ()
+        self.assertIsNone (dl3.seg)
+        self.assertEqual (logging.error.call_count, 1)
+
+class TestMemoryLoss (MemoryPtpTest):
+    args = "--loss 30 --seed xyzzy"
+
+    def sendmany (self):
+        for i in range (1, 201):
+            self.port1.send (testsdu (i))
+        calls = self.node2.dispatch.call_args_list[1:]
+        return [ int.from_bytes (c[0][0].packet, "little") for c in calls ]
+
+    def test_loss (self):
+        self.start ()
+        got = self.sendmany ()
+        lost = self.dl1.shaper.dropped
+        self.assertEqual (len (got) + lost, 200)
+        self.assertTrue (30 < lost < 90)
+        self.assertEqual (got, sorted (got))
+        # Do it again, with a new pair of circuits configured the
+        # same way on another wire.  The same messages should be lost.
+        self.port1.close ()
+        self.port2.close ()
+        self.node.dispatch.reset_mock ()
+        self.node2.dispatch.reset_mock ()
+        self.wire = nextwire ()
+        self.mkpair ()
+        self.start ()
+        self.assertEqual (self.sendmany (), got)
+
+class TestMemoryDelay (MemoryPtpTest):
+    args = "--delay 100"
+
+    def test_delay (self):
+        self.start ()
+        self.port1.send (testsdu (1))
+        self.port1.send (testsdu (2))
+        self.assertEqual (self.node2.dispatch.call_count, 1)
+        time.sleep (0.3)
+        w = self.lastdispatch (3, self.node2, itype = Received)
+        self.assertEqual (w.packet, testsdu (2))
+        w = self.lastdispatch (3, self.node2, back = 1, itype = Received)
+        self.assertEqual (w.packet, testsdu (1))
+
+class TestMemoryRate (MemoryPtpTest):
+    # 1000 bytes at 80 kb/s takes 0.1 second
+    args = "--rate 80000"
+
+    def test_rate (self):
+        self.start ()
+        t0 = time.monotonic ()
+        for i in range (3):
+            self.port1.send (bytes (1000))
+        self.assertTrue (self.dl1.shaper.txdone - t0 >= 0.3)
+        time.sleep (0.15)
+        self.assertEqual (self.node2.dispatch.call_count, 2)
+        time.sleep (0.3)
+        self.lastdispatch (4, self.node2, itype = Received)
+
+class TestMemoryLan (MemoryTest):
+    def setUp (self):
+        super ().setUp ()
+        self.node3 = t_node ()
+        self.node3.nodename = "MARLIN"
+        self.nodes = (self.node, self.node2, self.node3)
+        self.dls = list ()
+        self.ports = list ()
+        for i, n in enumerate (self.nodes):
+            dl = self.mkcirc (n, "lan-{}".format (i), "--mode lan")
+            dl.open ()
+            port = dl.create_port (n, ROUTINGPROTO)
+            port.macaddr = Macaddr (Nodeid (1, i + 1))
+            self.dls.append (dl)
+            self.ports.append (port)
+
+    def tearDown (self):
+        for dl in self.dls:
+            dl.close ()
+        self.assertNotIn (self.wire, memory._segments)
+        super ().tearDown ()
+
+    def test_multicast (self):
+        self.ports[0].add_multicast (Macaddr ("AB-00-00-03-00-00"))
+        self.ports[1].add_multicast (Macaddr ("AB-00-00-03-00-00"))
+        self.ports[0].send (testsdu (), Macaddr ("AB-00-00-03-00-00"))
+        w = self.lastdispatch (1, self.node2, itype = Received)
+        self.assertEqual (bytes (w.packet), testsdu ())
+        self.assertEqual (w.src, self.ports[0].macaddr)
+        # Not delivered to the sender, or to a node that isn't
+        # listening to that address.
+        self.assertEqual (self.node.dispatch.call_count, 0)
+        self.assertEqual (self.node3.dispatch.call_count, 0)
+        self.assertEqual (self.dls[2].counters.unk_dest, 1)
+
+    def test_unicast (self):
+        self.ports[1].send (testsdu (), self.ports[2].macaddr)
+        w = self.lastdispatch (1, self.node3, itype = Received)
+        self.assertEqual (bytes (w.packet), testsdu ())
+        self.assertEqual (self.ports[2].counters.pkts_recv, 1)
+        self.assertEqual (self.ports[1].counters.pkts_sent, 1)
+        self.assertEqual (self.node.dispatch.call_count, 0)
+
+    def test_close (self):
+        self.dls[2].close ()
+        self.ports[1].send (testsdu (), self.ports[2].macaddr)
+        self.assertEqual (self.node3.dispatch.call_count, 0)
+        self.ports[1].send (testsdu (), self.ports[0].macaddr)
+        self.lastdispatch (1, itype = Received)
+
+if __name__ == "__main__":
+    unittest.main ()
@@ -101,6 +101,22 @@ class TestMultinetUDP (MultinetBase, MultinetCommonTests):
     def sendpdu (self, pdu):
         self.socket.sendto (pdu, ("127.0.0.1", self.cport))
 
+    def test_batch (self):
+        # Messages sent while handling one burst of work go out
+        # together when that work is done.
+        self.node.enable_dispatcher (False)
+        for i in range (5):
+            self.rport.send (testsdu (i), None)
+        self.assertEqual (len (self.mult.txq.q), 5)
+        self.node.enable_dispatcher ()
+        self.node.dispatcher.dispatch ()
+        self.assertEqual (len (self.mult.txq.q), 0)
+        self.assertEqual (self.mult.txq.sent, 5)
+        if datalink._sendmmsg:
+            self.assertEqual (self.mult.txq.calls, 1)
+        for i in range (5):
+            self.assertEqual (self.receivedata (), self.pdu (i, testsdu (i)))
+        
 class TestMultinetUDPnodest (MultinetBase):
     def setUp (self):
         self.lport = nextport ()
@@ -220,6 +236,45 @@ class MultinetTCPbase (MultinetBase, MultinetCommonTests):
         self.assertEqual (self.mult.counters.bytes_recv, 10)
         self.assertEqual (self.mult.counters.pkts_recv, 2)
         
+    def test_framing3 (self):
+        "Test handling of many frames, more than the receive buffer"
+        sdus = [ randpkt (1, 1500) for i in range (200) ]
+        sdus.append (bytes (65535))
+        self.socket.sendall (b"".join (self.pdu (0, sdu) for sdu in sdus))
+        time.sleep (0.5)
+        calls = self.node.dispatch.call_args_list
+        self.assertGreaterEqual (len (calls), len (sdus) + 1)
+        for i, sdu in enumerate (sdus):
+            w = self.lastdispatch (len (sdus) + 1, back = len (sdus) - 1 - i,
+                                   itype = Received)
+            self.assertEqual (w.packet, sdu)
+        self.assertEqual (self.mult.counters.pkts_recv, len (sdus))
+
+    def test_burst (self):
+        "Test that a burst of messages is sent with one write"
+        writes = self.mult.counters.tx_writes
+        self.node.enable_dispatcher (False)
+        for n in range (3):
+            self.rport.send (testsdu (n), None)
+        self.assertEqual (len (self.mult.txq), 6)
+        self.node.enable_dispatcher ()
+        self.node.dispatcher.dispatch ()
+        for n in range (3):
+            b = self.receivedata ()
+            self.assertEqual (b, self.pdu (n, testsdu (n)))
+        self.assertEqual (self.mult.counters.tx_writes, writes + 1)
+        self.assertEqual (self.mult.counters.pkts_sent, 3)
+
+    def test_nodelay (self):
+        "Test the --nodelay option"
+        sock = self.mult.socket
+        self.assertFalse (sock.getsockopt (socket.IPPROTO_TCP,
+                                           socket.TCP_NODELAY))
+        self.mult.config.nodelay = True
+        self.mult.connected ()
+        self.assertTrue (sock.getsockopt (socket.IPPROTO_TCP,
+                                          socket.TCP_NODELAY))
+        
 class TestMultinetTCPconnect (MultinetTCPbase):
     "Test TCP connect mode"
 
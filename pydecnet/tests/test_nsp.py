@@ -23,6 +23,7 @@ class ntest (DnTest):
     myphase = 4
     max_connections = 511
     qmax = nsp.Seq.maxdelta
+    rtt_estimator = "nsp"
     
     def setUp (self):
         super ().setUp ()
@@ -34,6 +35,7 @@ class ntest (DnTest):
         self.config.nsp.nsp_weight = 3
         self.config.nsp.qmax = self.qmax
         self.config.nsp.retransmits = 3
+        self.config.nsp.rtt_estimator = self.rtt_estimator
         self.node.ntype = routing.L2ROUTER
         self.node.routing = unittest.mock.Mock ()
         self.node.routing.send = unittest.mock.Mock (wraps = self.rsend)
@@ -145,6 +147,15 @@ class inbound_base (ntest):
         self.assertEqual (nc.state, nc.run)
         self.assertEqual (len (nc.data.pending_ack), 0)
 
+    def ack (self, num):
+        # Deliver an incoming data ack for the supplied segment number
+        lla = self.nspconn.srcaddr
+        ack = b"\x04" + lla.to_bytes (2, "little") + b"\x03\x00" + \
+              (num + 0x8000).to_bytes (2, "little")
+        w = Received (owner = self.nsp, src = self.remnode,
+                      packet = ack, rts = False)
+        self.node.addwork (w)
+
 class common_inbound (inbound_base):
     def test_normalconn (self):
         """Basic good inbound connection (accept, data, disconnect)"""
@@ -301,7 +312,11 @@ class common_inbound (inbound_base):
             self.assertEqual (ds2.acknum2, nsp.AckNum (4, nsp.AckNum.XACK))
         else:
             self.assertFalse (hasattr (ds2, "acknum2"))
-        self.assertEqual (ds.payload + ds2.payload, b"hello world" * 40)
+        # The segment payloads are slices of the one message buffer
+        self.assertIsInstance (ds.payload, memoryview)
+        self.assertIs (ds.payload.obj, ds2.payload.obj)
+        self.assertEqual (bytes (ds.payload) + bytes (ds2.payload),
+                          b"hello world" * 40)
         # These transmitted messages have not yet been acked, so they
         # should be on the pending queue.
         self.assertEqual (len (nc.data.pending_ack), 3)
@@ -388,6 +403,9 @@ class common_inbound (inbound_base):
         r = self.node.routing
         s = self.node.session
         self.accept ()
+        # This test is about flow control on retransmit, so keep the
+        # congestion window out of the picture.
+        nc.setsockopt (congestion = False)
         # Check the timers are all in the correct state.
         if nc.cphase == 2:
             self.assertFalse (nc.islinked ())
@@ -452,11 +470,10 @@ class common_inbound (inbound_base):
         self.assertEqual (r.send.call_count, 5 + self.cdadj)
         self.assertEqual (len (nc.data.pending_ack), 2)
         self.assertTrue (nc.data.pending_ack[0].sent)
-        self.assertTrue (nc.data.pending_ack[0].islinked ())
+        self.assertTrue (nc.data.rtxtimer.islinked ())
         self.assertTrue (nc.data.pending_ack[1].sent)
-        self.assertTrue (nc.data.pending_ack[1].islinked ())
         # Time out the first packet
-        DnTimeout (nc.data.pending_ack[0])
+        DnTimeout (nc.data.rtxtimer)
         # Check counters
         self.assertEqual (nc.destnode.counters.timeout, 1)
         # Check retransmit occurred
@@ -472,9 +489,9 @@ class common_inbound (inbound_base):
         self.assertEqual (ds.payload, b"packet")
         # Turn off flow
         if self.services == b'\x05':
-            # Send segment count delta -1
+            # Send segment count delta -2, so neither packet may be sent
             p = b"\x10" + lla.to_bytes (2, "little") + \
-                b"\x03\x00\x02\x00\x00\xff"
+                b"\x03\x00\x02\x00\x00\xfe"
         else:
             # Not segment flow control, send xoff
             p = b"\x10" + lla.to_bytes (2, "little") + \
@@ -493,12 +510,12 @@ class common_inbound (inbound_base):
         self.assertEqual (ds.acknum, nsp.AckNum (2))
         self.assertFalse (hasattr (ds, "acknum2"))
         self.assertFalse (nc.other.islinked ())
-        # Time out the second packet, should not send
-        DnTimeout (nc.data.pending_ack[1])
-        self.assertFalse (nc.data.pending_ack[1].sent)
-        # Skip this test because our simulated timeout doesn't unlink
-        # the timer, the way a real timeout does.
-        #self.assertFalse (nc.data.pending_ack[1].islinked ())
+        # Time out the first packet again, should not send, and the
+        # retransmit timer is not restarted.
+        DnTimeout (nc.data.rtxtimer)
+        self.assertFalse (nc.data.pending_ack[0].sent)
+        self.assertTrue (nc.data.pending_ack[1].sent)
+        self.assertFalse (nc.data.rtxtimer.islinked ())
         self.assertEqual (r.send.call_count, 7 + self.cdadj)
         # Turn off flow
         if self.services == b'\x05':
@@ -512,8 +529,9 @@ class common_inbound (inbound_base):
         w = Received (owner = self.nsp, src = self.remnode,
                       packet = p, rts = False)
         self.node.addwork (w)
-        # LS ACK (if not Phase 4) and second packet resend should have
-        # happened now
+        # LS ACK (if not Phase 4) and first packet resend should have
+        # happened now.  The second packet is not resent, it is still
+        # considered to be in flight.
         if nc.cphase == 4:
             lsadj = 0
         else:
@@ -530,7 +548,8 @@ class common_inbound (inbound_base):
             self.assertEqual (ds.acknum2, nsp.AckNum (3, nsp.AckNum.XACK))
         else:
             self.assertFalse (hasattr (ds, "acknum2"))
-        self.assertEqual (ds.payload, b"packet2")
+        self.assertEqual (ds.payload, b"packet")
+        self.assertTrue (nc.data.rtxtimer.islinked ())
         # Test inactivity timer, if applicable
         if nc.cphase > 2:
             DnTimeout (nc)
@@ -580,9 +599,9 @@ class common_inbound (inbound_base):
         self.assertEqual (r.send.call_count, 3 + self.cdadj)
         self.assertEqual (len (nc.data.pending_ack), 1)
         self.assertTrue (nc.data.pending_ack[0].sent)
-        self.assertTrue (nc.data.pending_ack[0].islinked ())
+        self.assertTrue (nc.data.rtxtimer.islinked ())
         # Time out the packet
-        DnTimeout (nc.data.pending_ack[0])
+        DnTimeout (nc.data.rtxtimer)
         # Check counters
         self.assertEqual (nc.destnode.counters.timeout, 1)
         # Check retransmit occurred
@@ -597,11 +616,11 @@ class common_inbound (inbound_base):
         self.assertFalse (hasattr (ds, "acknum2"))
         self.assertEqual (ds.payload, b"packet")
         # Check other state
-        self.assertTrue (nc.data.pending_ack[0].islinked ())
+        self.assertTrue (nc.data.rtxtimer.islinked ())
         self.assertEqual (nc.state, nc.run)
         self.assertConns (1, True)        
         # Time it out again
-        DnTimeout (nc.data.pending_ack[0])
+        DnTimeout (nc.data.rtxtimer)
         # Check counters
         self.assertEqual (nc.destnode.counters.timeout, 2)
         # Check retransmit occurred
@@ -616,11 +635,11 @@ class common_inbound (inbound_base):
         self.assertFalse (hasattr (ds, "acknum2"))
         self.assertEqual (ds.payload, b"packet")
         # Check other state
-        self.assertTrue (nc.data.pending_ack[0].islinked ())
+        self.assertTrue (nc.data.rtxtimer.islinked ())
         self.assertEqual (nc.state, nc.run)
         self.assertConns (1, True)        
         # Time it out again.  This goes over the limit
-        DnTimeout (nc.data.pending_ack[0])
+        DnTimeout (nc.data.rtxtimer)
         # Check counters
         self.assertEqual (nc.destnode.counters.timeout, 3)
         # Check retransmit did not occur
@@ -777,9 +796,9 @@ class test_inbound_noflow_phase4 (common_inbound):
         self.assertEqual (nc.cphase, min (self.phase, self.node.phase))
         # Check new connection state
         self.assertEqual (nc.state, nc.cc)
-        self.assertTrue (nc.data.pending_ack[0].islinked ())
+        self.assertTrue (nc.data.rtxtimer.islinked ())
         # Time out the confirm
-        DnTimeout (nc.data.pending_ack[0])
+        DnTimeout (nc.data.rtxtimer)
         # Check counters
         self.assertEqual (nc.destnode.counters.timeout, 1)
         # Check the retransmit
@@ -814,9 +833,9 @@ class test_inbound_noflow_phase4 (common_inbound):
         self.assertEqual (rj.data_ctl, b"not excellent")
         self.assertEqual (nc.state, nc.di)
         self.assertEqual (len (nc.data.pending_ack), 1)
-        self.assertTrue (nc.data.pending_ack[0].islinked ())
+        self.assertTrue (nc.data.rtxtimer.islinked ())
         # Time out the reject
-        DnTimeout (nc.data.pending_ack[0])
+        DnTimeout (nc.data.rtxtimer)
         self.assertEqual (r.send.call_count, 2 + self.cdadj)
         args, kwargs = r.send.call_args
         ds, dest = args
@@ -864,10 +883,20 @@ class test_inbound_noflow_phase4 (common_inbound):
         self.node.addwork (w)
         # Nothing yet to session control
         self.assertEqual (s.dispatch.call_count, 2 - (self.phase == 2))
-        # No acks yet
+        # No acks yet, except that Phase IV sends a NAK for the gap,
+        # once.
         self.assertFalse (nc.data.islinked ())
+        nakadj = int (nc.cphase == 4)
+        self.assertEqual (r.send.call_count, 1 + self.cdadj + nakadj)
+        if nakadj:
+            args, kwargs = r.send.call_args
+            ds, dest = args
+            self.assertIsInstance (ds, nsp.AckData)
+            self.assertEqual (ds.acknum, nsp.AckNum (0, nsp.AckNum.NAK))
+            self.assertEqual (nc.data.naks_sent, 1)
         # Two packets in out of order cache
         self.assertEqual (len (nc.data.ooo), 2)
+        self.assertEqual (nc.data.ooo_saved, 2)
         # Deliver packet 1
         w = Received (owner = self.nsp, src = self.remnode,
                       packet = d1, rts = False)
@@ -887,17 +916,17 @@ class test_inbound_noflow_phase4 (common_inbound):
         self.assertEqual (pkt.payload, b"data 2")
         # One packet left in OOO cache
         self.assertEqual (len (nc.data.ooo), 1)
-        # Force ACK if phase 4
-        if nc.cphase == 4:
-            DnTimeout (nc.data)
-        self.assertEqual (r.send.call_count, 2 + self.cdadj)
+        self.assertEqual (nc.data.ooo_hits, 1)
+        # There is still a gap, so Phase IV sends a NAK immediately
+        # rather than a delayed ACK.
+        self.assertEqual (r.send.call_count, 2 + self.cdadj + nakadj)
         args, kwargs = r.send.call_args
         ds, dest = args
         self.assertIsInstance (ds, nsp.AckData)
         self.assertEqual (dest, self.remnode)
         self.assertEqual (ds.srcaddr, lla)
         self.assertEqual (ds.dstaddr, rla)
-        self.assertEqual (ds.acknum, nsp.AckNum (2))
+        self.assertEqual (ds.acknum, nsp.AckNum (2, nakadj))
         self.assertFalse (hasattr (ds, "acknum2"))
         self.assertFalse (nc.data.islinked ())
         # Deliver packet 3
@@ -919,10 +948,11 @@ class test_inbound_noflow_phase4 (common_inbound):
         self.assertEqual (pkt.payload, b"data 4")
         # OOO cache now empty
         self.assertEqual (len (nc.data.ooo), 0)
+        self.assertEqual (nc.data.ooo_hits, 2)
         # Force ACK if phase 4
         if nc.cphase == 4:
             DnTimeout (nc.data)
-        self.assertEqual (r.send.call_count, 3 + self.cdadj)
+        self.assertEqual (r.send.call_count, 3 + self.cdadj + nakadj)
         args, kwargs = r.send.call_args
         ds, dest = args
         self.assertIsInstance (ds, nsp.AckData)
@@ -952,8 +982,15 @@ class test_inbound_noflow_phase4 (common_inbound):
         self.node.addwork (w)
         # Nothing to session control
         self.assertEqual (s.dispatch.call_count, 2 - (self.phase == 2))
-        # No acks yet
+        # No acks yet, other than a NAK if Phase IV
         self.assertFalse (nc.other.islinked ())
+        nakadj = int (nc.cphase == 4)
+        self.assertEqual (r.send.call_count, 1 + self.cdadj + nakadj)
+        if nakadj:
+            args, kwargs = r.send.call_args
+            ds, dest = args
+            self.assertIsInstance (ds, nsp.AckOther)
+            self.assertEqual (ds.acknum, nsp.AckNum (0, nsp.AckNum.NAK))
         # One packet in out of order cache for Int/LS subchannel (yes,
         # we have one)
         self.assertEqual (len (nc.other.ooo), 1)
@@ -966,7 +1003,7 @@ class test_inbound_noflow_phase4 (common_inbound):
         # OOO cache is now empty
         self.assertEqual (len (nc.data.ooo), 0)
         # Int/LS always gets immediate ACK
-        self.assertEqual (r.send.call_count, 2 + self.cdadj)
+        self.assertEqual (r.send.call_count, 2 + self.cdadj + nakadj)
         args, kwargs = r.send.call_args
         ds, dest = args
         self.assertIsInstance (ds, nsp.AckOther)
@@ -1124,7 +1161,7 @@ class test_inbound_noflow_phase4 (common_inbound):
         # Both are awaiting ack
         self.assertEqual (len (nc.data.pending_ack), 2)
         # Time out the first packet
-        DnTimeout (nc.data.pending_ack[0])
+        DnTimeout (nc.data.rtxtimer)
         self.assertEqual (r.send.call_count, 9 + self.cdadj)
         args, kwargs = r.send.call_args
         ds, dest = args
@@ -1158,16 +1195,16 @@ class test_inbound_noflow_phase4 (common_inbound):
         self.assertEqual (ds.acknum, nsp.AckNum (2))
         self.assertFalse (hasattr (ds, "acknum2"))
         self.assertFalse (nc.other.islinked ())
-        # Time out the second packet, should not send
-        DnTimeout (nc.data.pending_ack[1])
-        self.assertFalse (nc.data.pending_ack[1].sent)
+        # Time out the first packet again, should not send
+        DnTimeout (nc.data.rtxtimer)
+        self.assertFalse (nc.data.pending_ack[0].sent)
         self.assertEqual (r.send.call_count, 10 + self.cdadj)
         # Ack both.
         ack = b"\x04" + lla.to_bytes (2, "little") + b"\x03\x00\x04\x80"
         w = Received (owner = self.nsp, src = self.remnode,
                       packet = ack, rts = False)
         self.node.addwork (w)
-        # Even though the second packet was not resent, it was sent
+        # Even though the first packet was not resent, it was sent
         # once before so an ack for it is valid.  So both packets
         # should be acked now.
         self.assertEqual (len (nc.data.pending_ack), 0)
@@ -1658,7 +1695,7 @@ class outbound_base (ntest):
         r = self.node.routing
         s = self.node.session
         if self.phase > 2:
-            self.assertTrue (nc.data.pending_ack[0].islinked ())
+            self.assertTrue (nc.data.rtxtimer.islinked ())
             p = b"\x24" + lla.to_bytes (2, "little")
             w = Received (owner = self.nsp, src = self.remnode,
                           packet = p, rts = False)
@@ -1765,7 +1802,7 @@ class outbound_base (ntest):
         r = self.node.routing
         s = self.node.session
         if self.phase > 2:
-            self.assertTrue (nc.data.pending_ack[0].islinked ())
+            self.assertTrue (nc.data.rtxtimer.islinked ())
             p = b"\x24" + lla.to_bytes (2, "little")
             w = Received (owner = self.nsp, src = self.remnode,
                           packet = p, rts = False)
@@ -1831,7 +1868,7 @@ class outbound_base (ntest):
         r = self.node.routing
         s = self.node.session
         if self.phase > 2:
-            self.assertTrue (nc.data.pending_ack[0].islinked ())
+            self.assertTrue (nc.data.rtxtimer.islinked ())
             p = b"\x24" + lla.to_bytes (2, "little")
             w = Received (owner = self.nsp, src = self.remnode,
                           packet = p, rts = False)
@@ -1899,10 +1936,10 @@ class outbound_base (ntest):
         lla = nc.srcaddr
         r = self.node.routing
         s = self.node.session
-        self.assertTrue (nc.data.pending_ack[0].islinked ())
+        self.assertTrue (nc.data.rtxtimer.islinked ())
         self.assertEqual (nc.state, nc.ci)
         # Time out the CI
-        DnTimeout (nc.data.pending_ack[0])
+        DnTimeout (nc.data.rtxtimer)
         self.assertEqual (r.send.call_count, 2)
         args, kwargs = r.send.call_args
         ci, dest = args
@@ -1916,11 +1953,11 @@ class outbound_base (ntest):
         # Check counters
         self.assertEqual (nc.destnode.counters.timeout, 1)
         # Still same state
-        self.assertTrue (nc.data.pending_ack[0].islinked ())
+        self.assertTrue (nc.data.rtxtimer.islinked ())
         self.assertEqual (nc.state, nc.ci)
         self.assertConns (1, True)        
         # Time out the CI again
-        DnTimeout (nc.data.pending_ack[0])
+        DnTimeout (nc.data.rtxtimer)
         self.assertEqual (r.send.call_count, 3)
         args, kwargs = r.send.call_args
         ci, dest = args
@@ -1934,18 +1971,18 @@ class outbound_base (ntest):
         # Check counters
         self.assertEqual (nc.destnode.counters.timeout, 2)
         # Still same state
-        self.assertTrue (nc.data.pending_ack[0].islinked ())
+        self.assertTrue (nc.data.rtxtimer.islinked ())
         self.assertEqual (nc.state, nc.ci)
         self.assertConns (1, True)        
         # Time out the CI a third time
-        DnTimeout (nc.data.pending_ack[0])
+        DnTimeout (nc.data.rtxtimer)
         # No more retransmits once we hit the limit
         self.assertEqual (r.send.call_count, 3)
         # Check counters
         self.assertEqual (nc.destnode.counters.timeout, 3)
         # Still same state (connect is not aborted because destination
         # might be phase II) but no longer being timed out.
-        self.assertFalse (nc.data.pending_ack[0].islinked ())
+        self.assertFalse (nc.data.rtxtimer.islinked ())
         self.assertEqual (nc.state, nc.ci)
         self.assertConns (1, True)        
 
@@ -1954,7 +1991,7 @@ class outbound_base (ntest):
         lla = nc.srcaddr
         r = self.node.routing
         s = self.node.session
-        self.assertTrue (nc.data.pending_ack[0].islinked ())
+        self.assertTrue (nc.data.rtxtimer.islinked ())
         self.assertEqual (nc.state, nc.ci)
         # Time out the connection (i.e., no reply from other SC)
         DnTimeout (nc)
@@ -2101,6 +2138,66 @@ class test_connlimit_phase4 (ntest):
         # No new connections
         self.assertConns (i)
 
+class test_connlist (ntest):
+    max_connections = 255
+    remnode = Nodeid (1, 42)
+
+    def setUp (self):
+        super ().setUp ()
+        self.conns = [ self.nsp.connect (self.remnode, b"connect")
+                       for i in range (20) ]
+        self.node.nodeinfo_byid[self.remnode] = self.conns[0].destnode
+        
+    def test_links (self):
+        n = self.conns[0].destnode
+        self.assertEqual (n.links, 20)
+        # Closing a connection updates the count
+        c = self.conns.pop ()
+        c.close ()
+        self.assertEqual (n.links, 19)
+        # NICE read node status uses the count
+        resp = collections.defaultdict (container)
+        req = unittest.mock.Mock ()
+        req.sumstat.return_value = True
+        self.nsp.read_node (req, n, resp)
+        self.assertEqual (resp[n].active_links, 19)
+
+    def test_pages (self):
+        addrs = sorted (c.srcaddr for c in self.conns)
+        # Default is all of them
+        ret = self.nsp.get_api ()
+        self.assertEqual (ret["connection_count"], 20)
+        self.assertEqual (len (ret["connections"]), 20)
+        self.assertNotIn ("next", ret)
+        # In pages of 8
+        ret = self.nsp.get_api ({ "count" : 8 })
+        self.assertEqual ([ c["local_addr"] for c in ret["connections"] ],
+                          addrs[:8])
+        self.assertEqual (ret["next"], addrs[8])
+        ret = self.nsp.get_api ({ "start" : ret["next"], "count" : 8 })
+        self.assertEqual ([ c["local_addr"] for c in ret["connections"] ],
+                          addrs[8:16])
+        ret = self.nsp.get_api ({ "start" : ret["next"], "count" : 8 })
+        self.assertEqual ([ c["local_addr"] for c in ret["connections"] ],
+                          addrs[16:])
+        self.assertNotIn ("next", ret)
+
+    def test_html_pages (self):
+        self.nsp.HTML_CONNS = 8
+        addrs = sorted (c.srcaddr for c in self.conns)
+        self.node.session.html_localuser.return_value = ""
+        self.node.session.html_remuser.return_value = ""
+        ret = str (self.nsp.html_conns ("status"))
+        self.assertIn ("Next page", ret)
+        self.assertIn ("nsp/status/{}".format (addrs[8]), ret)
+        self.assertNotIn ("First page", ret)
+        ret = str (self.nsp.html_conns ("status", start = addrs[16]))
+        self.assertNotIn ("Next page", ret)
+        self.assertIn ("First page", ret)
+        ret = str (self.nsp.html_conns ("counters"))
+        self.assertIn ("nsp/counters/{}".format (addrs[8]), ret)
+        self.assertIn ("Data segments sent", ret)
+        
 class test_connlimit_phase3 (test_connlimit_phase4):
     remnode = Nodeid (42)
     info = b'\x00'       # NSP 3.2 (phase 3)
@@ -2178,6 +2275,338 @@ class test_qlimit_phase2 (test_qlimit_phase3):
     phase = 2
     cdadj = 0
 
+class test_congestion (inbound_base):
+    qmax = 8
+
+    def test_congestion (self):
+        nc = self.nspconn
+        r = self.node.routing
+        self.accept ()
+        self.assertEqual (nc.data.window (), self.qmax)
+        self.assertEqual (nc.get_api ()["window"], self.qmax)
+        # Fill the window, and queue a pile more
+        for i in range (self.qmax * 3):
+            nc.send_data (byte (i))
+        self.assertEqual (r.send.call_count, self.qmax + 1 + self.cdadj)
+        # Time out the first segment.  That is retransmitted, and the
+        # window closes down to one.
+        DnTimeout (nc.data.rtxtimer)
+        self.assertEqual (r.send.call_count, self.qmax + 2 + self.cdadj)
+        self.assertEqual (nc.data.window (), 1)
+        self.assertEqual (nc.data.cwthresh, self.qmax // 2)
+        # Another timeout retransmits the first segment again.  That
+        # is part of the same congestion event so the window doesn't
+        # change.
+        DnTimeout (nc.data.rtxtimer)
+        self.assertEqual (r.send.call_count, self.qmax + 3 + self.cdadj)
+        args, kwargs = r.send.call_args
+        d, dest = args
+        self.assertEqual (d.payload, byte (0))
+        self.assertEqual (nc.data.pending_ack[0].tries, 3)
+        self.assertEqual (nc.data.cwthresh, self.qmax // 2)
+        # Ack the first segment.  The window opens to 2.  Segments 2
+        # and 3 are still in flight from before, so nothing is sent,
+        # but the retransmit timer is now running for segment 2.
+        self.ack (1)
+        self.assertEqual (nc.data.window (), 2)
+        self.assertEqual (r.send.call_count, self.qmax + 3 + self.cdadj)
+        self.assertTrue (nc.data.rtxtimer.islinked ())
+        self.assertEqual (nc.data.pending_ack[0].tries, 1)
+        # Ack those; the window opens one per ack up to the threshold
+        self.ack (3)
+        self.assertEqual (nc.data.window (), 4)
+        self.assertEqual (r.send.call_count, self.qmax + 3 + self.cdadj)
+        # Past the threshold, growth is about one segment per window.
+        # Segments 4 to 7 acked leaves the window at 4, so 8 through
+        # 11 may be in flight, which means 9 to 11 are sent now.
+        self.ack (7)
+        self.assertEqual (nc.data.window (), 4)
+        self.assertEqual (r.send.call_count, self.qmax + 6 + self.cdadj)
+        self.ack (8)
+        self.assertEqual (nc.data.window (), 5)
+        # It never exceeds qmax
+        self.ack (self.qmax * 3)
+        self.assertLessEqual (nc.data.window (), self.qmax)
+
+    def test_nocongestion (self):
+        nc = self.nspconn
+        r = self.node.routing
+        self.accept ()
+        nc.setsockopt (rstssegbug = True)
+        nc.setsockopt (congestion = False)
+        # Options not mentioned are left alone
+        self.assertTrue (nc.rstssegbug)
+        nc.setsockopt (rstssegbug = False)
+        self.assertFalse (nc.rstssegbug)
+        self.assertFalse (nc.data.congctl)
+        for i in range (self.qmax * 2):
+            nc.send_data (byte (i))
+        DnTimeout (nc.data.rtxtimer)
+        self.assertEqual (nc.data.window (), self.qmax)
+        DnTimeout (nc.data.rtxtimer)
+        self.assertEqual (r.send.call_count, self.qmax + 3 + self.cdadj)
+        
+class test_fastrtx (inbound_base):
+    def test_nak (self):
+        nc = self.nspconn
+        lla = nc.srcaddr
+        r = self.node.routing
+        self.accept ()
+        for i in range (3):
+            nc.send_data (byte (i))
+        self.assertEqual (r.send.call_count, 4 + self.cdadj)
+        # NAK 1, meaning 1 is received but 2 is missing
+        ack = b"\x04" + lla.to_bytes (2, "little") + b"\x03\x00" + \
+              (1 + 0x9000).to_bytes (2, "little")
+        w = Received (owner = self.nsp, src = self.remnode,
+                      packet = ack, rts = False)
+        self.node.addwork (w)
+        # Segment 2 is resent right away, no timeout
+        self.assertEqual (len (nc.data.pending_ack), 2)
+        self.assertEqual (r.send.call_count, 5 + self.cdadj)
+        args, kwargs = r.send.call_args
+        d, dest = args
+        self.assertIsInstance (d, nsp.DataSeg)
+        self.assertEqual (d.payload, byte (1))
+        self.assertEqual (nc.data.fast_rtx, 1)
+        self.assertEqual (nc.destnode.counters.timeout, 0)
+        self.assertEqual (nc.data.pending_ack[0].tries, 2)
+        self.assertTrue (nc.data.rtxtimer.islinked ())
+        self.assertEqual (nc.get_api ()["data"]["fast_retransmits"], 1)
+        # NAK 2 acks segment 2 and resends segment 3
+        ack = b"\x04" + lla.to_bytes (2, "little") + b"\x03\x00" + \
+              (2 + 0x9000).to_bytes (2, "little")
+        w = Received (owner = self.nsp, src = self.remnode,
+                      packet = ack, rts = False)
+        self.node.addwork (w)
+        self.assertEqual (len (nc.data.pending_ack), 1)
+        self.assertEqual (r.send.call_count, 6 + self.cdadj)
+        self.assertEqual (nc.data.fast_rtx, 2)
+
+class test_ooo_limit (inbound_base):
+    qmax = 20
+    
+    def test_ooo_limit (self):
+        nc = self.nspconn
+        lla = nc.srcaddr
+        self.accept ()
+        # The cache holds up to qmax packets, and isn't allocated
+        # until it is needed.
+        self.assertEqual (nc.data.ooo.limit, 20)
+        self.assertIsNone (nc.data.ooo.slots)
+        # A packet just within the cache limit is held, one beyond is
+        # dropped.
+        for n in (nc.data.ooo.limit, nc.data.ooo.limit + 1):
+            d = b"\x60" + lla.to_bytes (2, "little") + \
+                b"\x03\x00" + n.to_bytes (2, "little") + b"data"
+            w = Received (owner = self.nsp, src = self.remnode,
+                          packet = d, rts = False)
+            self.node.addwork (w)
+        self.assertEqual (len (nc.data.ooo), 1)
+        self.assertEqual (nc.data.ooo_saved, 1)
+        self.assertEqual (nc.data.ooo_dropped, 1)
+        # Only one NAK for the gap
+        self.assertEqual (nc.data.naks_sent, 1)
+        self.assertEqual (len (nc.data.ooo.slots), 32)
+        
+class test_linkcounters (inbound_base):
+    qmax = 4
+
+    def test_counters (self):
+        nc = self.nspconn
+        lla = nc.srcaddr
+        self.accept ()
+        nc.setsockopt (congestion = False)
+        # Two messages, one of them two segments
+        nc.send_data (b"a" * (nc.segsize + 1))
+        nc.send_data (b"b")
+        c = nc.counters
+        self.assertEqual (c.msg_xmt, 2)
+        self.assertEqual (c.byt_xmt, nc.segsize + 2)
+        self.assertEqual (c.seg_xmt, 3)
+        self.assertEqual (c.stalls, 0)
+        # Fill the queue, the rest is blocked
+        for i in range (3):
+            nc.send_data (byte (i))
+        self.assertEqual (c.seg_xmt, self.qmax)
+        self.assertEqual (c.stalls, 1)
+        self.assertTrue (nc.data.stallstart)
+        # A timeout retransmits the first segment
+        DnTimeout (nc.data.rtxtimer)
+        self.assertEqual (c.timeout, 1)
+        self.assertEqual (c.rtx, 1)
+        # Ack everything sent, which lets the rest go and ends the
+        # stall
+        ack = b"\x04" + lla.to_bytes (2, "little") + b"\x03\x00" + \
+              (self.qmax + 0x8000).to_bytes (2, "little")
+        w = Received (owner = self.nsp, src = self.remnode,
+                      packet = ack, rts = False)
+        self.node.addwork (w)
+        self.assertEqual (c.seg_xmt, 6)
+        self.assertFalse (nc.data.stallstart)
+        self.assertGreater (c.stall_time, 0)
+        # Receive a message
+        d = b"\x60" + lla.to_bytes (2, "little") + \
+            b"\x03\x00\x01\x00data payload"
+        w = Received (owner = self.nsp, src = self.remnode,
+                      packet = d, rts = False)
+        self.node.addwork (w)
+        self.assertEqual (c.seg_rcv, 1)
+        self.assertEqual (c.msg_rcv, 1)
+        self.assertEqual (c.byt_rcv, 12)
+        api = nc.get_api ()
+        self.assertEqual (api["counters"]["seg_xmt"], 6)
+        self.assertEqual (api["counters"]["timeout"], 1)
+        self.assertIn ("rtt", api)
+        # The node counters are unchanged by this
+        self.assertEqual (nc.destnode.counters.msg_xmt, 5)
+
+class test_ackpolicy (inbound_base):
+    def data (self, num, dly = True):
+        lla = self.nspconn.srcaddr
+        seg = num + (0x1000 if dly else 0)
+        d = b"\x60" + lla.to_bytes (2, "little") + b"\x03\x00" + \
+            seg.to_bytes (2, "little") + b"data"
+        w = Received (owner = self.nsp, src = self.remnode,
+                      packet = d, rts = False)
+        self.node.addwork (w)
+
+    def interrupt (self, num):
+        lla = self.nspconn.srcaddr
+        d = b"\x30" + lla.to_bytes (2, "little") + b"\x03\x00" + \
+            num.to_bytes (2, "little") + b"int"
+        w = Received (owner = self.nsp, src = self.remnode,
+                      packet = d, rts = False)
+        self.node.addwork (w)
+        
+    def test_holdoff (self):
+        nc = self.nspconn
+        r = self.node.routing
+        self.accept ()
+        calls = r.send.call_count
+        # Default policy: several segments are covered by one ack
+        # when the holdoff expires.
+        for i in range (1, 4):
+            self.data (i)
+        self.assertEqual (r.send.call_count, calls)
+        DnTimeout (nc.data)
+        self.assertEqual (r.send.call_count, calls + 1)
+        ack, dest = self.lastsent (r, calls + 1, ptype = nsp.AckData)
+        self.assertEqual (ack.acknum, nsp.AckNum (3))
+        api = nc.get_api ()["data"]
+        self.assertEqual (api["acks_sent"], 1)
+        self.assertEqual (api["acks_coalesced"], 2)
+        # A pending ack goes out with outbound data instead.
+        self.data (4)
+        nc.send_data (b"reply")
+        ds, dest = self.lastsent (r, calls + 2, ptype = nsp.DataSeg)
+        self.assertEqual (ds.acknum, nsp.AckNum (4))
+        self.assertFalse (nc.data.islinked ())
+        api = nc.get_api ()["data"]
+        self.assertEqual (api["acks_piggybacked"], 1)
+        self.assertEqual (api["acks_saved"], 3)
+
+    def test_ackafter (self):
+        nc = self.nspconn
+        r = self.node.routing
+        self.accept ()
+        self.nsp.ackafter = 2
+        calls = r.send.call_count
+        self.data (1)
+        self.assertEqual (r.send.call_count, calls)
+        self.assertTrue (nc.data.islinked ())
+        # Second segment reaches the limit, ack right away
+        self.data (2)
+        ack, dest = self.lastsent (r, calls + 1, ptype = nsp.AckData)
+        self.assertEqual (ack.acknum, nsp.AckNum (2))
+        self.assertFalse (nc.data.islinked ())
+        self.assertEqual (nc.data.unacked, 0)
+        self.data (3)
+        self.assertEqual (r.send.call_count, calls + 1)
+        self.assertTrue (nc.data.islinked ())
+
+    def test_adaptive (self):
+        nc = self.nspconn
+        self.accept ()
+        self.assertEqual (nc.data.holdoff (), nc.data.HOLDOFF)
+        self.nsp.ackadaptive = True
+        nc.destnode.delay = 0.2
+        self.assertAlmostEqual (nc.data.holdoff (), 0.05)
+        nc.destnode.delay = 0.001
+        self.assertEqual (nc.data.holdoff (), nc.data.HOLDOFFMIN)
+        nc.destnode.delay = 5
+        self.assertEqual (nc.data.holdoff (), nc.data.HOLDOFF)
+
+    def test_piggyback (self):
+        nc = self.nspconn
+        r = self.node.routing
+        self.accept ()
+        calls = r.send.call_count
+        # By default an interrupt is acked right away
+        self.interrupt (1)
+        ack, dest = self.lastsent (r, calls + 1, ptype = nsp.AckOther)
+        self.assertEqual (ack.acknum, nsp.AckNum (1))
+        # With piggyback, it is held and then sent as a cross
+        # subchannel ack on the data reply.
+        self.nsp.piggyback = True
+        self.interrupt (2)
+        self.assertEqual (r.send.call_count, calls + 1)
+        self.assertTrue (nc.other.islinked ())
+        nc.send_data (b"reply")
+        ds, dest = self.lastsent (r, calls + 2, ptype = nsp.DataSeg)
+        self.assertEqual (ds.acknum2, nsp.AckNum (2, nsp.AckNum.XACK))
+        self.assertFalse (nc.other.islinked ())
+        api = nc.get_api ()["interrupt"]
+        self.assertEqual (api["acks_sent"], 1)
+        self.assertEqual (api["acks_piggybacked"], 1)
+        # If nothing goes out, the holdoff timer sends the ack
+        self.interrupt (3)
+        DnTimeout (nc.other)
+        ack, dest = self.lastsent (r, calls + 3, ptype = nsp.AckOther)
+        self.assertEqual (ack.acknum, nsp.AckNum (3))
+
+class test_srtt (inbound_base):
+    rtt_estimator = "srtt"
+
+    def test_srtt (self):
+        nc = self.nspconn
+        n = nc.destnode
+        self.accept ()
+        # The CC was acked, but that happened right away
+        srtt = n.srtt
+        self.assertLess (srtt, 0.1)
+        self.assertEqual (n.rttvar, srtt / 2)
+        self.assertEqual (nc.acktimeout (), 1)
+        # Start over, with no estimate.
+        n.srtt = n.rttvar = 0
+        self.assertEqual (nc.acktimeout (), 2)
+        # Send a segment, pretend it was sent 0.5 seconds ago
+        nc.send_data (b"one")
+        nc.data.pending_ack[0].txtime = time.time () - 0.5
+        self.ack (1)
+        self.assertAlmostEqual (n.srtt, 0.5, 2)
+        self.assertAlmostEqual (n.rttvar, 0.25, 2)
+        self.assertEqual (n.delay, n.srtt)
+        api = nc.get_api ()
+        self.assertEqual (api["srtt"], n.srtt)
+        self.assertEqual (api["rttvar"], n.rttvar)
+        rto = n.srtt + 4 * n.rttvar
+        self.assertAlmostEqual (api["rto"], rto)
+        # Retransmit timeouts back off exponentially
+        self.assertAlmostEqual (nc.acktimeout (1), rto * 2)
+        self.assertAlmostEqual (nc.acktimeout (2), rto * 4)
+        self.assertEqual (nc.acktimeout (10), nc.RTOMAX)
+        # A retransmitted packet is not used for a measurement
+        srtt, rttvar = n.srtt, n.rttvar
+        nc.send_data (b"two")
+        qe = nc.data.pending_ack[0]
+        DnTimeout (nc.data.rtxtimer)
+        self.assertEqual (qe.tries, 2)
+        qe.txtime = time.time () - 3
+        self.ack (2)
+        self.assertEqual (n.srtt, srtt)
+        self.assertEqual (n.rttvar, rttvar)
+        
 class test_connself_phase4 (ntest):
     info = b'\x02'       # Info, which carries NSP version in bits 0-1
     cdadj = 1            # Inbound packet adjustment because of CD
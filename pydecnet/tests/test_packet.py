@@ -166,6 +166,20 @@ class TestPacket (DnTest):
         with self.assertRaises (packet.ExtraData) as e:
             alltypes (testdata + b"x")
 
+    def test_parts (self):
+        # Nested packet as payload is encoded as its pieces, and a
+        # memoryview payload is not copied until the pieces are
+        # joined.
+        buf = b"payload data"
+        inner = allpayload (testdata, payload = memoryview (buf)[8:])
+        outer = allpayload (testdata, payload = inner)
+        parts = outer.encode_parts ()
+        self.assertIs (parts[-1].obj, buf)
+        self.assertEqual (b"".join (parts), bytes (outer))
+        self.assertEqual (bytes (outer), testdata2 * 2 + b"data")
+        self.assertEqual (len (outer), len (testdata2) * 2 + 4)
+        self.assertIn ("payload=b'data'", str (inner))
+
     def test_constfield (self):
         # Value defined in class is constant field
         class constimage (alltypes):
@@ -190,8 +190,10 @@ class test_end (lantest):
         # Original entry should be untouched
         self.assertEqual (self.c.prevhops[Nodeid (2, 1)].prevhop,
                           Macaddr (Nodeid (1, 2)))
-        # Expire a cache entry
-        DnTimeout (self.c.prevhops[Nodeid (2, 2)])
+        # Expire a cache entry, by making it look old and then
+        # starting a new cache epoch.
+        self.c.prevhops[Nodeid (2, 2)].epoch -= route_eth.NiCacheEntry.epochs
+        DnTimeout (self.c.cachetimer)
         # Only the other entry should remain
         self.assertEqual (len (self.c.prevhops), 1)
         self.assertEqual (self.c.prevhops[Nodeid (2, 1)].prevhop,
@@ -245,14 +247,57 @@ class test_end (lantest):
         self.c.send (pkt, None)
         p, dest = self.lastsent (self.cp, 5)
         self.assertEqual (dest, Macaddr (Nodeid (1, 1)))
-        # Expire the cache entry
-        DnTimeout (self.c.prevhops[Nodeid (1, 17)])
+        # Expire the cache entry.  It survives until it has been
+        # unused for more than the configured number of epochs.
+        for i in range (route_eth.NiCacheEntry.epochs):
+            DnTimeout (self.c.cachetimer)
+            self.assertTrue (self.c.prevhops)
+        DnTimeout (self.c.cachetimer)
         self.assertFalse (self.c.prevhops)
         # Send again, this should go to DR
         self.c.send (pkt, None)
         p, dest = self.lastsent (self.cp, 6)
         self.assertEqual (dest, Macaddr (Nodeid (1, 2)))
 
+    def test_cache_trim (self):
+        with unittest.mock.patch.object (route_eth.NiCacheEntry,
+                                         "cachemax", 2):
+            for i, src in enumerate ((17, 18, 17, 19)):
+                pkt = b"\x02\x05\x04" + bytes ([ src, 4 ]) + b"\x11payload"
+                self.node.addwork (Received (owner = self.c,
+                                             src = Macaddr ("aa:00:04:00:01:04"),
+                                             packet = pkt))
+                # New epoch after each packet
+                DnTimeout (self.c.cachetimer)
+            # 1.18 was least recently used so it was removed to make
+            # room for 1.19.
+            self.assertEqual (set (self.c.prevhops),
+                              { Nodeid (1, 17), Nodeid (1, 19) })
+
+    def test_cache_trim_epoch (self):
+        # Entries all used in the same epoch: only enough are removed
+        # to make room, oldest first.
+        with unittest.mock.patch.object (route_eth.NiCacheEntry,
+                                         "cachemax", 3):
+            for src in (17, 18, 19, 20):
+                pkt = b"\x02\x05\x04" + bytes ([ src, 4 ]) + b"\x11payload"
+                self.node.addwork (Received (owner = self.c,
+                                             src = Macaddr ("aa:00:04:00:01:04"),
+                                             packet = pkt))
+            self.assertEqual (set (self.c.prevhops),
+                              { Nodeid (1, 18), Nodeid (1, 19),
+                                Nodeid (1, 20) })
+
+    def test_stop (self):
+        pkt = b"\x02\x05\x04\x11\x04\x11payload"
+        self.node.addwork (Received (owner = self.c,
+                                     src = Macaddr ("aa:00:04:00:01:04"),
+                                     packet = pkt))
+        self.assertTrue (self.c.prevhops)
+        self.c.stop ()
+        self.node.timers.stop.assert_any_call (self.c.cachetimer)
+        self.assertFalse (self.c.prevhops)
+        
     def test_rnd (self):
         for i in range (rcount):
             pkt = randpkt (rmin, rmax)
@@ -617,6 +662,47 @@ class test_routing (lantest):
         self.assertFalse (self.c.isdr)
         self.assertEqual (self.c.dr, c)
     
+    def test_hello_cache (self):
+        self.rhello ()
+        a = self.c.adjacencies[Nodeid (1, 2)]
+        elist = self.c.helloelist
+        self.assertIsNotNone (elist)
+        self.assertIs (self.c.bestrtr, a)
+        self.assertTrue (a.listed)
+        # A repeat of the same hello changes nothing, and the periodic
+        # hello reuses the cached E-list.
+        pkt = b"\x0b\x02\x00\x01\xaa\x00\x04\x00\x02\x04\x02" \
+              b"\x10\x02\x40\x00\x80\x00\x00" \
+              b"\x0f\x00\x00\x00\x00\x00\x00\x00" \
+              b"\x07\xaa\x00\x04\x00\x05\x04\xa0"
+        self.node.addwork (Received (owner = self.c,
+                                   src = Macaddr ("aa:00:04:00:02:04"),
+                                   packet = pkt))
+        self.assertIs (self.c.helloelist, elist)
+        self.assertIs (self.c.bestrtr, a)
+        DnTimeout (self.c)
+        p, dest = self.lastsent (self.cp, 4)
+        self.assertIsInstance (p, RouterHello)
+        self.assertIs (p.elist, elist)
+        # Neighbor no longer lists us, so the adjacency drops back to
+        # init and the cached E-list is discarded.
+        pkt = b"\x0b\x02\x00\x01\xaa\x00\x04\x00\x02\x04\x02" \
+              b"\x10\x02\x40\x00\x80\x00\x00" \
+              b"\x08\x00\x00\x00\x00\x00\x00\x00\x00"
+        self.node.addwork (Received (owner = self.c,
+                                   src = Macaddr ("aa:00:04:00:02:04"),
+                                   packet = pkt))
+        self.assertEqual (a.state, route_eth.INIT)
+        self.assertFalse (a.listed)
+        self.assertIsNone (self.c.helloelist)
+        DnTimeout (self.c)
+        p, dest = self.lastsent (self.cp, 5)
+        rsent, rslist = RSent.decode (Elist (p.elist).rslist)
+        self.assertFalse (rslist)
+        self.assertEqual (rsent.router, Nodeid (1, 2))
+        self.assertFalse (rsent.twoway)
+        self.assertIsNotNone (self.c.helloelist)
+        
     def test_rhello_dr (self):
         self.assertFalse (self.c.adjacencies)
         pkt = b"\x0b\x02\x00\x01\xaa\x00\x04\x00\x02\x04\x02" \
@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 
+import os
+import json
+import tempfile
+
 from tests.dntest import *
 
 from decnet.routing_packets import *
 from decnet import routing
 from decnet import route_ptp
+from decnet import route_eth
 from decnet import datalink
 from decnet.node import Nodeinfo
 from decnet import logging
@@ -15,6 +20,8 @@ rmax = 40
     
 class rtest (DnTest):
     phase = 4
+    pathsplits = 1
+    checkpoint = None
     
     def setUp (self):
         super ().setUp ()
@@ -40,6 +47,9 @@ class rtest (DnTest):
         self.config.routing.maxcost = 20
         self.config.routing.amaxcost = 20
         self.config.routing.maxvisits = 30
+        self.config.routing.path_splits = self.pathsplits
+        self.config.routing.checkpoint = self.checkpoint
+        self.config.routing.checkpoint_interval = 60
         # No intercept
         self.config.routing.intercept = 0
         self.config.circuit = dict ()
@@ -888,6 +898,241 @@ class test_ph4l1a (rtest):
         self.assertEqual (w.src, Nodeid (1, 5))
         self.assertFalse (w.rts)
 
+class test_pacer (rtest):
+    ntype = "l2router"
+    circ = (( "ptp-0", False ),)
+
+    def setUp (self):
+        super ().setUp ()
+        # 8000 bits per second is 1000 bytes per second, and the
+        # token bucket holds one second worth.
+        self.p = routing.Pacer (self.c1, 8000)
+        self.d1.txbacklog.return_value = 0
+        self.d1.send.reset_mock ()
+        
+    def test_bucket (self):
+        p = self.p
+        p.queue (self.c1.update, [ b"x" * 400 ] * 4, False)
+        # Three fit, the third takes the bucket negative
+        self.assertEqual (self.d1.send.call_count, 3)
+        self.assertEqual (len (p.pending), 1)
+        self.assertAlmostEqual (p.tokens, -200, delta = 5)
+        # Pretend 0.3 seconds have passed
+        p.last -= 0.3
+        DnTimeout (p)
+        self.assertEqual (self.d1.send.call_count, 4)
+        self.assertEqual (len (p.pending), 0)
+        pkt, dest = self.lastsent (self.d1, 4, ptype = bytes)
+        self.assertEqual (dest, route_eth.ALL_ROUTERS)
+
+    def test_backlog (self):
+        p = self.p
+        self.d1.txbacklog.return_value = 3
+        p.queue (self.c1.update, [ b"x" * 100 ], False)
+        self.assertEqual (self.d1.send.call_count, 0)
+        # Still backlogged but not yet for long enough
+        DnTimeout (p)
+        self.assertEqual (self.d1.send.call_count, 0)
+        # Backlog cleared
+        self.d1.txbacklog.return_value = 0
+        DnTimeout (p)
+        self.assertEqual (self.d1.send.call_count, 1)
+        # Persistent backlog eventually lets routing through
+        self.d1.txbacklog.return_value = 3
+        p.queue (self.c1.update, [ b"y" * 100 ], False)
+        self.assertEqual (self.d1.send.call_count, 1)
+        p.deferred -= T2
+        DnTimeout (p)
+        pkt, dest = self.lastsent (self.d1, 2, ptype = bytes)
+        self.assertEqual (pkt, b"y" * 100)
+        # While the backlog lasts, routing messages are no longer
+        # held back.
+        p.queue (self.c1.update, [ b"z" * 100 ] * 2, False)
+        pkt, dest = self.lastsent (self.d1, 4, ptype = bytes)
+        self.assertEqual (pkt, b"z" * 100)
+        # Once it clears, the next backlog holds them back again
+        self.d1.txbacklog.return_value = 0
+        p.queue (self.c1.update, [ b"a" ], False)
+        self.assertEqual (self.d1.send.call_count, 5)
+        self.d1.txbacklog.return_value = 3
+        p.queue (self.c1.update, [ b"b" ], False)
+        self.assertEqual (self.d1.send.call_count, 5)
+        
+    def test_stop (self):
+        p = self.p
+        self.d1.txbacklog.return_value = 3
+        p.queue (self.c1.update, [ b"x" * 100 ] * 2, False)
+        self.assertEqual (len (p.pending), 2)
+        self.c1.pacer = p
+        self.c1.flush_pacer ()
+        self.assertEqual (len (p.pending), 0)
+        self.assertIsNone (p.deferred)
+        self.node.timers.stop.assert_called_with (p)
+        
+
+    def test_supersede (self):
+        p = self.p
+        p.tokens = p.depth = 0
+        u1 = self.c1.update
+        u2 = self.c1.aupdate
+        p.queue (u1, [ b"a", b"b" ], False)
+        p.queue (u2, [ b"c" ], False)
+        p.queue (u1, [ b"d" ], True)
+        self.assertEqual (self.d1.send.call_count, 0)
+        self.assertEqual ([ x for u, x in p.pending ], [ b"c", b"d" ])
+        
+class splitbase (rtest):
+    ntype = "l1router"
+    circ = (( "ptp-0", False ),
+            ( "ptp-1", False ))
+    
+    def setUp (self):
+        super ().setUp ()
+        # Bring up L1 router adjacencies to 1.2 on ptp-0 and 1.3 on
+        # ptp-1.
+        for c, n in ((self.c1, 2), (self.c2, 3)):
+            self.node.addwork (datalink.DlStatus (owner = c,
+                                                  status = datalink.DlStatus.UP))
+            pkt = bytes ([ 1, n, 4, 2, 0x10, 2, 2, 0, 0, 10, 0, 0 ])
+            self.node.addwork (Received (owner = c, src = c, packet = pkt))
+            self.assertEqual (c.state.__name__, "ru4l1")
+        # Nodes 10 through 17 are reachable via both neighbors at
+        # equal cost; node 20 is closer via 1.3.
+        for ri, c20 in ((self.c1.adj.routeinfo, 5), (self.c2.adj.routeinfo, 4)):
+            for i in range (10, 18):
+                ri.hops[i] = 2
+                ri.cost[i] = 4
+            ri.hops[20] = 2
+            ri.cost[20] = c20
+        self.r.route (10, 20)
+
+    def sendall (self):
+        for i in range (10, 18):
+            self.r.send (b"payload", Nodeid (1, i))
+        return (self.c1.datalink.counters.orig_sent,
+                self.c2.datalink.counters.orig_sent)
+
+class test_pathsplit (splitbase):
+    pathsplits = 2
+    
+    def test_split (self):
+        self.assertEqual (self.r.opaths[10], (self.c1.adj, self.c2.adj))
+        self.assertIsNone (self.r.opaths[20])
+        self.assertEqual (self.r.mincost[10], 4)
+        c1, c2 = self.sendall ()
+        # Both paths carry some of the traffic
+        self.assertEqual (c1 + c2, 8)
+        self.assertNotEqual (c1, 0)
+        self.assertNotEqual (c2, 0)
+        # A given flow always takes the same path
+        self.assertEqual (self.sendall (), (2 * c1, 2 * c2))
+        # Single path destination
+        self.r.send (b"payload", Nodeid (1, 20))
+        self.assertEqual (self.c2.datalink.counters.orig_sent, 2 * c2 + 1)
+        # Take one path away
+        ri = self.c1.adj.routeinfo
+        for i in range (10, 18):
+            ri.cost[i] = 6
+        self.r.route (10, 17)
+        self.assertIsNone (self.r.opaths[10])
+        self.assertEqual (self.sendall (), (2 * c1, 2 * c2 + 9))
+
+class test_nopathsplit (splitbase):
+    pathsplits = 1
+
+    def test_split (self):
+        self.assertIsNone (self.r.opaths[10])
+        c1, c2 = self.sendall ()
+        self.assertEqual (c1 + c2, 8)
+        self.assertTrue (c1 == 0 or c2 == 0)
+        
+class test_warmstart (splitbase):
+    def setUp (self):
+        self.tempdir = tempfile.TemporaryDirectory ()
+        self.checkpoint = os.path.join (self.tempdir.name, "ckpt")
+        super ().setUp ()
+        # Make a checkpoint of the routing state
+        self.r.checkpoint.save ()
+        self.r2 = None
+        
+    def tearDown (self):
+        if self.r2:
+            self.r2.stop ()
+        super ().tearDown ()
+        self.tempdir.cleanup ()
+
+    def restart (self):
+        # Start a new routing layer instance, as after a restart, and
+        # bring up the adjacency on ptp-0 again.
+        self.r2 = routing.Router (self, self.config)
+        self.r2.start ()
+        c = self.r2.circuits["ptp-0"]
+        self.node.addwork (datalink.DlStatus (owner = c,
+                                              status = datalink.DlStatus.UP))
+        pkt = bytes ([ 1, 2, 4, 2, 0x10, 2, 2, 0, 0, 10, 0, 0 ])
+        self.node.addwork (Received (owner = c, src = c, packet = pkt))
+        self.assertEqual (c.state.__name__, "ru4l1")
+        return c
+    
+    def test_save (self):
+        with open (self.checkpoint, "rt") as f:
+            d = json.load (f)
+        self.assertEqual (d["id"], int (Nodeid (1, 5)))
+        self.assertEqual (len (d["adjacencies"]), 2)
+        self.assertEqual (d["l1"]["ptp-0 1026"][1][10], 4)
+        self.assertEqual (d["mincost"][10], 4)
+        self.assertEqual (d["mincost"][20], 4)
+        
+    def test_warm (self):
+        rc = self.eventcount (events.reach_chg)
+        c = self.restart ()
+        r2 = self.r2
+        self.assertIsNotNone (r2.warm)
+        # Routes via the neighbor are available right away, and
+        # their return isn't logged.
+        self.assertTrue (c.adj.routeinfo.provisional)
+        self.assertIs (r2.oadj[10], c.adj)
+        self.assertEqual (r2.mincost[20], 5)
+        self.assertEqual (self.eventcount (events.reach_chg), rc)
+        # A routing message from the neighbor replaces the
+        # provisional data, but only for the destinations it covers.
+        w = L1Routing (srcnode = Nodeid (1, 2))
+        w.src = c.adj
+        w.segments = [ L1Segment (count = 1, startid = 10,
+                                  entries = [ 3 ]) ]
+        r2.routemsg (w, c.adj.routeinfo, r2.route, r2.maxnodes)
+        self.assertNotIn (10, c.adj.routeinfo.provisional)
+        self.assertIn (20, c.adj.routeinfo.provisional)
+        self.assertEqual (r2.mincost[20], 5)
+        # End of the warm restart period.  The route that was
+        # confirmed stays, the other one is discarded.
+        DnTimeout (r2.warm)
+        self.assertIsNone (r2.warm)
+        self.assertFalse (c.adj.routeinfo.provisional)
+        self.assertIs (r2.oadj[10], c.adj)
+        self.assertFalse (r2.oadj[20])
+        self.assertEqual (r2.mincost[20], INFCOST)
+        
+    def test_aging (self):
+        c = self.restart ()
+        r2 = self.r2
+        self.assertIs (r2.oadj[10], c.adj)
+        # No routing message, so the provisional data is discarded at
+        # the end of the warm restart period.
+        DnTimeout (r2.warm)
+        self.assertFalse (r2.oadj[10])
+        self.assertEqual (r2.mincost[10], INFCOST)
+
+    def test_stale (self):
+        with open (self.checkpoint, "rt") as f:
+            d = json.load (f)
+        d["time"] -= 1000
+        with open (self.checkpoint, "wt") as f:
+            json.dump (d, f)
+        c = self.restart ()
+        self.assertIsNone (self.r2.warm)
+        self.assertFalse (self.r2.oadj[10])
+        
 class test_random (rtest):
     ntype = "endnode"
     circ = (( "lan-0", True ),)